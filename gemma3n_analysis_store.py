@@ -0,0 +1,95 @@
+"""
+Gemma 3n Analysis Store
+SQLite-backed store of code analysis results for incremental re-analysis
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from gemma3n_cache import make_cache_key
+
+DEFAULT_STORE_PATH = Path(".gemma3n") / "analysis.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+)
+"""
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", "replace")).hexdigest()
+
+class AnalysisStore:
+    """Results keyed by content hash, prompt template version and model"""
+
+    def __init__(self, path: Path = DEFAULT_STORE_PATH, prompt_version: str = "1"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.prompt_version = prompt_version
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Shared by the analysis worker threads; access is serialized by _lock
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+
+    def key(self, kind: str, content: str, context: str, model: str) -> str:
+        return make_cache_key(kind, content_hash(content), context, self.prompt_version, model)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a stored result and mark it as used, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM analyses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE analyses SET last_used_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, kind: str, content: str, model: str, result: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, content_hash(content), self.prompt_version, model, result, now, now)
+            )
+            self._conn.commit()
+
+    def prune(self, max_age_days: Optional[float] = None) -> int:
+        """Delete entries from older prompt versions and, optionally, ones unused for max_age_days"""
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM analyses WHERE prompt_version != ?", (self.prompt_version,)
+            ).rowcount
+            if max_age_days is not None:
+                cutoff = time.time() - max_age_days * 86400
+                deleted += self._conn.execute(
+                    "DELETE FROM analyses WHERE last_used_at < ?", (cutoff,)
+                ).rowcount
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+            return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "path": str(self.path)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,298 @@
+"""
+Gemma 3n Async Ollama Client
+asyncio client for high fan-out workloads: many concurrent requests on one thread
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from gemma3n_client import DEFAULT_KEEP_ALIVE, DEFAULT_OLLAMA_URL, OllamaError, OllamaPayloads, get_client
+from gemma3n_metrics import MetricsRecorder, get_metrics, server_timings
+from gemma3n_singleflight import COALESCED_PATHS, AsyncSingleFlight, request_key
+
+# Requests sent at once; the rest wait on the semaphore instead of piling up on the server
+DEFAULT_MAX_CONCURRENCY = 8
+# Seconds; the read timeout applies between received chunks, so long streams are fine
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 300
+RETRY_STATUSES = (500, 502, 503, 504)
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Everything a failed call can raise; callers turn these into "Error: ..." results
+ASYNC_REQUEST_ERRORS = (httpx.HTTPError, OllamaError, asyncio.TimeoutError)
+
+def _is_failover_error(error: Exception) -> bool:
+    """Errors worth retrying on another server of a pool: connection problems and 5xx responses.
+
+    The caller's own timeout is not one: its budget is spent whichever server runs the retry.
+    """
+    if isinstance(error, OllamaError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+class AsyncOllamaClient(OllamaPayloads):
+    """httpx.AsyncClient wrapper with the same request methods as OllamaClient.
+
+    A semaphore bounds the requests in flight, so callers can create thousands
+    of tasks without overloading the server; each waits for a slot. timeout
+    (seconds) bounds a whole non-streaming request: on expiry the request is
+    cancelled, its connection closed, and asyncio.TimeoutError raised. Streams
+    hold their slot until the iterator is exhausted or closed.
+
+    A comma-separated base_url spreads requests over those servers: each one
+    goes to the backend the BackendPool from get_client() would choose, with
+    the same health and load state, and fails over to the next on connection
+    or server errors.
+    """
+
+    def __init__(self, base_url: str = DEFAULT_OLLAMA_URL, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 timeout: Optional[float] = None, max_retries: int = 3, backoff_factor: float = 0.5,
+                 keep_alive: Optional[str] = DEFAULT_KEEP_ALIVE, metrics: Optional[MetricsRecorder] = None,
+                 coalesce: bool = True):
+        urls = [url.strip().rstrip("/") for url in base_url.split(",") if url.strip()]
+        self.base_url = ",".join(urls)
+        # Routing and health state are shared with the synchronous pool for the same URLs
+        self.pool = get_client(self.base_url) if len(urls) > 1 else None
+        self.timeout = timeout
+        # As in BackendPool, failover replaces most of the per-server retries
+        self.max_retries = max_retries if self.pool is None else min(max_retries, 1)
+        self.backoff_factor = backoff_factor
+        self.keep_alive = keep_alive
+        self.metrics = metrics or get_metrics()
+        # Identical non-streaming generations awaited at the same time share one request
+        self.single_flight = AsyncSingleFlight() if coalesce else None
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._backends = {url: httpx.AsyncClient(
+            base_url=url,
+            timeout=httpx.Timeout(DEFAULT_READ_TIMEOUT, connect=DEFAULT_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=max(1, max_concurrency),
+                                max_keepalive_connections=max(1, max_concurrency)),
+        ) for url in urls}
+        self._http = self._backends[urls[0]]
+
+    async def __aenter__(self) -> "AsyncOllamaClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def _record(self, path: str, payload: Dict[str, Any], started: float, status: str,
+                backend: Optional[str] = None, **fields):
+        self.metrics.record(path, payload.get("model", ""), status, backend=backend or self.base_url,
+                            total_ms=(time.perf_counter() - started) * 1000, **fields)
+
+    def _acquire(self, payload: Dict[str, Any], tried: set):
+        """The pool backend for the next attempt, or None once every backend has been tried"""
+        return self.pool._acquire(payload.get("model", ""), tried, None)
+
+    def _release(self, backend, started: float, error: Optional[BaseException] = None):
+        failover = error is not None and _is_failover_error(error)
+        self.pool._release(backend, started, error, failover=failover)
+
+    @staticmethod
+    def _encode(payload: Dict[str, Any]):
+        """JSON-encode a payload, returning the body and the encode timings like OllamaClient._send"""
+        started = time.perf_counter()
+        data = json.dumps(payload)
+        return data, {"encode_ms": (time.perf_counter() - started) * 1000, "request_bytes": len(data)}
+
+    async def _with_retries(self, send):
+        """Await send(), retrying connection failures and 5xx responses with exponential backoff"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await send()
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+
+    async def post(self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """POST a JSON payload and return the decoded JSON response"""
+        if self.single_flight is None or path not in COALESCED_PATHS:
+            return await self._post(path, payload, timeout)
+        body, shared = await self.single_flight.do(request_key(path, payload),
+                                                   lambda: self._post(path, payload, timeout))
+        if shared:
+            self.metrics.record(path, payload.get("model", ""), "coalesced", backend=self.base_url)
+        return body
+
+    async def _post(self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        timeout = timeout if timeout is not None else self.timeout
+        async with self._semaphore:
+            if self.pool is None:
+                return await self._post_to(self.base_url, path, payload, timeout)
+            tried = set()
+            last_error: Optional[Exception] = None
+            while True:
+                backend = self._acquire(payload, tried)
+                if backend is None:
+                    raise last_error
+                tried.add(backend)
+                started = time.monotonic()
+                try:
+                    body = await self._post_to(backend.url, path, payload, timeout)
+                except ASYNC_REQUEST_ERRORS as e:
+                    self._release(backend, started, e)
+                    if not _is_failover_error(e):
+                        raise
+                    last_error = e
+                    continue
+                except asyncio.CancelledError as e:
+                    self._release(backend, started, e)
+                    raise
+                self._release(backend, started)
+                return body
+
+    async def _post_to(self, url: str, path: str, payload: Dict[str, Any], timeout: Optional[float]) -> Dict[str, Any]:
+        http = self._backends[url]
+        started = time.perf_counter()
+        data, timings = self._encode(payload)
+        try:
+            sent = time.perf_counter()
+            response = await asyncio.wait_for(
+                self._with_retries(lambda: http.post(path, content=data, headers=JSON_HEADERS)), timeout)
+            timings["network_ms"] = (time.perf_counter() - sent) * 1000
+            response.raise_for_status()
+            decode_started = time.perf_counter()
+            body = response.json()
+            timings["decode_ms"] = (time.perf_counter() - decode_started) * 1000
+        except ASYNC_REQUEST_ERRORS:
+            self._record(path, payload, started, "error", url, **timings)
+            raise
+        except asyncio.CancelledError:
+            self._record(path, payload, started, "cancelled", url, **timings)
+            raise
+        self._record(path, payload, started, "ok", url, **timings, **server_timings(body))
+        return body
+
+    async def stream_lines(self, path: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """POST a streaming request and yield each decoded NDJSON object as it arrives.
+
+        Closing the iterator early (break, aclose() or task cancellation) closes
+        the connection, which makes Ollama stop generating. With several servers
+        a stream fails over only until its first chunk has been yielded.
+        """
+        async with self._semaphore:
+            if self.pool is None:
+                lines = self._stream_from(self.base_url, path, payload)
+                try:
+                    async for chunk in lines:
+                        yield chunk
+                finally:
+                    await lines.aclose()
+                return
+            tried = set()
+            last_error: Optional[Exception] = None
+            while True:
+                backend = self._acquire(payload, tried)
+                if backend is None:
+                    raise last_error
+                tried.add(backend)
+                started = time.monotonic()
+                lines = self._stream_from(backend.url, path, payload)
+                yielded = False
+                error = None
+                try:
+                    async for chunk in lines:
+                        yielded = True
+                        yield chunk
+                    return
+                except ASYNC_REQUEST_ERRORS as e:
+                    error = e
+                    # Text already shown to the caller cannot be replayed on another node
+                    if yielded or not _is_failover_error(e):
+                        raise
+                    last_error = e
+                finally:
+                    await lines.aclose()
+                    self._release(backend, started, error)
+
+    async def _stream_from(self, url: str, path: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        http = self._backends[url]
+        started = time.perf_counter()
+        data, timings = self._encode(payload)
+        decode_s = 0.0
+        status = "cancelled"
+        final = {}
+        try:
+            request = http.build_request("POST", path, content=data, headers=JSON_HEADERS)
+            sent = time.perf_counter()
+            response = await self._with_retries(lambda: http.send(request, stream=True))
+            # Time to response headers, as for the synchronous client's streams
+            timings["network_ms"] = (time.perf_counter() - sent) * 1000
+            try:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    decode_started = time.perf_counter()
+                    chunk = json.loads(line)
+                    decode_s += time.perf_counter() - decode_started
+                    if "error" in chunk:
+                        raise OllamaError(chunk["error"])
+                    if "ttft_ms" not in timings and (chunk.get("response") or
+                                                     chunk.get("message", {}).get("content")):
+                        timings["ttft_ms"] = (time.perf_counter() - started) * 1000
+                    yield chunk
+                    if chunk.get("done"):
+                        status, final = "ok", chunk
+                        break
+            finally:
+                await response.aclose()
+        except ASYNC_REQUEST_ERRORS:
+            status = "error"
+            raise
+        finally:
+            timings["decode_ms"] = decode_s * 1000
+            self._record(path, payload, started, status, url, **timings, **server_timings(final))
+
+    async def generate(self, model: str, prompt: str, images: Optional[List[str]] = None,
+                       options: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Run a non-streaming /api/generate call and return the full response body"""
+        return await self.post("/api/generate", self._generate_payload(model, prompt, images, options, False),
+                               timeout)
+
+    async def generate_stream(self, model: str, prompt: str, images: Optional[List[str]] = None,
+                              options: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Run a streaming /api/generate call, yielding text fragments as they are produced"""
+        lines = self.stream_lines("/api/generate", self._generate_payload(model, prompt, images, options, True))
+        try:
+            async for chunk in lines:
+                if chunk.get("response"):
+                    yield chunk["response"]
+        finally:
+            await lines.aclose()
+
+    async def chat(self, model: str, messages: List[Dict[str, Any]], options: Optional[Dict[str, Any]] = None,
+                   timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Run a non-streaming /api/chat call and return the full response body"""
+        return await self.post("/api/chat", self._chat_payload(model, messages, options, False), timeout)
+
+    def chat_stream(self, model: str, messages: List[Dict[str, Any]],
+                    options: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Run a streaming /api/chat call, yielding each chunk; the last one carries the timings"""
+        return self.stream_lines("/api/chat", self._chat_payload(model, messages, options, True))
+
+    async def embed(self, model: str, text: str) -> List[float]:
+        """Return the embedding vector for text (/api/embeddings)"""
+        return (await self.post("/api/embeddings", self._embed_payload(model, text)))["embedding"]
+
+    async def list_models(self) -> List[Dict[str, Any]]:
+        """Return the models installed on the server (/api/tags); the first one of several"""
+        response = await self._http.get("/api/tags")
+        response.raise_for_status()
+        return response.json().get("models", [])
+
+    async def aclose(self):
+        for http in self._backends.values():
+            await http.aclose()
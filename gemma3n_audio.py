@@ -0,0 +1,220 @@
+"""
+Gemma 3n Audio Ingestion
+Decode uploaded audio to 16 kHz mono, split it into encoder-sized windows and process them concurrently
+"""
+
+import base64
+import io
+import shutil
+import subprocess
+import threading
+import wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import requests
+
+from gemma3n_stt import resample_pcm
+
+TARGET_SAMPLE_RATE = 16000
+# Gemma 3n's audio encoder takes clips of up to 30 seconds
+DEFAULT_WINDOW_S = 30
+# Window boundaries move to the quietest point within this many seconds of the limit
+CUT_SEARCH_S = 2
+READ_BLOCK_BYTES = TARGET_SAMPLE_RATE * 2
+
+def _ffmpeg_pcm_blocks(data: bytes) -> Iterator[bytes]:
+    """Decode with ffmpeg as a stream, so only a block of PCM is held at a time"""
+    process = subprocess.Popen(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-ar", str(TARGET_SAMPLE_RATE), "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+    def feed():
+        try:
+            process.stdin.write(data)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+
+    # Writing from another thread avoids a deadlock when both pipe buffers fill up
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    try:
+        while True:
+            block = process.stdout.read(READ_BLOCK_BYTES)
+            if not block:
+                break
+            yield block
+    finally:
+        process.stdout.close()
+        writer.join()
+        if process.wait() != 0:
+            raise ValueError(f"Could not decode audio: {process.stderr.read().decode(errors='replace').strip()}")
+
+def decode_audio(data: bytes, file_name: str = "") -> bytes:
+    """Decode a whole file to 16 kHz mono 16-bit PCM with pydub, falling back to librosa"""
+    try:
+        from pydub import AudioSegment
+        audio = AudioSegment.from_file(io.BytesIO(data), format=Path(file_name).suffix.lstrip(".") or None)
+        return audio.set_frame_rate(TARGET_SAMPLE_RATE).set_channels(1).set_sample_width(2).raw_data
+    except Exception:
+        import librosa
+        samples, _ = librosa.load(io.BytesIO(data), sr=TARGET_SAMPLE_RATE, mono=True)
+        return (np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes()
+
+def _wav_pcm_blocks(data: bytes) -> Iterator[bytes]:
+    """Stream a 16-bit PCM WAV file without any decoder dependency"""
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        channels = wav.getnchannels()
+        rate = wav.getframerate()
+        frames_per_block = rate
+        while True:
+            block = wav.readframes(frames_per_block)
+            if not block:
+                return
+            if channels > 1:
+                samples = np.frombuffer(block, dtype=np.int16).reshape(-1, channels)
+                block = samples.mean(axis=1).astype(np.int16).tobytes()
+            yield resample_pcm(block, rate, TARGET_SAMPLE_RATE)
+
+def _is_pcm16_wav(data: bytes) -> bool:
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            return wav.getsampwidth() == 2
+    except (wave.Error, EOFError):
+        return False
+
+def iter_pcm_blocks(data: bytes, file_name: str = "") -> Iterator[bytes]:
+    """16 kHz mono PCM in blocks; streamed for PCM WAV files and whenever ffmpeg is installed"""
+    if _is_pcm16_wav(data):
+        yield from _wav_pcm_blocks(data)
+        return
+    if shutil.which("ffmpeg"):
+        yield from _ffmpeg_pcm_blocks(data)
+        return
+    pcm = decode_audio(data, file_name)
+    for start in range(0, len(pcm), READ_BLOCK_BYTES):
+        yield pcm[start:start + READ_BLOCK_BYTES]
+
+def _quietest_cut(pcm: bytes, search_bytes: int, frame_bytes: int = 640) -> int:
+    """Byte offset of the lowest-energy 20 ms frame within the last search_bytes"""
+    start = max(0, len(pcm) - search_bytes)
+    start -= start % 2
+    samples = np.frombuffer(pcm[start:], dtype=np.int16).astype(np.float32)
+    frame_samples = frame_bytes // 2
+    count = len(samples) // frame_samples
+    if count < 2:
+        return len(pcm)
+    energy = (samples[:count * frame_samples].reshape(count, frame_samples) ** 2).mean(axis=1)
+    return start + int(np.argmin(energy)) * frame_bytes
+
+def iter_windows(blocks: Iterator[bytes], window_s: float = DEFAULT_WINDOW_S,
+                 sample_rate: int = TARGET_SAMPLE_RATE) -> Iterator[Dict]:
+    """Group PCM blocks into windows of at most window_s, cut at quiet points.
+
+    Yields {"index", "start_s", "duration_s", "pcm"}; at most one window plus a
+    block is buffered, however long the recording is.
+    """
+    window_bytes = int(window_s * sample_rate) * 2
+    search_bytes = int(min(CUT_SEARCH_S, window_s / 4) * sample_rate) * 2
+    buffer = b""
+    offset_bytes = 0
+    index = 0
+    for block in blocks:
+        buffer += block
+        while len(buffer) >= window_bytes:
+            cut = _quietest_cut(buffer[:window_bytes], search_bytes) or window_bytes
+            yield {"index": index, "start_s": offset_bytes / 2 / sample_rate,
+                   "duration_s": cut / 2 / sample_rate, "pcm": buffer[:cut]}
+            index += 1
+            offset_bytes += cut
+            buffer = buffer[cut:]
+    if buffer:
+        yield {"index": index, "start_s": offset_bytes / 2 / sample_rate,
+               "duration_s": len(buffer) / 2 / sample_rate, "pcm": buffer}
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = TARGET_SAMPLE_RATE) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+def process_audio(data: bytes, file_name: str, handle_window: Callable[[Dict], str],
+                  workers: int = 2, window_s: float = DEFAULT_WINDOW_S,
+                  progress: Optional[Callable[[int], None]] = None) -> List[Dict]:
+    """Run handle_window on every window concurrently, returning results in order.
+
+    Decoding runs ahead of the workers by at most `workers` windows, so memory
+    stays bounded by the window size regardless of the recording length.
+    """
+    results = []
+
+    def run(window):
+        try:
+            text = handle_window(window)
+        except Exception as e:
+            text = f"Error: {str(e)}"
+        return {"index": window["index"], "start_s": window["start_s"],
+                "duration_s": window["duration_s"], "text": text}
+
+    def collect(future):
+        results.append(future.result())
+        if progress:
+            progress(len(results))
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for window in iter_windows(iter_pcm_blocks(data, file_name), window_s):
+            if len(pending) >= max(1, workers):
+                collect(pending.popleft())
+            pending.append(executor.submit(run, window))
+        while pending:
+            collect(pending.popleft())
+    return results
+
+def stt_handler(engine) -> Callable[[Dict], str]:
+    """Window handler that transcribes locally with a gemma3n_stt engine"""
+    return lambda window: engine.transcribe(window["pcm"])
+
+def chat_audio_handler(base_url: str, model: str, api_key: Optional[str] = None,
+                       instruction: str = "Transcribe this audio verbatim.") -> Callable[[Dict], str]:
+    """Window handler for an OpenAI-compatible /v1/chat/completions server that accepts audio input"""
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    url = f"{base_url.rstrip('/')}/v1/chat/completions"
+    session = requests.Session()
+
+    def handle(window):
+        audio = base64.b64encode(pcm_to_wav(window["pcm"])).decode()
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": [
+                {"type": "input_audio", "input_audio": {"data": audio, "format": "wav"}},
+                {"type": "text", "text": instruction},
+            ]}],
+        }
+        response = session.post(url, headers=headers, json=payload, timeout=(5, 300))
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"].strip()
+
+    return handle
+
+def format_timestamp(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+def format_transcript(results: List[Dict]) -> str:
+    """Timestamped transcript of the processed windows, skipping silent and failed ones"""
+    return "\n".join(
+        f"[{format_timestamp(r['start_s'])}] {r['text']}"
+        for r in results if r["text"].strip() and not r["text"].startswith("Error:")
+    )
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+Gemma 3n Benchmark
+Offline throughput benchmarks against a local mock of the Ollama API
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+
+from gemma3n_async_client import AsyncOllamaClient
+from gemma3n_client import get_client
+from gemma3n_coding_agent import Gemma3nCodingAgent
+from gemma3n_conversation import ChatSession
+from gemma3n_document_analyzer import DocumentAnalyzer, PdfPageSource
+from gemma3n_metrics import get_metrics
+
+DEFAULT_MODEL = "gemma3n:e4b"
+EMBEDDING_DIMENSIONS = 768
+WORDS = ("the model reads each page and reports key points dates names totals and open questions "
+         "about the document in a short structured answer").split()
+
+class MockConfig:
+    """Behaviour of the mock server; rates and latencies roughly match a mid-range GPU"""
+
+    def __init__(self, latency_ms: float = 150, tokens_per_s: float = 400, response_tokens: int = 64,
+                 parallel: int = 4, error_rate: float = 0.0, error_status: int = 500,
+                 stream_error_rate: float = 0.0, load_ms: float = 0, models: Optional[List[str]] = None,
+                 seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.tokens_per_s = tokens_per_s
+        self.response_tokens = response_tokens
+        # Requests processed at once, like OLLAMA_NUM_PARALLEL; the rest wait for a slot
+        self.parallel = parallel
+        # Fraction of requests answered with error_status before any work is done
+        self.error_rate = error_rate
+        self.error_status = error_status
+        # Fraction of streams that fail halfway with an {"error": ...} chunk
+        self.stream_error_rate = stream_error_rate
+        # Reported once as load_duration, as if the model was loaded on the first request
+        self.load_ms = load_ms
+        self.models = models or [DEFAULT_MODEL, "gemma3n:e2b", "nomic-embed-text"]
+        self.seed = seed
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/api/tags":
+            self._send_json(404, {"error": "not found"})
+            return
+        self._send_json(200, {"models": [{"name": name, "model": name} for name in self.server.config.models]})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        config = self.server.config
+        if self.path == "/api/embeddings":
+            self._send_json(200, {"embedding": mock_embedding(payload.get("prompt", ""))})
+            return
+        if self.path not in ("/api/generate", "/api/chat"):
+            self._send_json(404, {"error": "not found"})
+            return
+        if self.server.chance(config.error_rate):
+            self._send_json(config.error_status, {"error": "injected failure"})
+            return
+
+        with self.server.slots:
+            try:
+                self._generate(payload, config)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up, as a cancelled or timed-out request does
+                self.close_connection = True
+
+    def _generate(self, payload: Dict[str, Any], config: MockConfig):
+        started = time.perf_counter()
+        chat = self.path == "/api/chat"
+        prompt = json.dumps(payload.get("messages")) if chat else payload.get("prompt", "")
+        prompt_tokens = max(1, len(prompt) // 4) + 258 * len(payload.get("images") or [])
+        time.sleep(config.latency_ms / 1000)
+        prompt_done = time.perf_counter()
+
+        tokens = [WORDS[i % len(WORDS)] + " " for i in range(config.response_tokens)]
+        token_s = 1 / config.tokens_per_s if config.tokens_per_s else 0
+        fail_at = len(tokens) // 2 if payload.get("stream", True) and self.server.chance(config.stream_error_rate) else None
+
+        def chunk(text: str, done: bool = False) -> Dict[str, Any]:
+            body = {"model": payload.get("model", ""), "done": done}
+            if chat:
+                body["message"] = {"role": "assistant", "content": text}
+            else:
+                body["response"] = text
+            if done:
+                now = time.perf_counter()
+                body.update({
+                    "total_duration": int((now - started) * 1e9),
+                    "load_duration": int(self.server.take_load_ms() * 1e6),
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int((prompt_done - started) * 1e9),
+                    "eval_count": len(tokens),
+                    "eval_duration": int((now - prompt_done) * 1e9),
+                })
+            return body
+
+        if not payload.get("stream", True):
+            time.sleep(token_s * len(tokens))
+            self._send_json(200, chunk("".join(tokens), done=True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if i == fail_at:
+                self._write_chunk({"error": "injected stream failure"})
+                break
+            time.sleep(token_s)
+            self._write_chunk(chunk(token))
+        else:
+            self._write_chunk(chunk("", done=True))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, body: Dict[str, Any]):
+        data = json.dumps(body).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+class MockOllamaServer(ThreadingHTTPServer):
+    """Stand-in for Ollama's /api/generate, /api/chat, /api/embeddings and /api/tags"""
+
+    daemon_threads = True
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _MockHandler)
+        self.config = config or MockConfig()
+        self.slots = threading.Semaphore(max(1, self.config.parallel))
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._load_pending = self.config.load_ms > 0
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def chance(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def take_load_ms(self) -> float:
+        with self._lock:
+            pending, self._load_pending = self._load_pending, False
+        return self.config.load_ms if pending else 0
+
+    def start(self) -> "MockOllamaServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def mock_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> List[float]:
+    """Deterministic unit vector derived from the text"""
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+    rng = random.Random(seed)
+    values = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = sum(v * v for v in values) ** 0.5 or 1.0
+    return [v / norm for v in values]
+
+def _serve_process(config: MockConfig, port_queue):
+    server = MockOllamaServer(config)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+def start_mock_process(config: MockConfig) -> tuple:
+    """Run the mock in a separate process so it adds no CPU or memory to the measurements"""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve_process, args=(config, port_queue), daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+
+def make_pdf(pages: int, scanned_every: int = 4) -> bytes:
+    """Synthetic PDF; every scanned_every-th page is an image without a text layer"""
+    document = fitz.open()
+    for number in range(1, pages + 1):
+        page = document.new_page(width=595, height=842)
+        text = f"Page {number}\n" + "\n".join(
+            f"Item {line}: " + " ".join(WORDS[(number + line + i) % len(WORDS)] for i in range(10))
+            for line in range(30)
+        )
+        if scanned_every and number % scanned_every == 0:
+            scan = make_image(1240, 1754, text)
+            page.insert_image(page.rect, stream=_png_bytes(scan))
+        else:
+            page.insert_textbox(fitz.Rect(50, 50, 545, 792), text, fontsize=10)
+    data = document.tobytes()
+    document.close()
+    return data
+
+def make_image(width: int = 1240, height: int = 1754, text: str = "") -> Image.Image:
+    """Synthetic scanned page: text lines on an off-white background"""
+    image = Image.new("RGB", (width, height), (248, 246, 240))
+    draw = ImageDraw.Draw(image)
+    lines = text.splitlines() or [" ".join(WORDS)] * 40
+    for i, line in enumerate(lines):
+        draw.text((60, 60 + i * 36), line, fill=(30, 30, 30))
+    return image
+
+def _png_bytes(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def make_code_tree(root: Path, files: int, functions_per_file: int = 20) -> Path:
+    """Synthetic Python package with files of a few hundred lines each"""
+    for number in range(files):
+        module = root / f"package_{number % 5}" / f"module_{number}.py"
+        module.parent.mkdir(parents=True, exist_ok=True)
+        module.write_text("\n\n".join(
+            f"def function_{i}(items):\n"
+            f"    \"\"\"Return the items above {i}\"\"\"\n"
+            f"    result = []\n"
+            f"    for item in items:\n"
+            f"        if item > {i}:\n"
+            f"            result.append(item * {number + 1})\n"
+            f"    return result\n"
+            for i in range(functions_per_file)
+        ))
+    return root
+
+def measure(name: str, unit: str, run: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """Time run() and report items per second and client metrics.
+
+    Runs untraced: tracemalloc slows Python-heavy paths down severalfold, so
+    the heap peak is measured in a separate pass by measure_peak().
+    """
+    get_metrics().reset()
+    started = time.perf_counter()
+    outcome = run()
+    seconds = time.perf_counter() - started
+    summary = get_metrics().summary()
+    items = outcome["items"]
+    return {
+        "scenario": name,
+        "items": items,
+        "unit": unit,
+        "seconds": round(seconds, 3),
+        "rate": round(items / seconds, 3) if seconds else None,
+        "errors": outcome.get("errors", 0),
+        "requests": summary["requests"],
+        "p50_ms": round(summary["p50_ms"], 1) if summary["p50_ms"] is not None else None,
+        "ttft_ms": round(outcome["ttft_ms"], 1) if outcome.get("ttft_ms") is not None else None,
+        "peak_mb": None,
+    }
+
+def measure_peak(run: Callable[[], Dict[str, Any]]) -> float:
+    """Python heap peak (MB) of one traced run()"""
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024 / 1024, 1)
+
+# Each bench_* function builds its synthetic input first and returns the timed part
+
+def bench_documents(url: str, model: str, pages: int, max_in_flight: int) -> Callable[[], Dict[str, Any]]:
+    """Document analyzer: lazily rendered PDF pages, text layer and scanned"""
+    pdf_bytes = make_pdf(pages)
+
+    def run():
+        analyzer = DocumentAnalyzer(url, model, max_in_flight)
+        results = analyzer.analyze_document_content(PdfPageSource(pdf_bytes), "summary")
+        return {"items": len(results), "errors": sum(r["analysis"].startswith("Error:") for r in results)}
+    return run
+
+def bench_images(url: str, model: str, images: int, max_in_flight: int) -> Callable[[], Dict[str, Any]]:
+    """Document analyzer: uploaded page images"""
+    image = make_image()
+
+    def run():
+        analyzer = DocumentAnalyzer(url, model, max_in_flight)
+        results = analyzer.analyze_document_content((image for _ in range(images)), "extract_data")
+        return {"items": len(results), "errors": sum(r["analysis"].startswith("Error:") for r in results)}
+    return run
+
+def bench_code(url: str, model: str, files: int, max_in_flight: int,
+               directory: Path) -> Callable[[], Dict[str, Any]]:
+    """Coding agent: analysis of a directory tree"""
+    root = make_code_tree(directory / "sync", files)
+
+    def run():
+        agent = Gemma3nCodingAgent(url, model)
+        records = list(agent.analyze_directory(str(root), max_in_flight=max_in_flight))
+        return {"items": len(records), "errors": sum(r["status"] == "error" for r in records)}
+    return run
+
+def bench_documents_async(url: str, model: str, pages: int, max_in_flight: int,
+                          documents: int) -> Callable[[], Dict[str, Any]]:
+    """Document analyzer on asyncio: several PDFs at once on one thread, bounded by one client"""
+    pdf_bytes = make_pdf(pages)
+
+    async def analyze_all():
+        analyzer = DocumentAnalyzer(url, model, max_in_flight)
+        async with AsyncOllamaClient(url, max_in_flight * documents) as client:
+            return await asyncio.gather(*(
+                analyzer.analyze_document_content_async(PdfPageSource(pdf_bytes), "summary", client)
+                for _ in range(documents)
+            ))
+
+    def run():
+        results = [r for document in asyncio.run(analyze_all()) for r in document]
+        return {"items": len(results), "errors": sum(r["analysis"].startswith("Error:") for r in results)}
+    return run
+
+def bench_code_async(url: str, model: str, files: int, max_in_flight: int,
+                     directory: Path) -> Callable[[], Dict[str, Any]]:
+    """Coding agent on asyncio: directory analysis without a thread per file"""
+    root = make_code_tree(directory / "async", files)
+
+    async def analyze_all():
+        agent = Gemma3nCodingAgent(url, model)
+        return [record async for record in agent.analyze_directory_async(str(root), max_in_flight=max_in_flight)]
+
+    def run():
+        records = asyncio.run(analyze_all())
+        return {"items": len(records), "errors": sum(r["status"] == "error" for r in records)}
+    return run
+
+def _time_streams(streams) -> Dict[str, Any]:
+    """Consume text streams one after another, reporting the median time to first text"""
+    ttfts, errors, count = [], 0, 0
+    for stream in streams:
+        count += 1
+        started = time.perf_counter()
+        first = None
+        try:
+            for text in stream:
+                if first is None and text:
+                    first = (time.perf_counter() - started) * 1000
+        except Exception:
+            errors += 1
+        if first is not None:
+            ttfts.append(first)
+    return {"items": count, "errors": errors, "ttft_ms": sorted(ttfts)[len(ttfts) // 2] if ttfts else None}
+
+def bench_chat(url: str, model: str, turns: int) -> Callable[[], Dict[str, Any]]:
+    """Voice assistant and coding agent chat: streamed /api/chat turns with growing history"""
+    def run():
+        session = ChatSession(url, model, "You are a helpful assistant.")
+        return _time_streams(session.stream(f"Question {turn}: " + " ".join(WORDS)) for turn in range(turns))
+    return run
+
+def bench_multimodal(url: str, model: str, turns: int) -> Callable[[], Dict[str, Any]]:
+    """Multimodal chat: streamed /api/generate with an attached image"""
+    image = make_image(1024, 768)
+
+    def run():
+        encoded = DocumentAnalyzer(url, model).encode_page(image)
+        client = get_client(url)
+        return _time_streams(client.generate_stream(model, f"Describe the image ({turn})", [encoded])
+                             for turn in range(turns))
+    return run
+
+def format_row(row: Dict[str, Any]) -> str:
+    ttft = f"{row['ttft_ms']:.0f} ms" if row["ttft_ms"] is not None else "-"
+    p50 = f"{row['p50_ms']:.0f} ms" if row["p50_ms"] is not None else "-"
+    peak = f"{row['peak_mb']:.1f} MB" if row.get("peak_mb") is not None else "-"
+    return (f"{row['scenario']:<15} {row['items']:>5} {row['unit']:<6} {row['seconds']:>8.2f}s "
+            f"{row['rate']:>8.2f} {row['unit']}/s  p50 {p50:>7}  TTFT {ttft:>7}  "
+            f"peak {peak:>9}  errors {row['errors']}")
+
+def compare(rows: List[Dict[str, Any]], baseline_path: str):
+    """Print the change in rate and peak memory against an earlier --json run"""
+    with open(baseline_path, encoding="utf-8") as f:
+        # Skip anything else that ended up in the saved output, such as library warnings
+        baseline = {row["scenario"]: row for row in (json.loads(line) for line in f if line.startswith("{"))}
+    for row in rows:
+        before = baseline.get(row["scenario"])
+        if not before or not before.get("rate"):
+            continue
+        rate_change = (row["rate"] - before["rate"]) / before["rate"] * 100
+        line = f"{row['scenario']:<15} rate {rate_change:+.1f}%"
+        if row.get("peak_mb") is not None and before.get("peak_mb") is not None:
+            line += f"  peak memory {row['peak_mb'] - before['peak_mb']:+.1f} MB"
+        print(line)
+
+SCENARIOS = ["documents", "documents-async", "images", "code", "code-async", "chat", "multimodal"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemma 3n offline benchmark suite")
+    subparsers = parser.add_subparsers(dest="command")
+
+    def add_mock_options(command):
+        command.add_argument("--latency-ms", type=float, default=150,
+                             help="Delay before the first token of every request")
+        command.add_argument("--tokens-per-s", type=float, default=400,
+                             help="Generation speed of each request")
+        command.add_argument("--response-tokens", type=int, default=64,
+                             help="Tokens generated per request")
+        command.add_argument("--parallel", type=int, default=4,
+                             help="Requests the mock processes at once (like OLLAMA_NUM_PARALLEL)")
+        command.add_argument("--error-rate", type=float, default=0.0,
+                             help="Fraction of requests answered with an HTTP error")
+        command.add_argument("--error-status", type=int, default=500,
+                             help="HTTP status of injected errors (5xx are retried by the client)")
+        command.add_argument("--stream-error-rate", type=float, default=0.0,
+                             help="Fraction of streams that fail halfway")
+        command.add_argument("--seed", type=int,
+                             help="Random seed for error injection")
+
+    run = subparsers.add_parser("run", help="Run benchmark scenarios")
+    add_mock_options(run)
+    run.add_argument("--scenario", action="append", choices=SCENARIOS,
+                     help="Scenario to run (repeatable; default: all)")
+    run.add_argument("--url", type=str,
+                     help="Benchmark a real Ollama server instead of the mock")
+    run.add_argument("--model", default=DEFAULT_MODEL,
+                     help="Model name sent with every request")
+    run.add_argument("--pages", type=int, default=40,
+                     help="Pages in the synthetic PDF")
+    run.add_argument("--documents", type=int, default=4,
+                     help="PDFs analyzed at once in documents-async")
+    run.add_argument("--images", type=int, default=20,
+                     help="Synthetic page images")
+    run.add_argument("--files", type=int, default=40,
+                     help="Files in the synthetic code tree")
+    run.add_argument("--turns", type=int, default=10,
+                     help="Chat turns")
+    run.add_argument("--max-in-flight", type=int, default=4,
+                     help="Concurrent requests for document and code scenarios")
+    run.add_argument("--memory", action="store_true",
+                     help="Also measure each scenario's Python heap peak in a second, traced run")
+    run.add_argument("--json", action="store_true",
+                     help="Print results as JSON lines (save them to compare later runs)")
+    run.add_argument("--compare", type=str,
+                     help="JSON lines of an earlier run to compare against")
+
+    serve = subparsers.add_parser("serve", help="Run only the mock server, e.g. to point the apps at it")
+    add_mock_options(serve)
+    serve.add_argument("--port", type=int, default=11435,
+                       help="Port to listen on")
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return
+
+    config = MockConfig(args.latency_ms, args.tokens_per_s, args.response_tokens, args.parallel,
+                        args.error_rate, args.error_status, args.stream_error_rate, seed=args.seed)
+    if args.command == "serve":
+        server = MockOllamaServer(config, port=args.port)
+        print(f"Mock Ollama listening on {server.url}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+        return
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_mock_process(config)
+
+    scenarios = {
+        "documents": ("pages", lambda: bench_documents(url, args.model, args.pages, args.max_in_flight)),
+        "images": ("images", lambda: bench_images(url, args.model, args.images, args.max_in_flight)),
+        "documents-async": ("pages", lambda: bench_documents_async(url, args.model, args.pages, args.max_in_flight,
+                                                                   args.documents)),
+        "code": ("files", lambda: bench_code(url, args.model, args.files, args.max_in_flight, Path(directory))),
+        "code-async": ("files", lambda: bench_code_async(url, args.model, args.files, args.max_in_flight,
+                                                         Path(directory))),
+        "chat": ("turns", lambda: bench_chat(url, args.model, args.turns)),
+        "multimodal": ("turns", lambda: bench_multimodal(url, args.model, args.turns)),
+    }
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for name in args.scenario or SCENARIOS:
+                unit, prepare = scenarios[name]
+                row = measure(name, unit, prepare())
+                if args.memory:
+                    # A second, traced pass on fresh input keeps the timings above undistorted
+                    row["peak_mb"] = measure_peak(prepare())
+                rows.append(row)
+                print(json.dumps(row) if args.json else format_row(row), flush=True)
+    finally:
+        if process is not None:
+            process.terminate()
+
+    if args.compare:
+        compare(rows, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Gemma 3n Result Cache
+Persistent, content-addressed cache for model responses with LRU eviction
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("GEMMA3N_CACHE_DIR", Path.home() / ".cache" / "gemma3n"))
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def make_cache_key(*parts: Any) -> str:
+    """Hash raw bytes and JSON-serializable values into a stable cache key"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            data = bytes(part)
+        else:
+            data = json.dumps(part, sort_keys=True, default=str).encode()
+        # Length prefix keeps ("ab", "c") and ("a", "bc") from colliding
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+class ResultCache:
+    """On-disk key/value store bounded by total size, evicting least recently used entries"""
+
+    def __init__(self, directory: Path = DEFAULT_CACHE_DIR / "documents", max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)["value"]
+            # Access time is tracked through mtime so eviction needs no separate index
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        """Store a JSON-serializable value and evict old entries if over budget"""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"value": value}, f)
+        size = tmp_path.stat().st_size
+
+        with self._lock:
+            # Rewriting a key replaces its file, so only the size difference is new
+            try:
+                old_size = path.stat().st_size
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            self._total_bytes += size - old_size
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            # Trim below the limit so eviction scans stay rare
+            target = self.max_bytes * 0.9
+
+            for _, size, path in sorted(entries, key=lambda e: e[0]):
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+
+            self._total_bytes = total
+
+    def clear(self):
+        """Remove every entry and reset statistics"""
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            self.hits = 0
+            self.misses = 0
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current disk usage"""
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
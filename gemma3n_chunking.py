@@ -0,0 +1,317 @@
+"""
+Gemma 3n Chunking
+Split source files and diffs into pieces that fit the model's context window
+"""
+
+import ast
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Rough average for code and English prose with Gemma's tokenizer
+CHARS_PER_TOKEN = 3.5
+DEFAULT_CHUNK_TOKENS = 3000
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token count estimate, good enough for budgeting prompts"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def _chunk(lines: List[str], start: int, end: int, name: str) -> Dict:
+    """Chunk covering lines[start:end] (0-based, end exclusive)"""
+    return {
+        "text": "".join(lines[start:end]),
+        "start_line": start + 1,
+        "end_line": end,
+        "name": name,
+    }
+
+def split_lines(text: str, max_tokens: int = DEFAULT_CHUNK_TOKENS, name: str = "lines",
+                first_line: int = 1) -> List[Dict]:
+    """Fallback splitter: consecutive lines packed up to the token budget"""
+    lines = text.splitlines(keepends=True)
+    chunks = []
+    start = 0
+    size = 0
+    for index, line in enumerate(lines):
+        line_tokens = estimate_tokens(line)
+        if size and size + line_tokens > max_tokens:
+            chunks.append(_chunk(lines, start, index, name))
+            start, size = index, 0
+        size += line_tokens
+    if start < len(lines):
+        chunks.append(_chunk(lines, start, len(lines), name))
+
+    for chunk in chunks:
+        chunk["start_line"] += first_line - 1
+        chunk["end_line"] += first_line - 1
+    return chunks
+
+def _node_span(node: ast.AST) -> tuple:
+    """0-based (start, end) line span of a node, including decorators"""
+    start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+    return start, node.end_lineno
+
+def _node_name(node: ast.AST) -> str:
+    return getattr(node, "name", type(node).__name__.lower())
+
+def _split_class(lines: List[str], node: ast.ClassDef, max_tokens: int) -> List[Dict]:
+    """Split an oversized class into its methods, each prefixed by the class header"""
+    class_start, class_end = _node_span(node)
+    body_start = _node_span(node.body[0])[0] if node.body else class_end
+    header = "".join(lines[class_start:body_start])
+    chunks = []
+    for child in node.body:
+        start, end = _node_span(child)
+        text = "".join(lines[start:end])
+        name = f"{node.name}.{_node_name(child)}"
+        if estimate_tokens(header + text) > max_tokens:
+            chunks.extend(split_lines(text, max_tokens, name, start + 1))
+        else:
+            chunks.append({"text": header + text, "start_line": start + 1, "end_line": end, "name": name})
+    return chunks
+
+def chunk_python_source(source: str, max_tokens: int = DEFAULT_CHUNK_TOKENS) -> List[Dict]:
+    """Split Python source along top-level function/class boundaries.
+
+    Small neighbouring statements are packed together; classes larger than the
+    budget are split per method; anything still too large falls back to lines.
+    """
+    if estimate_tokens(source) <= max_tokens:
+        return [{"text": source, "start_line": 1, "end_line": source.count("\n") + 1, "name": "module"}]
+
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return split_lines(source, max_tokens)
+
+    lines = source.splitlines(keepends=True)
+    chunks = []
+    group_start = None
+    group_end = 0
+    group_names = []
+
+    def flush_group():
+        nonlocal group_start, group_names
+        if group_start is not None:
+            chunks.append(_chunk(lines, group_start, group_end, ", ".join(group_names)))
+        group_start, group_names = None, []
+
+    previous_end = 0
+    for node in tree.body:
+        start, end = _node_span(node)
+        # Attach comments/blank lines preceding the node to it
+        start = min(start, previous_end)
+        previous_end = end
+        text = "".join(lines[start:end])
+        tokens = estimate_tokens(text)
+
+        if tokens > max_tokens:
+            flush_group()
+            if isinstance(node, ast.ClassDef):
+                chunks.extend(_split_class(lines, node, max_tokens))
+            else:
+                chunks.extend(split_lines(text, max_tokens, _node_name(node), start + 1))
+            continue
+
+        if group_start is not None and estimate_tokens("".join(lines[group_start:end])) > max_tokens:
+            flush_group()
+        if group_start is None:
+            group_start = start
+        group_end = end
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            group_names.append(node.name)
+        elif not group_names or group_names[-1] != "statements":
+            group_names.append("statements")
+
+    flush_group()
+    # Trailing comments after the last node
+    if previous_end < len(lines) and "".join(lines[previous_end:]).strip():
+        chunks.append(_chunk(lines, previous_end, len(lines), "trailer"))
+    return chunks
+
+def chunk_text_blocks(text: str, max_tokens: int = DEFAULT_CHUNK_TOKENS) -> List[Dict]:
+    """Split non-Python code on blank lines, packing blocks up to the budget"""
+    if estimate_tokens(text) <= max_tokens:
+        return [{"text": text, "start_line": 1, "end_line": text.count("\n") + 1, "name": "file"}]
+
+    # Blank-line separated blocks, packed greedily; oversized blocks are line-split
+    blocks = []
+    lines = text.splitlines(keepends=True)
+    start = 0
+    for index, line in enumerate(lines):
+        if not line.strip():
+            blocks.append((start, index + 1))
+            start = index + 1
+    if start < len(lines):
+        blocks.append((start, len(lines)))
+
+    chunks = []
+    group_start = group_end = None
+    group_tokens = 0
+    for start, end in blocks:
+        tokens = estimate_tokens("".join(lines[start:end]))
+        if group_start is not None and group_tokens + tokens > max_tokens:
+            chunks.append(_chunk(lines, group_start, group_end, "block"))
+            group_start = None
+        if tokens > max_tokens:
+            chunks.extend(split_lines("".join(lines[start:end]), max_tokens, "block", start + 1))
+            continue
+        if group_start is None:
+            group_start, group_tokens = start, 0
+        group_end = end
+        group_tokens += tokens
+    if group_start is not None:
+        chunks.append(_chunk(lines, group_start, group_end, "block"))
+    return chunks
+
+def chunk_code(code: str, max_tokens: int = DEFAULT_CHUNK_TOKENS, file_path: str = "") -> List[Dict]:
+    """Pick the right splitter for a piece of code"""
+    if file_path.endswith(".py") or (not file_path and _looks_like_python(code)):
+        return chunk_python_source(code, max_tokens)
+    return chunk_text_blocks(code, max_tokens)
+
+def _looks_like_python(code: str) -> bool:
+    try:
+        ast.parse(code)
+    except SyntaxError:
+        return False
+    return True
+
+FILE_HEADER = re.compile(r"^diff --git ", re.MULTILINE)
+HUNK_HEADER = re.compile(r"^@@ ", re.MULTILINE)
+
+def _split_at(text: str, pattern: re.Pattern) -> List[str]:
+    starts = [m.start() for m in pattern.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)]) if text[a:b]]
+
+def chunk_diff(diff: str, max_tokens: int = DEFAULT_CHUNK_TOKENS) -> List[Dict]:
+    """Split a unified diff along file and hunk boundaries.
+
+    Small file diffs are packed together; a file diff that is too large is split
+    per hunk with the file header repeated so each chunk stands on its own.
+    """
+    if estimate_tokens(diff) <= max_tokens:
+        return [{"text": diff, "name": "diff"}]
+
+    pieces = []
+    for file_diff in _split_at(diff, FILE_HEADER):
+        first_line = file_diff.split("\n", 1)[0]
+        name = first_line.split(" b/", 1)[-1] if first_line.startswith("diff --git") else "diff"
+        if estimate_tokens(file_diff) <= max_tokens:
+            pieces.append({"text": file_diff, "name": name})
+            continue
+
+        hunks = _split_at(file_diff, HUNK_HEADER)
+        header = hunks.pop(0) if hunks and not hunks[0].startswith("@@") else ""
+        for hunk in hunks:
+            if estimate_tokens(header + hunk) <= max_tokens:
+                pieces.append({"text": header + hunk, "name": name})
+            else:
+                for part in split_lines(hunk, max_tokens - estimate_tokens(header)):
+                    pieces.append({"text": header + part["text"], "name": name})
+
+    # Pack small pieces together up to the budget
+    chunks = []
+    for piece in pieces:
+        if chunks and estimate_tokens(chunks[-1]["text"] + piece["text"]) <= max_tokens:
+            chunks[-1]["text"] += piece["text"]
+            if piece["name"] not in chunks[-1]["name"].split(", "):
+                chunks[-1]["name"] += f", {piece['name']}"
+        else:
+            chunks.append(dict(piece))
+    return chunks
+
+def pack_for_reduce(texts: List[str], max_tokens: int = DEFAULT_CHUNK_TOKENS) -> List[List[int]]:
+    """Group consecutive texts within the token budget, at least two per group.
+
+    A group is only over max_tokens when it holds exactly two texts that do not
+    fit together; the reduce prompt's context window needs that headroom, up to
+    twice the largest text.
+    """
+    groups = []
+    group_tokens = 0
+    for index, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        # Pairing at least two items guarantees every reduce level shrinks the list
+        if groups and (len(groups[-1]) < 2 or group_tokens + tokens <= max_tokens):
+            groups[-1].append(index)
+            group_tokens += tokens
+        else:
+            groups.append([index])
+            group_tokens = tokens
+    return groups
+
+# Reduce calls retried before a failed partial merge aborts the whole reduction
+REDUCE_RETRIES = 1
+
+def _reduce_failed(text: str) -> bool:
+    # The exact prefix of failed calls; merged answers may well start with "Error handling..."
+    return text.startswith("Error:")
+
+def tree_reduce(items: List[Tuple[Any, str]], reduce_group: Callable[[List[Tuple[Any, str]], bool], str],
+                max_tokens: int = DEFAULT_CHUNK_TOKENS, workers: int = 4,
+                merge_key: Optional[Callable[[List[Any]], Any]] = None) -> str:
+    """Merge (key, text) items level by level until one text remains.
+
+    reduce_group(group, is_final) merges one group; groups on the same level run
+    in parallel, so total latency grows with the logarithm of the item count.
+    merge_key combines the keys of a group into the key of its result.
+    An intermediate merge that returns "Error: ..." is retried; if it still
+    fails, that error is returned instead of being merged as if it were a summary.
+    """
+    if not items:
+        return ""
+    if len(items) == 1:
+        return items[0][1]
+
+    def reduce_with_retry(group):
+        for _ in range(REDUCE_RETRIES + 1):
+            text = reduce_group(group, False)
+            if not _reduce_failed(text):
+                break
+        return text
+
+    merge_key = merge_key or (lambda keys: keys[0])
+    while True:
+        groups = [[items[i] for i in indices] for indices in pack_for_reduce([t for _, t in items], max_tokens)]
+        if len(groups) == 1:
+            return reduce_group(groups[0], True)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            texts = list(executor.map(reduce_with_retry, groups))
+        failed = next((text for text in texts if _reduce_failed(text)), None)
+        if failed is not None:
+            return failed
+        items = [(merge_key([key for key, _ in group]), text) for group, text in zip(groups, texts)]
+
+async def tree_reduce_async(items: List[Tuple[Any, str]],
+                            reduce_group: Callable[[List[Tuple[Any, str]], bool], Awaitable[str]],
+                            max_tokens: int = DEFAULT_CHUNK_TOKENS,
+                            merge_key: Optional[Callable[[List[Any]], Any]] = None) -> str:
+    """tree_reduce for a coroutine reduce_group; the groups of a level are gathered concurrently"""
+    if not items:
+        return ""
+    if len(items) == 1:
+        return items[0][1]
+
+    async def reduce_with_retry(group):
+        for _ in range(REDUCE_RETRIES + 1):
+            text = await reduce_group(group, False)
+            if not _reduce_failed(text):
+                break
+        return text
+
+    merge_key = merge_key or (lambda keys: keys[0])
+    while True:
+        groups = [[items[i] for i in indices] for indices in pack_for_reduce([t for _, t in items], max_tokens)]
+        if len(groups) == 1:
+            return await reduce_group(groups[0], True)
+
+        texts = await asyncio.gather(*(reduce_with_retry(group) for group in groups))
+        failed = next((text for text in texts if _reduce_failed(text)), None)
+        if failed is not None:
+            return failed
+        items = [(merge_key([key for key, _ in group]), text) for group, text in zip(groups, texts)]
@@ -0,0 +1,247 @@
+"""
+Gemma 3n Ollama Client
+Shared, connection-pooled HTTP client used by all Gemma 3n applications
+"""
+
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from gemma3n_metrics import MetricsRecorder, get_metrics, server_timings
+from gemma3n_singleflight import COALESCED_PATHS, SingleFlight, request_key
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+# (connect, read) seconds; reads are long because generation can take minutes
+DEFAULT_TIMEOUT = (5, 300)
+# How long Ollama keeps the model loaded after the last request
+DEFAULT_KEEP_ALIVE = "30m"
+
+class OllamaError(requests.exceptions.RequestException):
+    """Error reported by Ollama inside an otherwise successful response"""
+
+class OllamaPayloads:
+    """Request bodies shared by the synchronous and asyncio clients; needs self.keep_alive"""
+
+    keep_alive: Optional[str] = DEFAULT_KEEP_ALIVE
+
+    def _generate_payload(self, model: str, prompt: str, images: Optional[List[str]],
+                          options: Optional[Dict[str, Any]], stream: bool) -> Dict[str, Any]:
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": stream,
+        }
+        if options:
+            payload["options"] = options
+        if images:
+            payload["images"] = images
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    def _chat_payload(self, model: str, messages: List[Dict[str, Any]],
+                      options: Optional[Dict[str, Any]], stream: bool) -> Dict[str, Any]:
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": stream,
+        }
+        if options:
+            payload["options"] = options
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    def _embed_payload(self, model: str, text: str) -> Dict[str, Any]:
+        payload = {"model": model, "prompt": text}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+class OllamaClient(OllamaPayloads):
+    """Thin wrapper over a pooled requests.Session for the Ollama REST API"""
+
+    def __init__(self, base_url: str = DEFAULT_OLLAMA_URL,
+                 timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+                 max_retries: int = 3, backoff_factor: float = 0.5,
+                 keep_alive: Optional[str] = DEFAULT_KEEP_ALIVE, pool_maxsize: int = 16,
+                 metrics: Optional[MetricsRecorder] = None, coalesce: bool = True):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.metrics = metrics or get_metrics()
+        # Identical generations in flight at the same time share one upstream call
+        self.single_flight = SingleFlight() if coalesce else None
+
+        # Retry connection failures and 5xx responses with exponential backoff.
+        # Read timeouts are not retried: the server may still be generating.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _send(self, path: str, payload: Dict[str, Any], stream: bool = False):
+        """Encode and POST a payload, returning the response and the encode/network timings"""
+        started = time.perf_counter()
+        data = json.dumps(payload)
+        encoded = time.perf_counter()
+        response = self.session.post(f"{self.base_url}{path}", data=data, timeout=self.timeout, stream=stream,
+                                     headers={"Content-Type": "application/json"})
+        timings = {
+            "encode_ms": (encoded - started) * 1000,
+            # Full body for regular requests; time to response headers for streams
+            "network_ms": (time.perf_counter() - encoded) * 1000,
+            "request_bytes": len(data),
+        }
+        return response, started, timings
+
+    def _record(self, path: str, payload: Dict[str, Any], started: float, status: str, **fields):
+        self.metrics.record(path, payload.get("model", ""), status, backend=self.base_url,
+                            total_ms=(time.perf_counter() - started) * 1000, **fields)
+
+    def post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST a JSON payload and return the decoded JSON response"""
+        if self.single_flight is None or path not in COALESCED_PATHS:
+            return self._post(path, payload)
+        started = time.perf_counter()
+        body, shared = self.single_flight.do(request_key(path, payload), lambda: self._post(path, payload))
+        if shared:
+            self._record(path, payload, started, "coalesced")
+        return body
+
+    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        timings = {}
+        try:
+            response, started, timings = self._send(path, payload)
+            response.raise_for_status()
+            decode_started = time.perf_counter()
+            body = response.json()
+            timings["decode_ms"] = (time.perf_counter() - decode_started) * 1000
+        except requests.exceptions.RequestException:
+            self._record(path, payload, started, "error", **timings)
+            raise
+        self._record(path, payload, started, "ok", **timings, **server_timings(body))
+        return body
+
+    def generate(self, model: str, prompt: str, images: Optional[List[str]] = None,
+                 options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Run a non-streaming /api/generate call and return the full response body"""
+        return self.post("/api/generate", self._generate_payload(model, prompt, images, options, False))
+
+    def stream_lines(self, path: str, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """POST a streaming request and yield each decoded NDJSON object as it arrives.
+
+        An identical stream already in flight is joined instead: its chunks so
+        far are replayed and the rest arrive as they are generated.
+        """
+        if self.single_flight is None or path not in COALESCED_PATHS:
+            return self._stream_lines(path, payload)
+        chunks, joined = self.single_flight.stream(request_key(path, payload),
+                                                   lambda: self._stream_lines(path, payload))
+        if joined:
+            self.metrics.record(path, payload.get("model", ""), "coalesced", backend=self.base_url)
+        return chunks
+
+    def _stream_lines(self, path: str, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        started = time.perf_counter()
+        timings = {}
+        decode_s = 0.0
+        # Stays "cancelled" when the consumer stops reading before the last chunk
+        status = "cancelled"
+        final = {}
+        try:
+            response, started, timings = self._send(path, payload, stream=True)
+            with response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    decode_started = time.perf_counter()
+                    chunk = json.loads(line)
+                    decode_s += time.perf_counter() - decode_started
+                    if "error" in chunk:
+                        raise OllamaError(chunk["error"])
+                    if "ttft_ms" not in timings and (chunk.get("response") or chunk.get("message", {}).get("content")):
+                        timings["ttft_ms"] = (time.perf_counter() - started) * 1000
+                    yield chunk
+                    if chunk.get("done"):
+                        status, final = "ok", chunk
+                        break
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            timings["decode_ms"] = decode_s * 1000
+            self._record(path, payload, started, status, **timings, **server_timings(final))
+
+    def generate_stream(self, model: str, prompt: str, images: Optional[List[str]] = None,
+                        options: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Run a streaming /api/generate call, yielding text fragments as they are produced"""
+        payload = self._generate_payload(model, prompt, images, options, True)
+        for chunk in self.stream_lines("/api/generate", payload):
+            if chunk.get("response"):
+                yield chunk["response"]
+
+    def chat(self, model: str, messages: List[Dict[str, Any]], options: Optional[Dict[str, Any]] = None,
+             session: Optional[str] = None) -> Dict[str, Any]:
+        """Run a non-streaming /api/chat call and return the full response body.
+
+        session identifies the conversation so a BackendPool keeps it on one
+        server; a single client has nothing to route and ignores it.
+        """
+        return self.post("/api/chat", self._chat_payload(model, messages, options, False))
+
+    def chat_stream(self, model: str, messages: List[Dict[str, Any]], options: Optional[Dict[str, Any]] = None,
+                    session: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Run a streaming /api/chat call, yielding each chunk; the last one carries the timings"""
+        return self.stream_lines("/api/chat", self._chat_payload(model, messages, options, True))
+
+    def embed(self, model: str, text: str) -> List[float]:
+        """Return the embedding vector for text (/api/embeddings)"""
+        return self.post("/api/embeddings", self._embed_payload(model, text))["embedding"]
+
+    def list_models(self) -> List[Dict[str, Any]]:
+        """Return the models installed on the server (/api/tags)"""
+        response = self.session.get(f"{self.base_url}/api/tags", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get("models", [])
+
+    def close(self):
+        self.session.close()
+
+_clients: Dict[str, OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+def get_client(base_url: str = DEFAULT_OLLAMA_URL) -> OllamaClient:
+    """Return the process-wide client for base_url, creating it on first use.
+
+    A comma-separated list of URLs returns a BackendPool that balances
+    requests over all of them with the same interface.
+    """
+    key = ",".join(url.strip().rstrip("/") for url in base_url.split(",") if url.strip())
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            if "," in key:
+                from gemma3n_pool import BackendPool
+                client = BackendPool(key.split(","))
+            else:
+                client = OllamaClient(key)
+            _clients[key] = client
+        return client
@@ -10,50 +10,267 @@ import json
 import subprocess
 import requests
 import argparse
+import asyncio
 import re
 from pathlib import Path
 from typing import List, Dict, Optional
 import tempfile
 import shutil
+import fnmatch
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import AsyncIterator, Iterator, TextIO
+from gemma3n_async_client import ASYNC_REQUEST_ERRORS, AsyncOllamaClient
+from gemma3n_client import get_client
+from gemma3n_chunking import DEFAULT_CHUNK_TOKENS, chunk_code, chunk_diff, tree_reduce, tree_reduce_async
+from gemma3n_analysis_store import AnalysisStore, DEFAULT_STORE_PATH
+from gemma3n_conversation import ChatSession, format_stats
+from gemma3n_metrics import format_summary, get_metrics
+from gemma3n_retrieval import DEFAULT_EMBED_MODEL
+from gemma3n_semantic_cache import (DEFAULT_SEMANTIC_CACHE_DIR, DEFAULT_THRESHOLD, SemanticCache,
+                                    cache_scope, format_cache_stats)
+
+# Match Ollama's own request parallelism so extra files queue client-side
+DEFAULT_MAX_IN_FLIGHT = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+DEFAULT_MAX_FILE_BYTES = 256 * 1024
+# Context window requested from Ollama; chunks plus prompt and answer must fit in it
+DEFAULT_NUM_CTX = 8192
+# Conversation history kept in interactive mode; leaves room for the question and answer
+DEFAULT_HISTORY_TOKENS = 4000
+# Bump whenever an analysis prompt template changes so stored results are not reused
+PROMPT_TEMPLATE_VERSION = "2"
+# Always skipped when walking a directory without git
+SKIP_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", ".tox", ".mypy_cache"}
+
+def is_binary_file(path: Path, sample_size: int = 8192) -> bool:
+    """Treat a file as binary if its first bytes contain a NUL"""
+    with open(path, "rb") as f:
+        return b"\0" in f.read(sample_size)
+
+def _git_listed_files(root: Path) -> Optional[List[Path]]:
+    """Tracked and untracked-but-not-ignored files under root, or None outside git"""
+    try:
+        result = subprocess.run(
+            ["git", "ls-files", "--cached", "--others", "--exclude-standard", "-z"],
+            cwd=root, capture_output=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return [root / name for name in result.stdout.decode("utf-8", "replace").split("\0") if name]
+
+def _read_gitignore(directory: Path) -> List[tuple]:
+    """Parse a .gitignore into (pattern, negated, directory_only, anchored) rules"""
+    rules = []
+    try:
+        lines = (directory / ".gitignore").read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return rules
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        line = line.lstrip("!")
+        directory_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        rules.append((line.lstrip("/"), negated, directory_only, anchored))
+    return rules
+
+def _is_ignored(relative: str, is_dir: bool, rule_sets: List[tuple]) -> bool:
+    ignored = False
+    for base, rules in rule_sets:
+        path = relative[len(base) + 1:] if base else relative
+        for pattern, negated, directory_only, anchored in rules:
+            if directory_only and not is_dir:
+                continue
+            target = path if anchored else path.rsplit("/", 1)[-1]
+            if fnmatch.fnmatch(target, pattern):
+                ignored = not negated
+    return ignored
+
+def _walk_respecting_gitignore(root: Path) -> Iterator[Path]:
+    """os.walk fallback that honours .gitignore files found along the way"""
+    rule_sets_by_dir = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        current = Path(dirpath)
+        relative_dir = current.relative_to(root).as_posix()
+        relative_dir = "" if relative_dir == "." else relative_dir
+        parent_rules = rule_sets_by_dir.get(str(current.parent), []) if relative_dir else []
+        rules = _read_gitignore(current)
+        rule_sets = parent_rules + [(relative_dir, rules)] if rules else parent_rules
+        rule_sets_by_dir[str(current)] = rule_sets
+
+        def rel(name):
+            return f"{relative_dir}/{name}" if relative_dir else name
+
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if d not in SKIP_DIRS and not _is_ignored(rel(d), True, rule_sets)
+        )
+        for name in sorted(filenames):
+            if not _is_ignored(rel(name), False, rule_sets):
+                yield current / name
+
+def iter_source_files(root: str, include: Optional[List[str]] = None,
+                      exclude: Optional[List[str]] = None) -> Iterator[Path]:
+    """Yield files under root that git would not ignore, filtered by glob patterns"""
+    root_path = Path(root).resolve()
+    files = _git_listed_files(root_path)
+    if files is None:
+        files = _walk_respecting_gitignore(root_path)
+
+    for path in files:
+        relative = path.relative_to(root_path).as_posix()
+        if include and not any(fnmatch.fnmatch(relative, g) or fnmatch.fnmatch(path.name, g) for g in include):
+            continue
+        if exclude and any(fnmatch.fnmatch(relative, g) or fnmatch.fnmatch(path.name, g) for g in exclude):
+            continue
+        if path.is_file():
+            yield path
 
 class Gemma3nCodingAgent:
-    def __init__(self, ollama_url: str = "http://localhost:11434", model: str = "gemma3n:e4b"):
+    def __init__(self, ollama_url: str = "http://localhost:11434", model: str = "gemma3n:e4b",
+                 stream: bool = False):
         self.ollama_url = ollama_url
         self.model = model
+        # When set, responses are echoed to stdout token by token as they arrive
+        self.stream = stream
+        self.max_in_flight = DEFAULT_MAX_IN_FLIGHT
+        # Inputs larger than this are split and analyzed in parallel, then merged
+        self.chunk_tokens = DEFAULT_CHUNK_TOKENS
+        # Optional AnalysisStore; unchanged files and chunks reuse earlier results
+        self.store = None
+        # Optional SemanticCache; chat questions similar to earlier ones reuse their answers
+        self.semantic_cache = None
+        self.last_cache_hit = None
         self.conversation_history = []
         self.workspace = Path.cwd()
+        self.options = {
+            "temperature": 0.1,  # Lower temperature for more deterministic code
+            "top_p": 0.9,
+            "num_ctx": DEFAULT_NUM_CTX
+        }
 
-    def call_gemma3n(self, prompt: str, system_prompt: str = None) -> str:
+    def call_gemma3n(self, prompt: str, system_prompt: str = None, stream: Optional[bool] = None) -> str:
         """Call Gemma 3n via Ollama API"""
         full_prompt = prompt
         if system_prompt:
             full_prompt = f"{system_prompt}\n\n{prompt}"
 
-        payload = {
-            "model": self.model,
-            "prompt": full_prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.1,  # Lower temperature for more deterministic code
-                "top_p": 0.9
-            }
-        }
+        if stream is None:
+            stream = self.stream
 
         try:
-            response = requests.post(f"{self.ollama_url}/api/generate", json=payload)
-            response.raise_for_status()
-            return response.json().get("response", "")
+            if stream:
+                return self.stream_to_stdout(
+                    get_client(self.ollama_url).generate_stream(self.model, full_prompt, options=self.options)
+                )
+            response = get_client(self.ollama_url).generate(self.model, full_prompt, options=self.options)
+            return response.get("response", "")
         except requests.exceptions.RequestException as e:
             return f"Error: {str(e)}"
 
-    def analyze_code(self, file_path: str) -> str:
-        """Analyze a code file and provide insights"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                code_content = f.read()
-        except Exception as e:
-            return f"Error reading file: {e}"
-
+    def stream_to_stdout(self, chunks) -> str:
+        """Print streamed chunks as they arrive and return the full text"""
+        parts = []
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+            parts.append(chunk)
+        sys.stdout.write("\n")
+        return "".join(parts)
+
+    def print_result(self, header: str, call):
+        """Print a header followed by the result of call(), streaming when enabled"""
+        if self.stream:
+            print(header)
+            result = call()
+            # Errors are returned rather than streamed, so surface them here
+            if result.startswith("Error"):
+                print(result)
+        else:
+            result = call()
+            print(f"{header}\n{result}")
+        return result
+
+    def call_cached(self, kind: Optional[str], content: str, context: str, prompt: str,
+                    system_prompt: str = None, stream: Optional[bool] = None) -> str:
+        """call_gemma3n, reusing a stored result when content, prompt version and model match"""
+        if self.store is None or kind is None:
+            return self.call_gemma3n(prompt, system_prompt, stream)
+
+        key = self.store.key(kind, content, context, self.model)
+        cached = self.store.get(key)
+        if cached is not None:
+            if stream or (stream is None and self.stream):
+                print(cached)
+            return cached
+
+        result = self.call_gemma3n(prompt, system_prompt, stream)
+        if not result.startswith("Error:"):
+            self.store.put(key, kind, content, self.model, result)
+        return result
+
+    def run_chunked(self, chunks: List[Dict], system_prompt: str, build_prompt,
+                    merge_instructions: str, stream: Optional[bool] = None,
+                    workers: Optional[int] = None, cache_kind: Optional[str] = None,
+                    cache_context: str = "") -> str:
+        """Map build_prompt over chunks in parallel, then merge the partial answers"""
+        if len(chunks) == 1:
+            return self.call_cached(cache_kind, chunks[0]["text"], cache_context,
+                                    build_prompt(chunks[0], ""), system_prompt, stream)
+
+        total = len(chunks)
+        part_kind = f"{cache_kind}:part" if cache_kind else None
+        workers = max(1, workers or self.max_in_flight)
+        # Chunks are cached individually, so an edit only re-sends the chunks it touched
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            partials = list(executor.map(
+                lambda item: self.call_cached(
+                    part_kind, item[1]["text"], cache_context,
+                    build_prompt(item[1], f" (part {item[0] + 1} of {total}: {item[1]['name']})"),
+                    system_prompt, stream=False
+                ),
+                enumerate(chunks)
+            ))
+
+        successful = [
+            f"### Part {i + 1}: {chunk['name']}\n{partial}"
+            for i, (chunk, partial) in enumerate(zip(chunks, partials))
+            if not partial.startswith("Error:")
+        ]
+        if not successful:
+            return partials[0]
+
+        if self.store is not None and cache_kind:
+            # Identical partials always merge to the same answer
+            merged_input = "\n\n".join(successful)
+            key = self.store.key(f"{cache_kind}:merged", merged_input, merge_instructions, self.model)
+            cached = self.store.get(key)
+            if cached is not None:
+                if stream or (stream is None and self.stream):
+                    print(cached)
+                return cached
+            result = self.merge_partials(successful, system_prompt, merge_instructions, stream, workers)
+            if not result.startswith("Error:"):
+                self.store.put(key, f"{cache_kind}:merged", merged_input, self.model, result)
+            return result
+
+        return self.merge_partials(successful, system_prompt, merge_instructions, stream, workers)
+
+    def merge_partials(self, partials: List[str], system_prompt: str, merge_instructions: str,
+                       stream: Optional[bool] = None, workers: Optional[int] = None) -> str:
+        """Reduce partial answers into one, in parallel rounds that fit the token budget"""
+        def reduce_group(group, is_final):
+            prompt = f"{merge_instructions}\n\n" + "\n\n".join(text for _, text in group)
+            return self.call_gemma3n(prompt, system_prompt, stream if is_final else False)
+
+        return tree_reduce(list(enumerate(partials)), reduce_group, self.chunk_tokens,
+                           max(1, workers or self.max_in_flight))
+
+    def analysis_prompts(self, file_path: str, code_content: str, part: str = "") -> tuple:
+        """Build the (prompt, system_prompt) pair used to analyze a file"""
         system_prompt = """You are a code analysis expert. Analyze the provided code and give:
 1. Code quality assessment
 2. Potential bugs or issues
@@ -62,7 +279,7 @@ class Gemma3nCodingAgent:
 5. Best practices recommendations
 Be specific and actionable."""
 
-        prompt = f"""Please analyze this {Path(file_path).suffix} code:
+        prompt = f"""Please analyze this {Path(file_path).suffix} code{part}:
 
 ```{Path(file_path).suffix}
 {code_content}
@@ -70,7 +287,266 @@ Be specific and actionable."""
 
 File: {file_path}"""
 
-        return self.call_gemma3n(prompt, system_prompt)
+        return prompt, system_prompt
+
+    def analysis_job(self, file_path: str, code_content: str) -> tuple:
+        """(chunks, system_prompt, build_prompt, merge_instructions) for run_chunked"""
+        _, system_prompt = self.analysis_prompts(file_path, "")
+        return (
+            chunk_code(code_content, self.chunk_tokens, str(file_path)),
+            system_prompt,
+            lambda chunk, part: self.analysis_prompts(file_path, chunk["text"], part)[0],
+            f"Combine these analyses of different parts of {file_path} into one analysis with the "
+            "same structure. Remove duplicates and keep the most important findings."
+        )
+
+    def analyze_source(self, file_path: str, code_content: str, stream: Optional[bool] = None,
+                       workers: Optional[int] = None) -> str:
+        """Analyze source text, chunking it when it exceeds the token budget"""
+        return self.run_chunked(*self.analysis_job(file_path, code_content), stream, workers,
+                                cache_kind="analyze", cache_context=str(file_path))
+
+    def analyze_code(self, file_path: str) -> str:
+        """Analyze a code file and provide insights"""
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                code_content = f.read()
+        except Exception as e:
+            return f"Error reading file: {e}"
+
+        return self.analyze_source(file_path, code_content)
+
+    def read_for_record(self, path: Path, record: Dict, max_file_bytes: int) -> Optional[str]:
+        """Source text of a file for a directory report, or None after marking the record skipped"""
+        record["bytes"] = path.stat().st_size
+        if record["bytes"] == 0:
+            record.update(status="skipped", reason="empty")
+            return None
+        if record["bytes"] > max_file_bytes:
+            record.update(status="skipped", reason="too_large")
+            return None
+        if is_binary_file(path):
+            record.update(status="skipped", reason="binary")
+            return None
+        return path.read_text(encoding="utf-8", errors="replace")
+
+    def analyze_file_record(self, path: Path, root: Path, max_file_bytes: int) -> Dict:
+        """Analyze one file for a directory report, never raising"""
+        record = {"path": path.relative_to(root).as_posix(), "bytes": 0}
+        started = time.perf_counter()
+        try:
+            code_content = self.read_for_record(path, record, max_file_bytes)
+            if code_content is not None:
+                # Concurrent output cannot be interleaved on stdout, so never stream here.
+                # Files already run in parallel, so chunks of one file are analyzed in sequence.
+                analysis = self.analyze_source(record["path"], code_content, stream=False, workers=1)
+                if analysis.startswith("Error:"):
+                    record.update(status="error", reason=analysis)
+                else:
+                    record.update(status="ok", analysis=analysis)
+        except Exception as e:
+            record.update(status="error", reason=str(e))
+        finally:
+            record["seconds"] = round(time.perf_counter() - started, 3)
+        return record
+
+    def analyze_directory(self, root: str, include: Optional[List[str]] = None,
+                          exclude: Optional[List[str]] = None,
+                          max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                          max_file_bytes: int = DEFAULT_MAX_FILE_BYTES) -> Iterator[Dict]:
+        """Analyze every matching file under root, yielding records as files finish"""
+        root_path = Path(root).resolve()
+        max_in_flight = max(1, max_in_flight)
+        pending = set()
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for path in iter_source_files(root, include, exclude):
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(executor.submit(self.analyze_file_record, path, root_path, max_file_bytes))
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    async def call_gemma3n_async(self, client: AsyncOllamaClient, prompt: str, system_prompt: str = None,
+                                 timeout: Optional[float] = None) -> str:
+        """call_gemma3n on an asyncio client; a request that exceeds timeout is cancelled"""
+        full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+        try:
+            response = await client.generate(self.model, full_prompt, options=self.options, timeout=timeout)
+            return response.get("response", "")
+        except asyncio.TimeoutError:
+            return f"Error: No response within {timeout} s"
+        except ASYNC_REQUEST_ERRORS as e:
+            return f"Error: {str(e)}"
+
+    async def call_cached_async(self, client: AsyncOllamaClient, kind: Optional[str], content: str,
+                                context: str, prompt: str, system_prompt: str = None,
+                                timeout: Optional[float] = None) -> str:
+        """call_cached on an asyncio client"""
+        if self.store is None or kind is None:
+            return await self.call_gemma3n_async(client, prompt, system_prompt, timeout)
+
+        key = self.store.key(kind, content, context, self.model)
+        cached = self.store.get(key)
+        if cached is not None:
+            return cached
+        result = await self.call_gemma3n_async(client, prompt, system_prompt, timeout)
+        if not result.startswith("Error:"):
+            self.store.put(key, kind, content, self.model, result)
+        return result
+
+    async def run_chunked_async(self, client: AsyncOllamaClient, chunks: List[Dict], system_prompt: str,
+                                build_prompt, merge_instructions: str, cache_kind: Optional[str] = None,
+                                cache_context: str = "", timeout: Optional[float] = None) -> str:
+        """run_chunked on an asyncio client; the client's semaphore bounds the parallel chunks"""
+        if len(chunks) == 1:
+            return await self.call_cached_async(client, cache_kind, chunks[0]["text"], cache_context,
+                                                build_prompt(chunks[0], ""), system_prompt, timeout)
+
+        total = len(chunks)
+        part_kind = f"{cache_kind}:part" if cache_kind else None
+        partials = await asyncio.gather(*(
+            self.call_cached_async(client, part_kind, chunk["text"], cache_context,
+                                   build_prompt(chunk, f" (part {i + 1} of {total}: {chunk['name']})"),
+                                   system_prompt, timeout)
+            for i, chunk in enumerate(chunks)
+        ))
+
+        successful = [
+            f"### Part {i + 1}: {chunk['name']}\n{partial}"
+            for i, (chunk, partial) in enumerate(zip(chunks, partials))
+            if not partial.startswith("Error:")
+        ]
+        if not successful:
+            return partials[0]
+
+        async def reduce_group(group, is_final):
+            prompt = f"{merge_instructions}\n\n" + "\n\n".join(text for _, text in group)
+            return await self.call_gemma3n_async(client, prompt, system_prompt, timeout)
+
+        if self.store is None or not cache_kind:
+            return await tree_reduce_async(list(enumerate(successful)), reduce_group, self.chunk_tokens)
+
+        # Identical partials always merge to the same answer
+        merged_input = "\n\n".join(successful)
+        key = self.store.key(f"{cache_kind}:merged", merged_input, merge_instructions, self.model)
+        cached = self.store.get(key)
+        if cached is not None:
+            return cached
+        result = await tree_reduce_async(list(enumerate(successful)), reduce_group, self.chunk_tokens)
+        if not result.startswith("Error:"):
+            self.store.put(key, f"{cache_kind}:merged", merged_input, self.model, result)
+        return result
+
+    async def analyze_source_async(self, client: AsyncOllamaClient, file_path: str, code_content: str,
+                                   timeout: Optional[float] = None) -> str:
+        """analyze_source on an asyncio client"""
+        return await self.run_chunked_async(client, *self.analysis_job(file_path, code_content),
+                                            cache_kind="analyze", cache_context=str(file_path), timeout=timeout)
+
+    async def analyze_code_async(self, client: AsyncOllamaClient, file_path: str) -> str:
+        """analyze_code on an asyncio client"""
+        try:
+            code_content = await asyncio.to_thread(Path(file_path).read_text, encoding="utf-8")
+        except Exception as e:
+            return f"Error reading file: {e}"
+
+        return await self.analyze_source_async(client, file_path, code_content)
+
+    async def analyze_file_record_async(self, client: AsyncOllamaClient, path: Path, root: Path,
+                                        max_file_bytes: int, timeout: Optional[float] = None) -> Dict:
+        """analyze_file_record on an asyncio client, never raising"""
+        record = {"path": path.relative_to(root).as_posix(), "bytes": 0}
+        started = time.perf_counter()
+        try:
+            code_content = await asyncio.to_thread(self.read_for_record, path, record, max_file_bytes)
+            if code_content is not None:
+                analysis = await self.analyze_source_async(client, record["path"], code_content, timeout)
+                if analysis.startswith("Error:"):
+                    record.update(status="error", reason=analysis)
+                else:
+                    record.update(status="ok", analysis=analysis)
+        except Exception as e:
+            record.update(status="error", reason=str(e))
+        finally:
+            record["seconds"] = round(time.perf_counter() - started, 3)
+        return record
+
+    async def analyze_directory_async(self, root: str, include: Optional[List[str]] = None,
+                                      exclude: Optional[List[str]] = None,
+                                      max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                                      max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+                                      client: Optional[AsyncOllamaClient] = None,
+                                      timeout: Optional[float] = None) -> AsyncIterator[Dict]:
+        """analyze_directory on asyncio, yielding records as files finish.
+
+        At most max_in_flight files are open at once; requests of all files share
+        the client's semaphore, so chunked files cannot flood the server.
+        """
+        own_client = client is None
+        if own_client:
+            client = AsyncOllamaClient(self.ollama_url, max_in_flight)
+        root_path = Path(root).resolve()
+        max_in_flight = max(1, max_in_flight)
+        pending = set()
+        try:
+            for path in iter_source_files(root, include, exclude):
+                if len(pending) >= max_in_flight:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                pending.add(asyncio.ensure_future(
+                    self.analyze_file_record_async(client, path, root_path, max_file_bytes, timeout)))
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if own_client:
+                await client.aclose()
+
+    def write_directory_report(self, records: Iterator[Dict], output: TextIO, report_format: str = "jsonl",
+                               progress: Optional[TextIO] = None) -> Dict[str, int]:
+        """Write records as JSONL (or a JSON array) as they arrive and return status counts"""
+        counts = {"ok": 0, "skipped": 0, "error": 0}
+        started = time.perf_counter()
+        if report_format == "json":
+            output.write("[\n")
+
+        for index, record in enumerate(records):
+            counts[record["status"]] += 1
+            line = json.dumps(record, ensure_ascii=False)
+            if report_format == "json":
+                output.write((",\n" if index else "") + line)
+            else:
+                output.write(line + "\n")
+            output.flush()
+
+            if progress:
+                icon = {"ok": "✅", "skipped": "⏭️", "error": "❌"}[record["status"]]
+                progress.write(f"{icon} {record['path']} ({record['seconds']}s)\n")
+                progress.flush()
+
+        if report_format == "json":
+            output.write("\n]\n")
+            output.flush()
+
+        if progress:
+            elapsed = time.perf_counter() - started
+            total = sum(counts.values())
+            progress.write(
+                f"📋 {total} files in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.2f} files/s): "
+                f"{counts['ok']} analyzed, {counts['skipped']} skipped, {counts['error']} errors\n"
+            )
+        return counts
 
     def generate_code(self, description: str, language: str = "python") -> str:
         """Generate code based on description"""
@@ -99,16 +575,23 @@ Provide:
 3. Fixed code
 4. Prevention tips for similar issues"""
 
-        prompt = f"""Please help debug this code:
+        def build_prompt(chunk, part):
+            prompt = f"""Please help debug this code{part}:
 
 ```
-{code}
+{chunk["text"]}
 ```"""
 
-        if error_message:
-            prompt += f"\n\nError message:\n{error_message}"
+            if error_message:
+                prompt += f"\n\nError message:\n{error_message}"
+            return prompt
 
-        return self.call_gemma3n(prompt, system_prompt)
+        return self.run_chunked(
+            chunk_code(code, self.chunk_tokens), system_prompt, build_prompt,
+            "Combine these debugging notes about different parts of one program. Identify the most "
+            "likely root cause, give the fix, and drop parts that are unrelated to the error.",
+            cache_kind="debug", cache_context=error_message or ""
+        )
 
     def optimize_code(self, code: str) -> str:
         """Optimize code for performance"""
@@ -119,13 +602,17 @@ Provide:
 4. Trade-offs considered
 5. Benchmarking suggestions"""
 
-        prompt = f"""Please optimize this code for better performance:
+        return self.run_chunked(
+            chunk_code(code, self.chunk_tokens), system_prompt,
+            lambda chunk, part: f"""Please optimize this code for better performance{part}:
 
 ```
-{code}
-```"""
-
-        return self.call_gemma3n(prompt, system_prompt)
+{chunk["text"]}
+```""",
+            "Combine these optimization reports for different parts of one program into a single "
+            "report. Keep the optimized code for each part and rank bottlenecks by impact.",
+            cache_kind="optimize"
+        )
 
     def explain_code(self, code: str) -> str:
         """Explain how code works"""
@@ -174,13 +661,17 @@ Provide a thorough review including:
 5. Suggestions for improvement
 6. Positive feedback on good practices"""
 
-        prompt = f"""Please review this pull request diff:
+        return self.run_chunked(
+            chunk_diff(diff_content, self.chunk_tokens), system_prompt,
+            lambda chunk, part: f"""Please review this pull request diff{part}:
 
 ```diff
-{diff_content}
-```"""
-
-        return self.call_gemma3n(prompt, system_prompt)
+{chunk["text"]}
+```""",
+            "Combine these reviews of different parts of one pull request into a single review "
+            "with the same structure. Remove duplicates and order issues by severity.",
+            cache_kind="review"
+        )
 
     def create_project_structure(self, project_name: str, project_type: str) -> str:
         """Create a project structure"""
@@ -202,6 +693,11 @@ Provide the directory tree and essential files with their basic content."""
         print("🤖 Gemma 3n Coding Agent - Interactive Mode")
         print("Type 'help' for commands, 'exit' to quit\n")
 
+        system_prompt = """You are a helpful coding assistant. Provide clear, 
+        practical answers to programming questions. Include code examples when relevant."""
+        self.chat = ChatSession(self.ollama_url, self.model, system_prompt, DEFAULT_HISTORY_TOKENS,
+                                options={"temperature": 0.1, "top_p": 0.9, "num_ctx": DEFAULT_NUM_CTX})
+
         while True:
             try:
                 user_input = input("You: ").strip()
@@ -218,12 +714,13 @@ Provide the directory tree and essential files with their basic content."""
                     self.handle_command(user_input)
                     continue
 
-                # Regular coding question
-                system_prompt = """You are a helpful coding assistant. Provide clear, 
-                practical answers to programming questions. Include code examples when relevant."""
-
-                response = self.call_gemma3n(user_input, system_prompt)
-                print(f"\n🤖 Assistant: {response}\n")
+                # Regular coding question, answered with the conversation so far
+                result = self.print_result("\n🤖 Assistant:", lambda: self.chat_turn(user_input))
+                if self.last_cache_hit is not None:
+                    print(f"⚡ Answered from the semantic cache (similarity {self.last_cache_hit['score']:.2f})")
+                elif not result.startswith("Error") and self.chat.last_stats:
+                    print(f"⏱️  {format_stats(self.chat.last_stats)}")
+                print()
 
             except KeyboardInterrupt:
                 print("\n\nGoodbye! 👋")
@@ -231,6 +728,37 @@ Provide the directory tree and essential files with their basic content."""
             except Exception as e:
                 print(f"Error: {e}")
 
+        if self.semantic_cache is not None:
+            self.semantic_cache.save()
+
+    def chat_turn(self, user_input: str) -> str:
+        """Send one turn of the interactive conversation, or answer it from the semantic cache"""
+        self.last_cache_hit = None
+        # A follow-up's answer depends on the turns before it, so it only matches the same history
+        history = [self.chat.turns] if self.chat.turns else []
+        scope = cache_scope(self.model, self.chat.system_prompt, self.chat.options, *history)
+        if self.semantic_cache is not None:
+            hit = self.semantic_cache.get(user_input, scope)
+            if hit is not None:
+                self.last_cache_hit = hit
+                # Keep the history complete so follow-up questions still have their context
+                self.chat.add_turn(user_input, hit["response"])
+                if self.stream:
+                    print(hit["response"])
+                return hit["response"]
+
+        started = time.perf_counter()
+        try:
+            if self.stream:
+                result = self.stream_to_stdout(self.chat.stream(user_input))
+            else:
+                result = self.chat.send(user_input)
+        except requests.exceptions.RequestException as e:
+            return f"Error: {str(e)}"
+        if self.semantic_cache is not None:
+            self.semantic_cache.put(user_input, result, scope, (time.perf_counter() - started) * 1000)
+        return result
+
     def handle_command(self, command: str):
         """Handle special commands"""
         parts = command.split()
@@ -239,11 +767,48 @@ Provide the directory tree and essential files with their basic content."""
         if cmd == 'analyze' and len(parts) > 1:
             file_path = parts[1]
             if os.path.exists(file_path):
-                result = self.analyze_code(file_path)
-                print(f"\n📊 Analysis for {file_path}:\n{result}\n")
+                self.print_result(f"\n📊 Analysis for {file_path}:", lambda: self.analyze_code(file_path))
+                print()
             else:
                 print(f"File not found: {file_path}")
 
+        elif cmd == 'analyze-dir' and len(parts) > 1:
+            directory = parts[1]
+            report_path = parts[2] if len(parts) > 2 else "gemma3n_analysis.jsonl"
+            if os.path.isdir(directory):
+                with open(report_path, "w", encoding="utf-8") as report:
+                    self.write_directory_report(self.analyze_directory(directory), report, progress=sys.stdout)
+                print(f"Report written to {report_path}\n")
+            else:
+                print(f"Directory not found: {directory}")
+
+        elif cmd == 'stats':
+            print(f"📈 {format_summary(get_metrics().summary())}")
+            if self.semantic_cache is not None:
+                print(f"⚡ Semantic cache: {format_cache_stats(self.semantic_cache.summary())}")
+
+        elif cmd == 'cache':
+            if self.semantic_cache is None:
+                print("Semantic cache is disabled. Start with --semantic-cache to enable it.")
+            elif len(parts) > 1 and parts[1] == 'clear':
+                self.semantic_cache.clear()
+                print("Semantic cache cleared.")
+            else:
+                if self.semantic_cache.disabled_reason:
+                    print(f"⚠️  Semantic cache paused: {self.semantic_cache.disabled_reason}")
+                print(f"⚡ Semantic cache: {format_cache_stats(self.semantic_cache.summary())}")
+
+        elif cmd == 'clear':
+            self.chat.reset()
+            print("Conversation history cleared.")
+
+        elif cmd == 'prune-cache':
+            if self.store is None:
+                print("Analysis cache is disabled.")
+            else:
+                max_age = float(parts[1]) if len(parts) > 1 else None
+                print(f"🧹 Removed {self.store.prune(max_age)} stale cache entries")
+
         elif cmd == 'workspace':
             print(f"Current workspace: {self.workspace}")
             print("Files:")
@@ -261,9 +826,14 @@ Provide the directory tree and essential files with their basic content."""
 General Commands:
   help                    - Show this help message
   exit/quit/bye          - Exit the program
+  /clear                 - Forget the conversation history
+  /stats                 - Show request latency and tokens/sec so far
+  /cache [clear]         - Show semantic cache hit rate and time saved (or empty it)
 
 File Commands:
   /analyze <file>        - Analyze a code file
+  /analyze-dir <dir> [report.jsonl] - Analyze every file in a directory
+  /prune-cache [days]   - Drop cached analyses from old prompts (or unused for N days)
   /workspace            - Show current workspace
 
 Direct Questions:
@@ -283,46 +853,102 @@ Examples:
 def main():
     parser = argparse.ArgumentParser(description="Gemma 3n Local Coding Agent")
     parser.add_argument("--ollama-url", default="http://localhost:11434", 
-                       help="Ollama server URL")
+                       help="Ollama server URL; comma-separate several to balance across them")
     parser.add_argument("--model", default="gemma3n:e4b", 
                        help="Gemma 3n model to use")
     parser.add_argument("--analyze", type=str, 
                        help="Analyze a specific file")
+    parser.add_argument("--analyze-dir", type=str,
+                       help="Analyze every file in a directory (respects .gitignore)")
+    parser.add_argument("--include", action="append",
+                       help="Glob of files to include with --analyze-dir (repeatable)")
+    parser.add_argument("--exclude", action="append",
+                       help="Glob of files to exclude with --analyze-dir (repeatable)")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                       help="Concurrent requests for --analyze-dir")
+    parser.add_argument("--max-file-kb", type=int, default=DEFAULT_MAX_FILE_BYTES // 1024,
+                       help="Skip files larger than this with --analyze-dir")
+    parser.add_argument("--output", type=str,
+                       help="Report file for --analyze-dir (default: stdout)")
+    parser.add_argument("--format", choices=["jsonl", "json"], default="jsonl",
+                       help="Report format for --analyze-dir")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Do not reuse or store analysis results")
+    parser.add_argument("--cache-path", default=str(DEFAULT_STORE_PATH),
+                       help="SQLite file for stored analysis results")
+    parser.add_argument("--prune-cache", nargs="?", type=float, const=-1, metavar="DAYS",
+                       help="Remove stored results from old prompt versions (and unused for DAYS) then exit")
     parser.add_argument("--generate", type=str, 
                        help="Generate code based on description")
     parser.add_argument("--language", default="python", 
                        help="Programming language for code generation")
     parser.add_argument("--interactive", action="store_true", 
                        help="Start interactive chat mode")
+    parser.add_argument("--no-stream", action="store_true",
+                       help="Print responses only once they are complete")
+    parser.add_argument("--semantic-cache", action="store_true",
+                       help="Answer chat questions similar to earlier ones from their cached answers")
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_THRESHOLD,
+                       help="Cosine similarity needed for a semantic cache hit (0-1)")
+    parser.add_argument("--embed-model", default=DEFAULT_EMBED_MODEL,
+                       help="Ollama embedding model for the semantic cache")
 
     args = parser.parse_args()
 
     # Initialize the coding agent
-    agent = Gemma3nCodingAgent(args.ollama_url, args.model)
+    agent = Gemma3nCodingAgent(args.ollama_url, args.model, stream=not args.no_stream)
+    agent.max_in_flight = args.max_in_flight
+    if not args.no_cache:
+        agent.store = AnalysisStore(Path(args.cache_path), PROMPT_TEMPLATE_VERSION)
+    if args.semantic_cache:
+        agent.semantic_cache = SemanticCache(args.ollama_url, args.embed_model, args.similarity_threshold,
+                                             directory=DEFAULT_SEMANTIC_CACHE_DIR)
+
+    if args.prune_cache is not None:
+        if agent.store is None:
+            print("❌ --prune-cache cannot be combined with --no-cache")
+            sys.exit(1)
+        max_age = args.prune_cache if args.prune_cache >= 0 else None
+        print(f"🧹 Removed {agent.store.prune(max_age)} stale entries from {args.cache_path}")
+        return
 
     # Check if Ollama is accessible
     try:
-        response = requests.get(f"{args.ollama_url}/api/tags")
-        response.raise_for_status()
+        get_client(args.ollama_url).list_models()
     except requests.exceptions.RequestException:
         print(f"❌ Error: Cannot connect to Ollama at {args.ollama_url}")
         print("Please make sure Ollama is running and Gemma 3n is installed.")
         sys.exit(1)
 
-    print("✅ Connected to Ollama successfully!")
+    # Keep stdout clean for the machine-readable report
+    status_stream = sys.stderr if args.analyze_dir and not args.output else sys.stdout
+    print("✅ Connected to Ollama successfully!", file=status_stream)
+
+    if args.analyze_dir:
+        if not os.path.isdir(args.analyze_dir):
+            print(f"❌ Directory not found: {args.analyze_dir}", file=sys.stderr)
+            sys.exit(1)
+
+        records = agent.analyze_directory(
+            args.analyze_dir, args.include, args.exclude,
+            max_in_flight=args.max_in_flight, max_file_bytes=args.max_file_kb * 1024
+        )
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as report:
+                agent.write_directory_report(records, report, args.format, progress=sys.stderr)
+        else:
+            agent.write_directory_report(records, sys.stdout, args.format, progress=sys.stderr)
 
-    if args.analyze:
+    elif args.analyze:
         if os.path.exists(args.analyze):
             print(f"🔍 Analyzing {args.analyze}...")
-            result = agent.analyze_code(args.analyze)
-            print(f"\nAnalysis Result:\n{result}")
+            agent.print_result("\nAnalysis Result:", lambda: agent.analyze_code(args.analyze))
         else:
             print(f"❌ File not found: {args.analyze}")
 
     elif args.generate:
         print(f"🛠️ Generating {args.language} code...")
-        result = agent.generate_code(args.generate, args.language)
-        print(f"\nGenerated Code:\n{result}")
+        agent.print_result("\nGenerated Code:", lambda: agent.generate_code(args.generate, args.language))
 
     elif args.interactive:
         agent.interactive_chat()
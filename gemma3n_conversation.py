@@ -0,0 +1,114 @@
+"""
+Gemma 3n Conversation
+Chat sessions over /api/chat that keep a stable, token-budgeted history prefix
+"""
+
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+from gemma3n_chunking import estimate_tokens
+from gemma3n_client import get_client
+
+DEFAULT_HISTORY_TOKENS = 2000
+# When the budget is exceeded, history is cut down to this fraction of it at once
+TRIM_TO_FRACTION = 0.5
+
+def turn_stats(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Token counts and timings (ms) from the final /api/chat or /api/generate chunk"""
+    return {
+        "prompt_tokens": response.get("prompt_eval_count", 0),
+        "prompt_eval_ms": response.get("prompt_eval_duration", 0) / 1e6,
+        "eval_tokens": response.get("eval_count", 0),
+        "eval_ms": response.get("eval_duration", 0) / 1e6,
+        "total_ms": response.get("total_duration", 0) / 1e6,
+    }
+
+def format_stats(stats: Dict[str, Any]) -> str:
+    """One-line summary of a turn's prompt evaluation and generation"""
+    if not stats:
+        return ""
+    tokens_per_second = stats["eval_tokens"] / (stats["eval_ms"] / 1000) if stats["eval_ms"] else 0
+    return (f"prompt eval: {stats['prompt_tokens']} new tokens in {stats['prompt_eval_ms']:.0f} ms "
+            f"(history {stats['history_tokens']} tokens, {stats['history_turns']} turns) · "
+            f"{stats['eval_tokens']} tokens generated at {tokens_per_second:.1f} tokens/s")
+
+class ChatSession:
+    """Multi-turn conversation sent as structured messages to /api/chat.
+
+    Ollama reuses the KV cache for the longest prompt prefix it has already
+    processed, so each turn only evaluates the new messages as long as the
+    history sent is the previous one plus the last exchange. A sliding "last N"
+    window would shift the prefix every turn; instead the oldest turns are
+    dropped in one step down to TRIM_TO_FRACTION of the budget, which keeps the
+    prefix stable for the following turns.
+    """
+
+    def __init__(self, ollama_url: str, model: str, system_prompt: Optional[str] = None,
+                 max_history_tokens: int = DEFAULT_HISTORY_TOKENS,
+                 options: Optional[Dict[str, Any]] = None):
+        self.ollama_url = ollama_url
+        self.model = model
+        self.system_prompt = system_prompt
+        self.max_history_tokens = max_history_tokens
+        self.options = options
+        self.turns: List[Dict[str, str]] = []
+        self.last_stats: Dict[str, Any] = {}
+        # Keeps the conversation on one server of a backend pool even after history is trimmed
+        self.session_id = uuid.uuid4().hex
+
+    def history_tokens(self) -> int:
+        return sum(estimate_tokens(t["user"]) + estimate_tokens(t["assistant"]) for t in self.turns)
+
+    def messages(self, content: str) -> List[Dict[str, str]]:
+        """Messages for a new user turn: system prompt, history, then the turn itself"""
+        messages = [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn["user"]})
+            messages.append({"role": "assistant", "content": turn["assistant"]})
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    def add_turn(self, user: str, assistant: str):
+        self.turns.append({"user": user, "assistant": assistant})
+        if self.history_tokens() > self.max_history_tokens:
+            target = self.max_history_tokens * TRIM_TO_FRACTION
+            while self.turns and self.history_tokens() > target:
+                self.turns.pop(0)
+
+    def reset(self):
+        self.turns = []
+        self.last_stats = {}
+        self.session_id = uuid.uuid4().hex
+
+    def _finish_turn(self, content: str, reply: str, response: Dict[str, Any]):
+        self.last_stats = {
+            **turn_stats(response),
+            "history_tokens": self.history_tokens(),
+            "history_turns": len(self.turns),
+        }
+        self.add_turn(content, reply)
+
+    def send(self, content: str) -> str:
+        """Send a user turn and return the reply; raises RequestException on failure"""
+        response = get_client(self.ollama_url).chat(self.model, self.messages(content), self.options,
+                                                    self.session_id)
+        reply = response.get("message", {}).get("content", "")
+        self._finish_turn(content, reply, response)
+        return reply
+
+    def stream(self, content: str) -> Iterator[str]:
+        """Send a user turn, yielding the reply as it is generated.
+
+        The turn joins the history only once the reply is complete, so an
+        abandoned or failed stream leaves the conversation unchanged.
+        """
+        parts = []
+        chunks = get_client(self.ollama_url).chat_stream(self.model, self.messages(content), self.options,
+                                                         self.session_id)
+        for chunk in chunks:
+            text = chunk.get("message", {}).get("content", "")
+            if text:
+                parts.append(text)
+                yield text
+            if chunk.get("done"):
+                self._finish_turn(content, "".join(parts), chunk)
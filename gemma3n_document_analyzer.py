@@ -1,135 +1,618 @@
 import streamlit as st
 import requests
-import base64
-import io
+import asyncio
 import fitz  # PyMuPDF
 from PIL import Image
 import pandas as pd
 import json
 import tempfile
 import os
-from typing import List, Dict, Any
-
-# Document Intelligence App powered by Gemma 3n
-st.set_page_config(
-    page_title="Gemma 3n Document Analyzer",
-    page_icon="📄",
-    layout="wide"
-)
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, AsyncIterator, Iterable, Iterator, Optional, Union
+from gemma3n_async_client import ASYNC_REQUEST_ERRORS, AsyncOllamaClient
+from gemma3n_cache import ResultCache, make_cache_key
+from gemma3n_client import get_client
+from gemma3n_image import DEFAULT_FORMAT, DEFAULT_MAX_SIDE, DEFAULT_QUALITY, open_image, prepare_image
+from gemma3n_chunking import tree_reduce
+from gemma3n_jobs import JobQueue, start_worker_process
+from gemma3n_metrics import render_streamlit_panel
+from gemma3n_retrieval import (DEFAULT_EMBED_MODEL, DEFAULT_INDEX_DIR, VectorIndex,
+                               build_qa_prompt, chunk_text, embed_texts)
+
+# Match Ollama's own request parallelism so extra pages queue client-side
+DEFAULT_MAX_IN_FLIGHT = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+# Longest side of the preview kept per page once analysis is done
+THUMBNAIL_SIZE = 400
+# A page needs this much extractable text to skip the vision encoder...
+MIN_TEXT_CHARS = 200
+# ...and images may cover at most this fraction of it
+MAX_IMAGE_COVERAGE = 0.3
+# Token budget for the partial results merged by one reduce call
+DEFAULT_REDUCE_TOKENS = 3000
+# Context window requested for reduce calls so the budget plus the answer fit
+REDUCE_NUM_CTX = 8192
+
+class TextPage:
+    """A born-digital PDF page sent to the model as its text layer instead of pixels"""
+
+    def __init__(self, text: str, tables: List[str], thumbnail: Image.Image):
+        self.text = text
+        self.tables = tables
+        self.thumbnail = thumbnail
+
+    def as_prompt_context(self) -> str:
+        context = f"Page text (extracted from the PDF text layer):\n```\n{self.text}\n```"
+        if self.tables:
+            context += "\n\nTables on this page (markdown):\n" + "\n\n".join(self.tables)
+        return context
+
+Page = Union[Image.Image, TextPage]
+
+def _table_to_markdown(rows: List[List[Any]]) -> str:
+    cells = [["" if cell is None else str(cell).replace("\n", " ") for cell in row] for row in rows]
+    if not cells:
+        return ""
+    lines = ["| " + " | ".join(cells[0]) + " |", "|" + " --- |" * len(cells[0])]
+    lines += ["| " + " | ".join(row) + " |" for row in cells[1:]]
+    return "\n".join(lines)
+
+def extract_tables(page) -> List[str]:
+    """Markdown tables detected on a PDF page (empty with older PyMuPDF versions)"""
+    try:
+        tables = page.find_tables()
+    except AttributeError:
+        return []
+    return [md for md in (_table_to_markdown(t.extract()) for t in tables.tables) if md]
+
+def image_coverage(page) -> float:
+    """Fraction of the page area covered by embedded images"""
+    page_area = abs(page.rect) or 1
+    covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    return min(1.0, covered / page_area)
+
+class PdfPageSource:
+    """Lazily rendered PDF pages; each page is rasterized only when iterated to.
+
+    In hybrid mode pages with a usable text layer and few images are yielded as
+    TextPage objects, so only scanned or figure-heavy pages are rasterized.
+    Pages listed in skip_pages (0-based) are yielded as None without rendering.
+    """
+
+    def __init__(self, pdf_bytes: bytes, zoom: float = 2, hybrid: bool = True,
+                 min_text_chars: int = MIN_TEXT_CHARS, include_tables: bool = True,
+                 skip_pages: Iterable[int] = ()):
+        self.pdf_bytes = pdf_bytes
+        self.zoom = zoom
+        self.hybrid = hybrid
+        self.min_text_chars = min_text_chars
+        self.include_tables = include_tables
+        self.skip_pages = set(skip_pages)
+        self.route_stats = {"text": 0, "vision": 0}
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+            self.page_count = len(pdf_document)
+
+    def __len__(self) -> int:
+        return self.page_count
+
+    def text_page(self, page) -> Optional[TextPage]:
+        """Return the page as a TextPage when its text layer is good enough"""
+        text = page.get_text("text", sort=True).strip()
+        if len(text) < self.min_text_chars or image_coverage(page) > MAX_IMAGE_COVERAGE:
+            return None
+
+        tables = extract_tables(page) if self.include_tables else []
+        # A low-zoom render is enough for the preview and costs little
+        thumb_zoom = THUMBNAIL_SIZE / max(page.rect.width, page.rect.height)
+        pix = page.get_pixmap(matrix=fitz.Matrix(thumb_zoom, thumb_zoom))
+        thumbnail = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        return TextPage(text, tables, thumbnail)
+
+    def __iter__(self) -> Iterator[Optional[Page]]:
+        pdf_document = fitz.open(stream=self.pdf_bytes, filetype="pdf")
+        try:
+            mat = fitz.Matrix(self.zoom, self.zoom)
+            for page_num in range(len(pdf_document)):
+                if page_num in self.skip_pages:
+                    yield None
+                    continue
+                page = pdf_document.load_page(page_num)
+                if self.hybrid:
+                    text_page = self.text_page(page)
+                    if text_page is not None:
+                        self.route_stats["text"] += 1
+                        yield text_page
+                        continue
+
+                pix = page.get_pixmap(matrix=mat)
+                # Build the image straight from the raw samples instead of a PNG round trip
+                img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+                del pix
+                self.route_stats["vision"] += 1
+                yield img
+        finally:
+            pdf_document.close()
+
+# End of a page iterator read with next() in a worker thread
+_NO_PAGE = object()
+
+def make_thumbnail(page: Page, size: int = THUMBNAIL_SIZE) -> Image.Image:
+    """Return a small copy of a page image for display"""
+    if isinstance(page, TextPage):
+        return page.thumbnail
+    thumbnail = page.copy()
+    thumbnail.thumbnail((size, size))
+    return thumbnail
+
+def page_route(page: Page) -> str:
+    return "text" if isinstance(page, TextPage) else "vision"
 
 class DocumentAnalyzer:
-    def __init__(self, ollama_url: str, model: str):
+    def __init__(self, ollama_url: str, model: str, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 cache: Optional[ResultCache] = None):
         self.ollama_url = ollama_url
         self.model = model
-
-    def call_gemma3n(self, prompt: str, image_data: str = None) -> str:
-        """Call Gemma 3n via Ollama with optional image"""
-        payload = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.3,
-                "top_p": 0.9
-            }
+        self.max_in_flight = max(1, max_in_flight)
+        self.cache = cache
+        self.options = {
+            "temperature": 0.3,
+            "top_p": 0.9
+        }
+        # Passed to prepare_image; text pages are converted to grayscale automatically
+        self.image_options = {
+            "max_side": DEFAULT_MAX_SIDE,
+            "image_format": DEFAULT_FORMAT,
+            "quality": DEFAULT_QUALITY
         }
+        self.transfer_stats = {"pages": 0, "original_bytes": 0, "encoded_bytes": 0}
+        self._stats_lock = threading.Lock()
 
-        if image_data:
-            payload["images"] = [image_data]
+    def call_gemma3n(self, prompt: str, image_data: str = None, options: Optional[Dict] = None) -> str:
+        """Call Gemma 3n via Ollama with optional image"""
+        images = [image_data] if image_data else None
 
         try:
-            response = requests.post(f"{self.ollama_url}/api/generate", json=payload)
-            response.raise_for_status()
-            return response.json().get("response", "No response generated")
+            response = get_client(self.ollama_url).generate(self.model, prompt, images, options or self.options)
+            return response.get("response", "No response generated")
         except requests.exceptions.RequestException as e:
             return f"Error: {str(e)}"
 
-    def extract_pdf_pages(self, pdf_file) -> List[Image.Image]:
-        """Extract pages from PDF as images"""
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        pages = []
+    def iter_pdf_pages(self, pdf_file, hybrid: bool = True) -> PdfPageSource:
+        """Return a lazy page source for a PDF upload"""
+        # getvalue() does not depend on the read position, so an upload can be reused
+        pdf_bytes = pdf_file.getvalue() if hasattr(pdf_file, "getvalue") else pdf_file.read()
+        return PdfPageSource(pdf_bytes, hybrid=hybrid)
+
+    def extract_pdf_pages(self, pdf_file, hybrid: bool = True) -> List[Page]:
+        """Extract all pages of a PDF: TextPage where the text layer suffices, otherwise an image"""
+        return list(self.iter_pdf_pages(pdf_file, hybrid=hybrid))
+
+    def build_prompt(self, analysis_type: str, page_number: int) -> str:
+        """Build the analysis prompt for a single page"""
+        if analysis_type == "summary":
+            return f"""Please provide a concise summary of the content shown in this document page {page_number}. 
+            Focus on key points, main topics, and important information."""
+
+        elif analysis_type == "extract_data":
+            return f"""Extract structured data from this document page {page_number}. 
+            Look for tables, lists, key-value pairs, dates, numbers, and names. 
+            Present the extracted data in a clear, organized format."""
+
+        elif analysis_type == "questions":
+            return f"""Based on the content of this document page {page_number}, generate 5 relevant questions 
+            that could be answered using the information shown. Include both factual and analytical questions."""
+
+        elif analysis_type == "translation":
+            return f"""Identify the language of this document page {page_number} and provide an English translation 
+            if it's in another language. If it's already in English, provide a summary instead."""
+
+        elif analysis_type == "compliance":
+            return f"""Analyze this document page {page_number} for potential compliance issues, 
+            legal concerns, or regulatory requirements. Look for dates, signatures, 
+            terms and conditions, and any compliance-related content."""
+
+        else:  # custom analysis
+            return f"""Analyze this document page {page_number} and provide insights about: {analysis_type}"""
+
+    def encode_page(self, page: Image.Image) -> str:
+        """Downscale and re-encode a page image as base64 for the model"""
+        prepared = prepare_image(page, **self.image_options)
+        with self._stats_lock:
+            self.transfer_stats["pages"] += 1
+            self.transfer_stats["original_bytes"] += prepared["original_bytes"]
+            self.transfer_stats["encoded_bytes"] += prepared["encoded_bytes"]
+        return prepared["data"]
+
+    def page_prompt(self, page_index: int, page: Page, analysis_type: str) -> str:
+        """Full prompt for a page; text-layer pages carry their text inline"""
+        prompt = self.build_prompt(analysis_type, page_index + 1)
+        if isinstance(page, TextPage):
+            prompt += "\n\n" + page.as_prompt_context()
+        return prompt
+
+    def page_images(self, page: Page) -> Optional[List[str]]:
+        """Images to upload for a page; text-layer pages need none"""
+        if isinstance(page, TextPage):
+            return None
+        return [self.encode_page(page)]
+
+    def page_cache_key(self, page: Page, prompt: str) -> Optional[str]:
+        """Cache key for a page analysis, or None when caching is disabled"""
+        if self.cache is None:
+            return None
+        if isinstance(page, TextPage):
+            # The prompt already contains the page text and tables
+            return make_cache_key("text", self.model, prompt, self.options)
+        # Keyed on rendered pixels, so identical pages hit across uploads
+        return make_cache_key(page.mode, page.size, page.tobytes(), self.model, prompt,
+                              self.options, self.image_options)
+
+    def analyze_page(self, page_index: int, page: Page, analysis_type: str) -> Dict:
+        """Analyze a single page; errors are reported in the result instead of raised"""
+        try:
+            prompt = self.page_prompt(page_index, page, analysis_type)
+            cache_key = self.page_cache_key(page, prompt)
+            analysis = self.cache.get(cache_key) if cache_key else None
+
+            if analysis is None:
+                images = self.page_images(page)
+                analysis = self.call_gemma3n(prompt, images[0] if images else None)
+                if cache_key is not None and not analysis.startswith("Error:"):
+                    self.cache.set(cache_key, analysis)
+        except Exception as e:
+            analysis = f"Error: {str(e)}"
+
+        # Only a thumbnail outlives the analysis; the full-size page is released
+        return {
+            "page": page_index + 1,
+            "analysis": analysis,
+            "route": page_route(page),
+            "thumbnail": make_thumbnail(page)
+        }
 
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            mat = fitz.Matrix(2, 2)  # Zoom factor
-            pix = page.get_pixmap(matrix=mat)
-            img_data = pix.tobytes("png")
-            img = Image.open(io.BytesIO(img_data))
-            pages.append(img)
+    def analyze_document_content(self, pages: Iterable[Page], analysis_type: str,
+                                 concurrent: bool = True) -> List[Dict]:
+        """Analyze document pages based on type, returning results in page order"""
+        return self.map_pages(pages, lambda i, page: self.analyze_page(i, page, analysis_type), concurrent)
 
-        pdf_document.close()
-        return pages
+    def map_pages(self, pages: Iterable[Page], fn, concurrent: bool = True) -> List[Any]:
+        """Apply fn(page_index, page) to every page, returning results in page order"""
+        if not concurrent or self.max_in_flight == 1:
+            return [fn(i, page) for i, page in enumerate(pages)]
 
-    def analyze_document_content(self, pages: List[Image.Image], analysis_type: str) -> List[Dict]:
-        """Analyze document pages based on type"""
+        # Encoding of one page overlaps with inference of the others. At most
+        # max_in_flight pages are rendered and outstanding against Ollama at any
+        # time, so a lazy page source is never rasterized far ahead of analysis.
         results = []
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            for i, page in enumerate(pages):
+                if len(pending) >= self.max_in_flight:
+                    results.append(pending.popleft().result())
+                pending.append(executor.submit(fn, i, page))
+            while pending:
+                results.append(pending.popleft().result())
 
-        for i, page in enumerate(pages):
-            # Convert image to base64
-            img_buffer = io.BytesIO()
-            page.save(img_buffer, format='PNG')
-            img_data = base64.b64encode(img_buffer.getvalue()).decode()
-
-            # Generate prompt based on analysis type
-            if analysis_type == "summary":
-                prompt = f"""Please provide a concise summary of the content shown in this document page {i+1}. 
-                Focus on key points, main topics, and important information."""
-
-            elif analysis_type == "extract_data":
-                prompt = f"""Extract structured data from this document page {i+1}. 
-                Look for tables, lists, key-value pairs, dates, numbers, and names. 
-                Present the extracted data in a clear, organized format."""
-
-            elif analysis_type == "questions":
-                prompt = f"""Based on the content of this document page {i+1}, generate 5 relevant questions 
-                that could be answered using the information shown. Include both factual and analytical questions."""
-
-            elif analysis_type == "translation":
-                prompt = f"""Identify the language of this document page {i+1} and provide an English translation 
-                if it's in another language. If it's already in English, provide a summary instead."""
-
-            elif analysis_type == "compliance":
-                prompt = f"""Analyze this document page {i+1} for potential compliance issues, 
-                legal concerns, or regulatory requirements. Look for dates, signatures, 
-                terms and conditions, and any compliance-related content."""
-
-            else:  # custom analysis
-                prompt = f"""Analyze this document page {i+1} and provide insights about: {analysis_type}"""
-
-            # Get analysis
-            analysis = self.call_gemma3n(prompt, img_data)
-
-            results.append({
-                "page": i + 1,
-                "analysis": analysis,
-                "image": page
-            })
+        return results
+
+    async def call_gemma3n_async(self, client: AsyncOllamaClient, prompt: str, image_data: str = None,
+                                 options: Optional[Dict] = None, timeout: Optional[float] = None) -> str:
+        """call_gemma3n on an asyncio client; a request that exceeds timeout is cancelled"""
+        images = [image_data] if image_data else None
 
+        try:
+            response = await client.generate(self.model, prompt, images, options or self.options, timeout)
+            return response.get("response", "No response generated")
+        except asyncio.TimeoutError:
+            return f"Error: No response within {timeout} s"
+        except ASYNC_REQUEST_ERRORS as e:
+            return f"Error: {str(e)}"
+
+    async def analyze_page_async(self, client: AsyncOllamaClient, page_index: int, page: Page,
+                                 analysis_type: str, timeout: Optional[float] = None) -> Dict:
+        """analyze_page on an asyncio client; image encoding runs in a worker thread"""
+        try:
+            prompt = self.page_prompt(page_index, page, analysis_type)
+            cache_key = self.page_cache_key(page, prompt)
+            analysis = self.cache.get(cache_key) if cache_key else None
+
+            if analysis is None:
+                images = await asyncio.to_thread(self.page_images, page)
+                analysis = await self.call_gemma3n_async(client, prompt, images[0] if images else None,
+                                                         timeout=timeout)
+                if cache_key is not None and not analysis.startswith("Error:"):
+                    self.cache.set(cache_key, analysis)
+        except Exception as e:
+            analysis = f"Error: {str(e)}"
+
+        return {
+            "page": page_index + 1,
+            "analysis": analysis,
+            "route": page_route(page),
+            "thumbnail": make_thumbnail(page)
+        }
+
+    async def analyze_document_content_async(self, pages: Iterable[Page], analysis_type: str,
+                                             client: Optional[AsyncOllamaClient] = None,
+                                             timeout: Optional[float] = None) -> List[Dict]:
+        """analyze_document_content on asyncio, returning results in page order.
+
+        Pages are read (and rendered) in a worker thread only as the window of
+        max_in_flight pages moves, as in map_pages. Pass a shared client to bound
+        the requests of many documents analyzed at once with its semaphore.
+        """
+        if client is None:
+            async with AsyncOllamaClient(self.ollama_url, self.max_in_flight) as own_client:
+                return await self.analyze_document_content_async(pages, analysis_type, own_client, timeout)
+
+        iterator = iter(pages)
+        results = []
+        pending = deque()
+        try:
+            for page_index in itertools.count():
+                if len(pending) >= self.max_in_flight:
+                    results.append(await pending.popleft())
+                page = await asyncio.to_thread(next, iterator, _NO_PAGE)
+                if page is _NO_PAGE:
+                    break
+                pending.append(asyncio.ensure_future(
+                    self.analyze_page_async(client, page_index, page, analysis_type, timeout)))
+            while pending:
+                results.append(await pending.popleft())
+        finally:
+            # Cancelled from outside: stop the requests still running
+            for task in pending:
+                task.cancel()
         return results
 
-# Streamlit UI
-st.title("📄 Gemma 3n Document Analyzer")
-st.markdown("Upload documents and get AI-powered analysis using Gemma 3n's multimodal capabilities!")
-
-# Sidebar configuration
-st.sidebar.title("Configuration")
-ollama_url = st.sidebar.text_input("Ollama URL", "http://localhost:11434")
-model_name = st.sidebar.selectbox("Gemma 3n Model", ["gemma3n:e4b", "gemma3n:e2b"])
-
-# Initialize analyzer
-if 'analyzer' not in st.session_state:
-    st.session_state.analyzer = DocumentAnalyzer(ollama_url, model_name)
-
-# File upload
-st.subheader("📁 Upload Document")
-uploaded_file = st.file_uploader(
-    "Choose a document", 
-    type=['pdf', 'png', 'jpg', 'jpeg'],
-    help="Upload PDF documents or images for analysis"
-)
-
-if uploaded_file is not None:
-    # Analysis type selection
+    def stream_page(self, page_index: int, page: Page, analysis_type: str) -> Iterator[str]:
+        """Analyze a single page, yielding the analysis text as it is generated"""
+        prompt = self.page_prompt(page_index, page, analysis_type)
+        cache_key = self.page_cache_key(page, prompt)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts = []
+        try:
+            for chunk in get_client(self.ollama_url).generate_stream(
+                    self.model, prompt, self.page_images(page), self.options):
+                parts.append(chunk)
+                yield chunk
+        except requests.exceptions.RequestException as e:
+            yield f"Error: {str(e)}"
+            return
+
+        if cache_key is not None and parts:
+            self.cache.set(cache_key, "".join(parts))
+
+    async def stream_page_async(self, client: AsyncOllamaClient, page_index: int, page: Page,
+                                analysis_type: str) -> AsyncIterator[str]:
+        """stream_page on an asyncio client; closing the iterator cancels the generation"""
+        prompt = self.page_prompt(page_index, page, analysis_type)
+        cache_key = self.page_cache_key(page, prompt)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts = []
+        images = await asyncio.to_thread(self.page_images, page)
+        chunks = client.generate_stream(self.model, prompt, images, self.options)
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        except ASYNC_REQUEST_ERRORS as e:
+            yield f"Error: {str(e)}"
+            return
+        finally:
+            await chunks.aclose()
+
+        if cache_key is not None and parts:
+            self.cache.set(cache_key, "".join(parts))
+
+    def reduce_prompt(self, analysis_type: str, sections: List[str], is_final: bool) -> str:
+        """Prompt that merges partial results from consecutive page ranges"""
+        if analysis_type == "summary":
+            task = """Combine these summaries of consecutive parts of one document into a single,
+            coherent summary. Keep the key points, main topics and important information."""
+        elif analysis_type == "extract_data":
+            task = """Merge the structured data extracted from consecutive parts of one document into
+            a single consolidated result. Remove duplicates and keep the clear, organized format."""
+        elif analysis_type == "questions":
+            task = """These are questions generated from consecutive parts of one document. Select and
+            refine them into the 10 best questions covering the material, mixing factual and analytical ones."""
+        elif analysis_type == "translation":
+            task = """Combine these per-part language findings and translations into one report of the
+            languages used and an English rendering of the content."""
+        elif analysis_type == "compliance":
+            task = """Consolidate these compliance reviews of consecutive parts of one document into a
+            single compliance report. Remove duplicates, order issues by severity and cite page numbers."""
+        else:
+            task = f"""Combine these partial findings from consecutive parts of one document into a single
+            answer about: {analysis_type}"""
+
+        scope = "the whole document" if is_final else "this range of pages"
+        return f"{task}\nThe result must describe {scope}.\n\n" + "\n\n".join(sections)
+
+    def call_reduce(self, prompt: str) -> str:
+        """Run one reduce call, reusing a cached answer when available"""
+        options = {**self.options, "num_ctx": REDUCE_NUM_CTX}
+        cache_key = make_cache_key("reduce", self.model, prompt, options) if self.cache is not None else None
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        answer = self.call_gemma3n(prompt, options=options)
+        if cache_key and not answer.startswith("Error:"):
+            self.cache.set(cache_key, answer)
+        return answer
+
+    def analyze_whole_document(self, pages: Iterable[Page], analysis_type: str,
+                               reduce_tokens: int = DEFAULT_REDUCE_TOKENS) -> Dict:
+        """Map each page concurrently, then tree-reduce the page results into one answer"""
+        page_results = self.analyze_document_content(pages, analysis_type)
+        items = [
+            ((r["page"], r["page"]), r["analysis"])
+            for r in page_results if not r["analysis"].startswith("Error:")
+        ]
+
+        def label(pages_range):
+            first, last = pages_range
+            return f"Page {first}" if first == last else f"Pages {first}-{last}"
+
+        def reduce_group(group, is_final):
+            sections = [f"### {label(key)}\n{text}" for key, text in group]
+            return self.call_reduce(self.reduce_prompt(analysis_type, sections, is_final))
+
+        if not items:
+            answer = "Error: no page could be analyzed"
+        else:
+            answer = tree_reduce(items, reduce_group, reduce_tokens, self.max_in_flight,
+                                 merge_key=lambda keys: (keys[0][0], keys[-1][1]))
+
+        return {"answer": answer, "pages": page_results}
+
+    def page_text(self, page_index: int, page: Page) -> Optional[str]:
+        """Text of a page: the PDF text layer when available, otherwise transcribed by the model.
+
+        Returns None when the transcription failed, so callers can tell a failed
+        page from a blank one.
+        """
+        if isinstance(page, TextPage):
+            return page.text
+
+        prompt = """Transcribe all text on this document page verbatim, in reading order.
+        Render tables as markdown. Output only the transcription."""
+        cache_key = self.page_cache_key(page, prompt)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        text = self.call_gemma3n(prompt, self.encode_page(page))
+        if text.startswith("Error:"):
+            return None
+        if cache_key:
+            self.cache.set(cache_key, text)
+        return text
+
+    def build_index(self, pages: Iterable[Page], document_key: str,
+                    embed_model: str = DEFAULT_EMBED_MODEL) -> VectorIndex:
+        """Build (or load) the retrieval index for a document.
+
+        Page text is extracted or transcribed once, chunked, embedded and saved
+        under DEFAULT_INDEX_DIR/document_key so later questions skip all of it.
+        Pages that failed to transcribe are listed in index.missing_pages, and
+        such an index is not saved, so the next build retries them.
+        """
+        index_dir = DEFAULT_INDEX_DIR / document_key
+        index = VectorIndex.load(index_dir)
+        if index is not None and index.embed_model == embed_model:
+            return index
+
+        page_texts = self.map_pages(pages, self.page_text)
+        records = [
+            {"page": page_number, "text": chunk}
+            for page_number, text in enumerate(page_texts, start=1) if text is not None
+            for chunk in chunk_text(text)
+        ]
+        vectors = embed_texts(get_client(self.ollama_url), embed_model,
+                              [r["text"] for r in records], self.max_in_flight)
+        index = VectorIndex(vectors, records, embed_model)
+        index.missing_pages = [page_number for page_number, text in enumerate(page_texts, start=1) if text is None]
+        if not index.missing_pages:
+            index.save(index_dir)
+        return index
+
+    def ask_document(self, index: VectorIndex, question: str, k: int = 4) -> Dict:
+        """Answer a question from the top-k retrieved chunks only"""
+        try:
+            query = get_client(self.ollama_url).embed(index.embed_model, question)
+        except requests.exceptions.RequestException as e:
+            return {"answer": f"Error: {str(e)}", "sources": []}
+
+        hits = index.search(query, k)
+        if not hits:
+            return {"answer": "No text could be extracted from this document.", "sources": []}
+        return {"answer": self.call_gemma3n(build_qa_prompt(question, hits)), "sources": hits}
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    return ResultCache()
+
+@st.cache_resource
+def get_job_queue() -> JobQueue:
+    return JobQueue()
+
+def main():
+    """Streamlit UI for the document analyzer"""
+    # Document Intelligence App powered by Gemma 3n
+    st.set_page_config(
+        page_title="Gemma 3n Document Analyzer",
+        page_icon="📄",
+        layout="wide"
+    )
+
+    # Streamlit UI
+    st.title("📄 Gemma 3n Document Analyzer")
+    st.markdown("Upload documents and get AI-powered analysis using Gemma 3n's multimodal capabilities!")
+
+    # Sidebar configuration
+    st.sidebar.title("Configuration")
+    ollama_url = st.sidebar.text_input("Ollama URL", "http://localhost:11434",
+                                       help="Comma-separate several servers to balance requests across them")
+    model_name = st.sidebar.selectbox("Gemma 3n Model", ["gemma3n:e4b", "gemma3n:e2b"])
+    embed_model = st.sidebar.text_input("Embedding Model", DEFAULT_EMBED_MODEL,
+                                        help="Ollama embedding model used by Ask the Document")
+    max_in_flight = st.sidebar.number_input(
+        "Parallel requests",
+        min_value=1, max_value=32, value=min(32, DEFAULT_MAX_IN_FLIGHT * len(ollama_url.split(","))),
+        help="Pages analyzed concurrently; match OLLAMA_NUM_PARALLEL on the server, times the number of servers"
+    )
+    use_cache = st.sidebar.checkbox("Cache page results", True,
+                                    help="Reuse earlier analyses of identical pages")
+    use_text_layer = st.sidebar.checkbox("Use PDF text layer", True,
+                                         help="Send born-digital pages as text; only scanned or "
+                                              "figure-heavy pages go through the vision encoder")
+    stream_output = st.sidebar.checkbox("Stream output", False,
+                                        help="Show each page's analysis as it is generated (pages run one at a time)")
+
+    with st.sidebar.expander("Image upload settings"):
+        image_max_side = st.number_input("Max image side (px)", min_value=256, max_value=4096,
+                                         value=DEFAULT_MAX_SIDE, step=128)
+        image_format = st.selectbox("Encoding", ["JPEG", "WEBP", "PNG"])
+        image_quality = st.slider("Quality", min_value=30, max_value=100, value=DEFAULT_QUALITY)
+
+    # Initialize analyzer
+    if 'analyzer' not in st.session_state:
+        st.session_state.analyzer = DocumentAnalyzer(ollama_url, model_name, max_in_flight)
+    st.session_state.analyzer.max_in_flight = int(max_in_flight)
+    st.session_state.analyzer.cache = get_result_cache() if use_cache else None
+    st.session_state.analyzer.image_options = {
+        "max_side": int(image_max_side),
+        "image_format": image_format,
+        "quality": int(image_quality)
+    }
+
+    if use_cache:
+        cache_stats = get_result_cache().stats()
+        st.sidebar.caption(
+            f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} entries, "
+            f"{cache_stats['bytes'] / 1024 / 1024:.1f} MB"
+        )
+        if st.sidebar.button("🧹 Clear Cache"):
+            get_result_cache().clear()
+
+    # Analysis types, shared by direct analysis and background jobs
     analysis_types = {
         "summary": "📝 Document Summary",
         "extract_data": "📊 Data Extraction", 
@@ -138,122 +621,295 @@ if uploaded_file is not None:
         "compliance": "⚖️ Compliance Review"
     }
 
-    selected_analysis = st.selectbox(
-        "Choose Analysis Type",
-        options=list(analysis_types.keys()),
-        format_func=lambda x: analysis_types[x]
+    # File upload
+    st.subheader("📁 Upload Document")
+    uploaded_file = st.file_uploader(
+        "Choose a document", 
+        type=['pdf', 'png', 'jpg', 'jpeg'],
+        help="Upload PDF documents or images for analysis"
     )
 
-    # Custom analysis option
-    if st.checkbox("Custom Analysis"):
-        custom_prompt = st.text_input("Enter your specific analysis request:")
-        if custom_prompt:
-            selected_analysis = custom_prompt
+    if uploaded_file is not None:
+        # Analysis type selection
+        selected_analysis = st.selectbox(
+            "Choose Analysis Type",
+            options=list(analysis_types.keys()),
+            format_func=lambda x: analysis_types[x]
+        )
+
+        # Custom analysis option
+        if st.checkbox("Custom Analysis"):
+            custom_prompt = st.text_input("Enter your specific analysis request:")
+            if custom_prompt:
+                selected_analysis = custom_prompt
+
+        whole_document = st.radio(
+            "Scope",
+            ["Per page", "Whole document"],
+            horizontal=True,
+            help="Whole document merges the page results into one answer (map-reduce)"
+        ) == "Whole document"
+
+        # Process document
+        if st.button("🔍 Analyze Document"):
+            with st.spinner("Processing document..."):
+                try:
+                    # Handle different file types
+                    if uploaded_file.type == "application/pdf":
+                        pages = st.session_state.analyzer.iter_pdf_pages(uploaded_file, hybrid=use_text_layer)
+                    else:
+                        # Single image
+                        image = open_image(uploaded_file.getvalue())
+                        pages = [image]
+
+                    st.success(f"Extracted {len(pages)} page(s) from document")
+                    transfer_before = dict(st.session_state.analyzer.transfer_stats)
+
+                    # Analyze pages
+                    document_answer = None
+                    if whole_document:
+                        with st.spinner("Analyzing pages and merging results with Gemma 3n..."):
+                            document = st.session_state.analyzer.analyze_whole_document(pages, selected_analysis)
+                        results = document["pages"]
+                        document_answer = document["answer"]
+                    elif stream_output:
+                        results = []
+                        for i, page in enumerate(pages):
+                            st.markdown(f"**Page {i + 1}:**")
+                            analysis = st.write_stream(
+                                st.session_state.analyzer.stream_page(i, page, selected_analysis)
+                            )
+                            results.append({
+                                "page": i + 1,
+                                "analysis": analysis,
+                                "route": page_route(page),
+                                "thumbnail": make_thumbnail(page)
+                            })
+                    else:
+                        with st.spinner("Analyzing content with Gemma 3n..."):
+                            results = st.session_state.analyzer.analyze_document_content(pages, selected_analysis)
+
+                    transfer = st.session_state.analyzer.transfer_stats
+                    sent_pages = transfer["pages"] - transfer_before["pages"]
+                    if sent_pages:
+                        original_kb = (transfer["original_bytes"] - transfer_before["original_bytes"]) / 1024
+                        encoded_kb = (transfer["encoded_bytes"] - transfer_before["encoded_bytes"]) / 1024
+                        # Rendered PDF pages have no file size to compare against
+                        original = "raw pixels" if uploaded_file.type == "application/pdf" else "original file"
+                        st.caption(f"Uploaded {sent_pages} page image(s): {encoded_kb:.0f} KB "
+                                   f"instead of {original_kb:.0f} KB {original}")
+
+                    # Store results in session state
+                    st.session_state.analysis_results = results
+                    st.session_state.analysis_type = selected_analysis
+                    st.session_state.document_answer = document_answer
+
+                except Exception as e:
+                    st.error(f"Error processing document: {str(e)}")
+
+    # Display results
+    if 'analysis_results' in st.session_state:
+        st.subheader(f"📋 Analysis Results: {analysis_types.get(st.session_state.analysis_type, st.session_state.analysis_type)}")
+
+        if st.session_state.get("document_answer"):
+            st.markdown("### 📘 Whole-Document Result")
+            st.write(st.session_state.document_answer)
+            st.download_button(
+                label="📘 Download document result",
+                data=st.session_state.document_answer,
+                file_name=f"document_analysis_{st.session_state.analysis_type}.md",
+                mime="text/markdown"
+            )
+
+        # Per-page routing: text layer vs. vision encoder
+        routes = [r.get("route", "vision") for r in st.session_state.analysis_results]
+        route_col1, route_col2 = st.columns(2)
+        route_col1.metric("📝 Pages read from text layer", routes.count("text"))
+        route_col2.metric("🖼️ Pages sent as images", routes.count("vision"))
+
+        # Create tabs for each page
+        if len(st.session_state.analysis_results) > 1:
+            tabs = st.tabs([f"Page {r['page']}" for r in st.session_state.analysis_results])
+
+            for tab, result in zip(tabs, st.session_state.analysis_results):
+                with tab:
+                    col1, col2 = st.columns([1, 1])
+
+                    with col1:
+                        if result.get('thumbnail') is not None:
+                            st.image(result['thumbnail'], caption=f"Page {result['page']}", use_container_width=True)
+
+                    with col2:
+                        st.markdown("**Analysis:**")
+                        st.write(result['analysis'])
+        else:
+            # Single page
+            result = st.session_state.analysis_results[0]
+            col1, col2 = st.columns([1, 1])
+
+            with col1:
+                if result.get('thumbnail') is not None:
+                    st.image(result['thumbnail'], caption="Document", use_container_width=True)
+
+            with col2:
+                st.markdown("**Analysis:**")
+                st.write(result['analysis'])
+
+        # Export results
+        st.subheader("💾 Export Results")
+
+        # Prepare export data
+        export_data = []
+        for result in st.session_state.analysis_results:
+            export_data.append({
+                "Page": result['page'],
+                "Route": result.get('route', 'vision'),
+                "Analysis": result['analysis']
+            })
 
-    # Process document
-    if st.button("🔍 Analyze Document"):
-        with st.spinner("Processing document..."):
+        # CSV export
+        df = pd.DataFrame(export_data)
+        csv = df.to_csv(index=False)
+        st.download_button(
+            label="📊 Download as CSV",
+            data=csv,
+            file_name=f"document_analysis_{st.session_state.analysis_type}.csv",
+            mime="text/csv"
+        )
+
+        # JSON export
+        json_data = json.dumps(export_data, indent=2)
+        st.download_button(
+            label="📄 Download as JSON",
+            data=json_data,
+            file_name=f"document_analysis_{st.session_state.analysis_type}.json",
+            mime="application/json"
+        )
+
+    # Question answering over the uploaded document
+    if uploaded_file is not None:
+        st.subheader("💬 Ask the Document")
+        question = st.text_input("Ask a question about this document:")
+        top_k = st.slider("Passages to retrieve", min_value=1, max_value=10, value=4)
+
+        if st.button("🔎 Ask") and question:
             try:
-                # Handle different file types
-                if uploaded_file.type == "application/pdf":
-                    pages = st.session_state.analyzer.extract_pdf_pages(uploaded_file)
-                else:
-                    # Single image
-                    image = Image.open(uploaded_file)
-                    pages = [image]
-
-                st.success(f"Extracted {len(pages)} page(s) from document")
-
-                # Analyze pages
-                with st.spinner("Analyzing content with Gemma 3n..."):
-                    results = st.session_state.analyzer.analyze_document_content(pages, selected_analysis)
+                # Scanned pages are transcribed by the vision model, so its settings shape the index too
+                analyzer = st.session_state.analyzer
+                document_key = make_cache_key(uploaded_file.getvalue(), embed_model, use_text_layer,
+                                              analyzer.model, analyzer.image_options)
+                if "document_indexes" not in st.session_state:
+                    st.session_state.document_indexes = {}
+
+                index = st.session_state.document_indexes.get(document_key)
+                if index is None:
+                    with st.spinner("Indexing document (only needed once per document)..."):
+                        if uploaded_file.type == "application/pdf":
+                            pages = st.session_state.analyzer.iter_pdf_pages(uploaded_file, hybrid=use_text_layer)
+                        else:
+                            pages = [open_image(uploaded_file.getvalue())]
+                        index = st.session_state.analyzer.build_index(pages, document_key, embed_model)
+                    if index.missing_pages:
+                        # Not kept, so the next question retries the failed pages
+                        st.warning(f"Could not transcribe page(s) {', '.join(map(str, index.missing_pages))}; "
+                                   "answers below cannot draw on them. They will be retried on the next question.")
+                    else:
+                        st.session_state.document_indexes[document_key] = index
+
+                with st.spinner("Answering from the most relevant passages..."):
+                    reply = st.session_state.analyzer.ask_document(index, question, top_k)
+
+                st.markdown(reply["answer"])
+                with st.expander(f"📚 Sources ({len(reply['sources'])} of {len(index)} passages)"):
+                    for hit in reply["sources"]:
+                        st.markdown(f"**Page {hit['page']}** · similarity {hit['score']:.2f}")
+                        st.text(hit["text"])
+            except Exception as e:
+                st.error(f"Error answering question: {str(e)}")
+
+    # Background jobs run in worker processes, so they survive reruns and browser refreshes
+    st.subheader("🗂️ Background Jobs")
+    job_queue = get_job_queue()
+
+    with st.expander("📥 Queue documents for background analysis"):
+        job_files = st.file_uploader(
+            "Choose documents",
+            type=['pdf', 'png', 'jpg', 'jpeg'],
+            accept_multiple_files=True,
+            key="job_files"
+        )
+        job_analysis = st.selectbox(
+            "Analysis type for queued documents",
+            options=list(analysis_types.keys()),
+            format_func=lambda x: analysis_types[x],
+            key="job_analysis"
+        )
+        if st.button("📥 Queue Documents") and job_files:
+            job_params = {
+                "ollama_url": ollama_url,
+                "model": model_name,
+                "max_in_flight": int(max_in_flight),
+                "use_cache": use_cache,
+                "hybrid": use_text_layer,
+                "image_options": st.session_state.analyzer.image_options
+            }
+            for job_file in job_files:
+                job_queue.submit(job_file.name, job_file.getvalue(), job_analysis, job_params)
+            st.success(f"Queued {len(job_files)} document(s)")
+
+    job_col1, job_col2 = st.columns(2)
+    if job_col1.button("▶️ Start Worker", help="Starts a worker process that exits once the queue is empty; "
+                                               "or run `python gemma3n_jobs.py worker`"):
+        start_worker_process(job_queue.directory)
+        st.info("Worker started")
+    job_col2.button("🔄 Refresh Progress")
+
+    for job in job_queue.list_jobs(limit=20):
+        total = job["total_pages"]
+        label = f"**{job['file_name']}** · {analysis_types.get(job['analysis_type'], job['analysis_type'])} · {job['status']}"
+        if total:
+            st.progress(min(1.0, job["done_pages"] / total), text=f"{label} ({job['done_pages']}/{total} pages)")
+        else:
+            st.markdown(label)
+        if job["error"]:
+            st.caption(job["error"])
 
-                # Store results in session state
-                st.session_state.analysis_results = results
-                st.session_state.analysis_type = selected_analysis
+        action_cols = st.columns(3)
+        if job["done_pages"] and action_cols[0].button("📋 Show Results", key=f"show_{job['id']}"):
+            st.session_state.analysis_results = job_queue.results(job["id"])
+            st.session_state.analysis_type = job["analysis_type"]
+            st.session_state.document_answer = None
+            st.rerun()
+        if job["status"] in ("queued", "running") and action_cols[1].button("⏹️ Cancel", key=f"cancel_{job['id']}"):
+            job_queue.cancel(job["id"])
+            st.rerun()
+        if job["status"] in ("failed", "cancelled") and action_cols[2].button("🔁 Retry", key=f"retry_{job['id']}"):
+            job_queue.requeue(job["id"])
+            st.rerun()
 
-            except Exception as e:
-                st.error(f"Error processing document: {str(e)}")
-
-# Display results
-if 'analysis_results' in st.session_state:
-    st.subheader(f"📋 Analysis Results: {analysis_types.get(st.session_state.analysis_type, st.session_state.analysis_type)}")
-
-    # Create tabs for each page
-    if len(st.session_state.analysis_results) > 1:
-        tabs = st.tabs([f"Page {r['page']}" for r in st.session_state.analysis_results])
-
-        for tab, result in zip(tabs, st.session_state.analysis_results):
-            with tab:
-                col1, col2 = st.columns([1, 1])
-
-                with col1:
-                    st.image(result['image'], caption=f"Page {result['page']}", use_container_width=True)
-
-                with col2:
-                    st.markdown("**Analysis:**")
-                    st.write(result['analysis'])
-    else:
-        # Single page
-        result = st.session_state.analysis_results[0]
-        col1, col2 = st.columns([1, 1])
-
-        with col1:
-            st.image(result['image'], caption="Document", use_container_width=True)
-
-        with col2:
-            st.markdown("**Analysis:**")
-            st.write(result['analysis'])
-
-    # Export results
-    st.subheader("💾 Export Results")
-
-    # Prepare export data
-    export_data = []
-    for result in st.session_state.analysis_results:
-        export_data.append({
-            "Page": result['page'],
-            "Analysis": result['analysis']
-        })
-
-    # CSV export
-    df = pd.DataFrame(export_data)
-    csv = df.to_csv(index=False)
-    st.download_button(
-        label="📊 Download as CSV",
-        data=csv,
-        file_name=f"document_analysis_{st.session_state.analysis_type}.csv",
-        mime="text/csv"
-    )
+    # Usage examples
+    with st.expander("💡 Usage Examples"):
+        st.markdown("""
+        **Document Summary**: Get concise summaries of contracts, reports, or articles
 
-    # JSON export
-    json_data = json.dumps(export_data, indent=2)
-    st.download_button(
-        label="📄 Download as JSON",
-        data=json_data,
-        file_name=f"document_analysis_{st.session_state.analysis_type}.json",
-        mime="application/json"
-    )
+        **Data Extraction**: Extract tables, names, dates, and structured information
 
-# Usage examples
-with st.expander("💡 Usage Examples"):
-    st.markdown("""
-    **Document Summary**: Get concise summaries of contracts, reports, or articles
+        **Generate Questions**: Create quiz questions or study materials from documents
 
-    **Data Extraction**: Extract tables, names, dates, and structured information
+        **Translation**: Identify languages and translate foreign documents
 
-    **Generate Questions**: Create quiz questions or study materials from documents
+        **Compliance Review**: Check documents for regulatory compliance issues
 
-    **Translation**: Identify languages and translate foreign documents
+        **Custom Analysis**: Ask specific questions about document content
 
-    **Compliance Review**: Check documents for regulatory compliance issues
+        **Ask the Document**: Question answering over large documents; only the most relevant passages are sent per question
 
-    **Custom Analysis**: Ask specific questions about document content
-    """)
+        **Background Jobs**: Queue dozens of documents; workers checkpoint every page and resume after interruptions
+        """)
 
-# Installation requirements
-with st.expander("📦 Installation Requirements"):
-    st.code("""
+    # Installation requirements
+    with st.expander("📦 Installation Requirements"):
+        st.code("""
 # Install required packages
 pip install streamlit PyMuPDF pillow pandas requests
 
@@ -263,21 +919,25 @@ pip install streamlit PyMuPDF pillow pandas requests
 
 # Run with:
 streamlit run gemma3n_document_analyzer.py
-    """)
+        """)
 
-# API status check
-if st.sidebar.button("🔧 Test Connection"):
-    try:
-        response = requests.get(f"{ollama_url}/api/tags")
-        if response.status_code == 200:
-            models = response.json().get('models', [])
+    # API status check
+    if st.sidebar.button("🔧 Test Connection"):
+        try:
+            models = get_client(ollama_url).list_models()
             gemma_models = [m['name'] for m in models if 'gemma3n' in m['name']]
 
             if gemma_models:
                 st.sidebar.success(f"✅ Connected! Available models: {', '.join(gemma_models)}")
             else:
                 st.sidebar.warning("⚠️ Connected but no Gemma 3n models found")
-        else:
+        except requests.exceptions.HTTPError:
             st.sidebar.error("❌ Connection failed")
-    except Exception as e:
-        st.sidebar.error(f"❌ Error: {str(e)}")
+        except Exception as e:
+            st.sidebar.error(f"❌ Error: {str(e)}")
+
+    # Latency and throughput of the requests made so far
+    render_streamlit_panel(st.sidebar)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Gemma 3n Document Batch
+Headless bulk analysis of PDFs and images with streamed JSONL/CSV/Parquet output
+"""
+
+import argparse
+import csv
+import glob
+import io
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from gemma3n_cache import ResultCache
+from gemma3n_client import get_client
+from gemma3n_document_analyzer import DEFAULT_MAX_IN_FLIGHT, DocumentAnalyzer, Page
+from gemma3n_metrics import format_summary, get_metrics
+from gemma3n_pool import BackendPool
+
+DOCUMENT_SUFFIXES = {".pdf", ".png", ".jpg", ".jpeg"}
+# Rows buffered before a Parquet row group is written
+PARQUET_BATCH_ROWS = 500
+
+def find_documents(patterns: List[str]) -> List[Path]:
+    """Expand directories (recursively) and globs into a sorted list of document paths"""
+    found = set()
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            candidates = path.rglob("*")
+        else:
+            candidates = (Path(p) for p in glob.glob(pattern, recursive=True))
+        found.update(p for p in candidates if p.is_file() and p.suffix.lower() in DOCUMENT_SUFFIXES)
+    return sorted(found)
+
+class ResultWriter:
+    """Appends page result rows to a file as they arrive"""
+
+    FIELDS = ["document", "page", "route", "analysis"]
+
+    def __init__(self, output: Optional[str], output_format: str):
+        self.output_format = output_format
+        self._rows = []
+        self._parquet = None
+        if output_format == "parquet":
+            if not output:
+                raise ValueError("Parquet output needs --output")
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)")
+            self._pa = pyarrow
+            self._schema = pyarrow.schema([("document", pyarrow.string()), ("page", pyarrow.int32()),
+                                           ("route", pyarrow.string()), ("analysis", pyarrow.string())])
+            self._parquet = pyarrow.parquet.ParquetWriter(output, self._schema)
+            self._file = None
+        else:
+            self._file = open(output, "w", encoding="utf-8", newline="") if output else sys.stdout
+            if output_format == "csv":
+                self._csv = csv.DictWriter(self._file, fieldnames=self.FIELDS)
+                self._csv.writeheader()
+
+    def write(self, row: Dict[str, Any]):
+        if self.output_format == "parquet":
+            self._rows.append(row)
+            if len(self._rows) >= PARQUET_BATCH_ROWS:
+                self._flush_parquet()
+            return
+        if self.output_format == "csv":
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        # Flushed per row so an interrupted nightly run keeps everything written so far
+        self._file.flush()
+
+    def _flush_parquet(self):
+        if self._rows:
+            table = self._pa.Table.from_pylist(self._rows, schema=self._schema)
+            self._parquet.write_table(table)
+            self._rows = []
+
+    def close(self):
+        if self._parquet is not None:
+            self._flush_parquet()
+            self._parquet.close()
+        elif self._file is not sys.stdout:
+            self._file.close()
+
+def iter_pages(analyzer: DocumentAnalyzer, documents: List[Path], hybrid: bool,
+               errors: List[Dict[str, Any]]) -> Iterator[Tuple[Path, int, Page]]:
+    """Yield (document, page index, page) across all documents, rendering lazily"""
+    for document in documents:
+        try:
+            data = document.read_bytes()
+            if document.suffix.lower() == ".pdf":
+                pages = analyzer.iter_pdf_pages(io.BytesIO(data), hybrid=hybrid)
+            else:
+                pages = [Image.open(io.BytesIO(data))]
+            for index, page in enumerate(pages):
+                yield document, index, page
+        except Exception as e:
+            errors.append({"document": str(document), "page": 0, "route": "", "analysis": f"Error: {str(e)}"})
+
+class Progress:
+    """Single-line progress and throughput report on stderr"""
+
+    def __init__(self, total_documents: int, quiet: bool = False):
+        self.total_documents = total_documents
+        self.quiet = quiet
+        self.pages = 0
+        self.failed = 0
+        self.documents = set()
+        self.started = time.perf_counter()
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / max(time.perf_counter() - self.started, 1e-9)
+
+    def update(self, row: Dict[str, Any]):
+        self.pages += 1
+        self.failed += row["analysis"].startswith("Error:")
+        self.documents.add(row["document"])
+        if not self.quiet:
+            print(f"\r{len(self.documents)}/{self.total_documents} documents, {self.pages} pages, "
+                  f"{self.failed} failed, {self.pages_per_second:.2f} pages/s", end="", file=sys.stderr, flush=True)
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        return (f"Analyzed {self.pages} pages from {len(self.documents)} documents in {elapsed:.1f}s "
+                f"({self.pages_per_second:.2f} pages/s, {self.failed} failed)")
+
+def run_batch(analyzer: DocumentAnalyzer, documents: List[Path], analysis_type: str,
+              writer: ResultWriter, hybrid: bool = True, quiet: bool = False) -> Progress:
+    """Analyze every page of every document, writing rows as pages complete.
+
+    Pages from consecutive documents share one window of max_in_flight requests,
+    so Ollama stays busy across document boundaries and small documents.
+    """
+    progress = Progress(len(documents), quiet)
+    errors = []
+
+    def analyze(document, index, page):
+        result = analyzer.analyze_page(index, page, analysis_type)
+        return {"document": str(document), "page": result["page"], "route": result["route"],
+                "analysis": result["analysis"]}
+
+    def emit(row):
+        writer.write(row)
+        progress.update(row)
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=analyzer.max_in_flight) as executor:
+        for document, index, page in iter_pages(analyzer, documents, hybrid, errors):
+            if len(pending) >= analyzer.max_in_flight:
+                emit(pending.popleft().result())
+            pending.append(executor.submit(analyze, document, index, page))
+            while errors:
+                emit(errors.pop(0))
+        while pending:
+            emit(pending.popleft().result())
+    for row in errors:
+        emit(row)
+
+    if not quiet:
+        print(file=sys.stderr)
+    return progress
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemma 3n Document Batch Analyzer")
+    parser.add_argument("inputs", nargs="+",
+                       help="Directories, files or globs of PDFs and images")
+    parser.add_argument("--type", default="summary",
+                       help="Analysis type (summary, extract_data, questions, translation, compliance or a custom request)")
+    parser.add_argument("--ollama-url", default="http://localhost:11434",
+                       help="Ollama server URL; comma-separate several to balance across them")
+    parser.add_argument("--model", default="gemma3n:e4b",
+                       help="Gemma 3n model to use")
+    parser.add_argument("--max-in-flight", type=int,
+                       help="Concurrent page requests (default: OLLAMA_NUM_PARALLEL per server)")
+    parser.add_argument("--output", type=str,
+                       help="Output file (default: stdout)")
+    parser.add_argument("--format", choices=["jsonl", "csv", "parquet"],
+                       help="Output format (default: from the output extension, else jsonl)")
+    parser.add_argument("--no-text-layer", action="store_true",
+                       help="Send every PDF page as an image")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Do not reuse or store page results")
+    parser.add_argument("--quiet", action="store_true",
+                       help="No progress output")
+
+    args = parser.parse_args()
+
+    documents = find_documents(args.inputs)
+    if not documents:
+        print("No PDF or image files found", file=sys.stderr)
+        sys.exit(1)
+
+    if args.max_in_flight is None:
+        args.max_in_flight = DEFAULT_MAX_IN_FLIGHT * len(args.ollama_url.split(","))
+
+    output_format = args.format
+    if output_format is None:
+        suffix = Path(args.output).suffix.lower().lstrip(".") if args.output else ""
+        output_format = suffix if suffix in ("csv", "parquet") else "jsonl"
+
+    analyzer = DocumentAnalyzer(args.ollama_url, args.model, args.max_in_flight,
+                                None if args.no_cache else ResultCache())
+    try:
+        writer = ResultWriter(args.output, output_format)
+    except (ValueError, RuntimeError) as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        progress = run_batch(analyzer, documents, args.type, writer, not args.no_text_layer, args.quiet)
+    except KeyboardInterrupt:
+        print("\nInterrupted; rows written so far are kept", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        writer.close()
+    print(progress.summary(), file=sys.stderr)
+    print(f"Model requests: {format_summary(get_metrics().summary())}", file=sys.stderr)
+    client = get_client(args.ollama_url)
+    if isinstance(client, BackendPool):
+        for backend in client.stats():
+            state = "up" if backend["healthy"] else f"down ({backend['last_error']})"
+            print(f"  {backend['url']}: {backend['requests']} requests, {backend['failures']} failed, {state}",
+                  file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
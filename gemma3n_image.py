@@ -0,0 +1,105 @@
+"""
+Gemma 3n Image Preprocessing
+Downscale and re-encode images before they are sent to the model
+"""
+
+import base64
+import io
+from typing import Any, Dict, Optional, Union
+
+from PIL import Image, ImageOps, ImageStat
+
+# Gemma 3n's vision encoder takes images of at most 768x768 and the server resizes
+# anything larger, so pixels beyond 768 on the long side are bytes it throws away
+DEFAULT_MAX_SIDE = 768
+DEFAULT_FORMAT = "JPEG"
+DEFAULT_QUALITY = 85
+# Mean HSV saturation (0-255) under which a page is treated as black-and-white text
+TEXT_PAGE_SATURATION = 12
+
+def is_text_page(image: Image.Image) -> bool:
+    """Heuristic: a page with almost no color saturation is text/line art"""
+    if image.mode in ("1", "L", "LA", "I", "F"):
+        return True
+    sample = image.convert("RGB")
+    sample.thumbnail((128, 128))
+    saturation = ImageStat.Stat(sample.convert("HSV")).mean[1]
+    return saturation < TEXT_PAGE_SATURATION
+
+def _flatten(image: Image.Image) -> Image.Image:
+    """Drop alpha onto a white background so the image can be saved as JPEG"""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        return background
+    if image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+def open_image(data: bytes) -> Image.Image:
+    """Open uploaded image bytes, remembering the file size for prepare_image's savings report"""
+    image = Image.open(io.BytesIO(data))
+    image.info["source_bytes"] = len(data)
+    return image
+
+def prepare_image(image: Union[Image.Image, bytes], max_side: int = DEFAULT_MAX_SIDE,
+                  image_format: str = DEFAULT_FORMAT, quality: int = DEFAULT_QUALITY,
+                  grayscale: Optional[bool] = None) -> Dict[str, Any]:
+    """Downscale, orient and re-encode an image for upload.
+
+    grayscale=None converts automatically when the image looks like a text page.
+    Returns the base64 payload with before/after sizes. The original size is the
+    file size for raw bytes and images from open_image; for other PIL images, such
+    as rendered PDF pages, there is no file and it is the uncompressed pixel buffer
+    ("original_source" says which).
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = open_image(bytes(image))
+    original_bytes = image.info.get("source_bytes")
+    original_source = "file" if original_bytes is not None else "pixels"
+    if original_bytes is None:
+        original_bytes = len(image.getbands()) * image.width * image.height
+    # Phone photos are often stored sideways with an EXIF rotation flag
+    image = ImageOps.exif_transpose(image)
+
+    original_size = image.size
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    if grayscale is None:
+        grayscale = is_text_page(image)
+
+    image = _flatten(image)
+    if grayscale and image.mode != "L":
+        image = image.convert("L")
+
+    buffer = io.BytesIO()
+    image_format = image_format.upper()
+    if image_format == "PNG":
+        image.save(buffer, format="PNG", optimize=True)
+    else:
+        image.save(buffer, format=image_format, quality=quality)
+    encoded = buffer.getvalue()
+
+    return {
+        "data": base64.b64encode(encoded).decode(),
+        "format": image_format,
+        "original_size": original_size,
+        "size": image.size,
+        "grayscale": grayscale,
+        "original_bytes": original_bytes,
+        "original_source": original_source,
+        "encoded_bytes": len(encoded),
+        "bytes_saved": max(0, original_bytes - len(encoded)),
+    }
+
+def format_savings(prepared: Dict[str, Any]) -> str:
+    """One-line human readable summary of a prepare_image result"""
+    return (
+        f"{prepared['original_size'][0]}x{prepared['original_size'][1]} → "
+        f"{prepared['size'][0]}x{prepared['size'][1]} {prepared['format']}"
+        f"{' grayscale' if prepared['grayscale'] else ''}, "
+        f"{prepared['original_bytes'] / 1024:.0f} KB → {prepared['encoded_bytes'] / 1024:.0f} KB"
+    )
@@ -0,0 +1,399 @@
+"""
+Gemma 3n Job Queue
+SQLite-backed queue of document analysis jobs processed by background workers
+"""
+
+import argparse
+import io
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from gemma3n_cache import DEFAULT_CACHE_DIR, make_cache_key
+
+DEFAULT_JOBS_DIR = DEFAULT_CACHE_DIR / "jobs"
+# Workers refresh the heartbeat of their running job this often...
+HEARTBEAT_INTERVAL = 15
+# ...and a running job without a heartbeat for this long is reclaimed and resumed
+STALE_AFTER = 90
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    analysis_type TEXT NOT NULL,
+    params TEXT NOT NULL,
+    total_pages INTEGER,
+    done_pages INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    claim TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat REAL
+);
+CREATE TABLE IF NOT EXISTS page_results (
+    job_id TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    route TEXT NOT NULL,
+    analysis TEXT NOT NULL,
+    thumbnail BLOB,
+    PRIMARY KEY (job_id, page)
+);
+"""
+
+JOB_STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+def _encode_thumbnail(image: Optional[Image.Image]) -> Optional[bytes]:
+    if image is None:
+        return None
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+class JobQueue:
+    """Document analysis jobs and their per-page checkpoints, shared by UI and worker processes"""
+
+    def __init__(self, directory: Path = DEFAULT_JOBS_DIR):
+        self.directory = Path(directory)
+        self.files_dir = self.directory / "files"
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Several processes use the same file; WAL lets the UI read while a worker writes
+        self._conn = sqlite3.connect(str(self.directory / "jobs.db"), timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def submit(self, file_name: str, data: bytes, analysis_type: str, params: Dict[str, Any]) -> str:
+        """Store the document next to the queue and enqueue a job for it"""
+        job_id = uuid.uuid4().hex[:12]
+        # Content-addressed, so resubmitting the same document does not copy it again
+        file_path = self.files_dir / (make_cache_key(data) + Path(file_name).suffix.lower())
+        if not file_path.exists():
+            tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, file_path)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, file_name, file_path, analysis_type, params, created_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, file_name, str(file_path), analysis_type, json.dumps(params), time.time())
+            )
+            self._conn.commit()
+        return job_id
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest queued job, or a running job whose worker died"""
+        claim = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        now = time.time()
+        with self._lock:
+            # A single UPDATE is atomic across processes, so two workers never get the same job
+            self._conn.execute(
+                """UPDATE jobs SET status = 'running', claim = ?, heartbeat = ?,
+                       started_at = COALESCE(started_at, ?), error = NULL
+                   WHERE id = (
+                       SELECT id FROM jobs
+                       WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?)
+                       ORDER BY created_at LIMIT 1
+                   )""",
+                (claim, now, now, now - STALE_AFTER)
+            )
+            self._conn.commit()
+            row = self._conn.execute("SELECT * FROM jobs WHERE claim = ?", (claim,)).fetchone()
+        return self._job(row) if row else None
+
+    def heartbeat(self, job_id: str, claim: str) -> str:
+        """Mark a job as alive and return its current status.
+
+        Returns "reclaimed" when another worker has taken the job over (after
+        this one stalled past STALE_AFTER); the caller must then stop working on it.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running' AND claim = ?",
+                               (time.time(), job_id, claim))
+            self._conn.commit()
+            row = self._conn.execute("SELECT status, claim FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return "cancelled"
+        if row["status"] == "running" and row["claim"] != claim:
+            return "reclaimed"
+        return row["status"]
+
+    def set_total_pages(self, job_id: str, claim: str, total_pages: int):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET total_pages = ? WHERE id = ? AND claim = ?",
+                               (total_pages, job_id, claim))
+            self._conn.commit()
+
+    def record_page(self, job_id: str, claim: str, result: Dict[str, Any]) -> bool:
+        """Checkpoint one page result as soon as it is available.
+
+        Returns False, writing nothing, when the job no longer belongs to claim.
+        """
+        with self._lock:
+            owned = self._conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running' AND claim = ?",
+                (time.time(), job_id, claim)
+            ).rowcount
+            if not owned:
+                self._conn.rollback()
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO page_results VALUES (?, ?, ?, ?, ?)",
+                (job_id, result["page"], result.get("route", "vision"), result["analysis"],
+                 _encode_thumbnail(result.get("thumbnail")))
+            )
+            self._conn.execute(
+                "UPDATE jobs SET done_pages = (SELECT COUNT(*) FROM page_results WHERE job_id = ?) WHERE id = ?",
+                (job_id, job_id)
+            )
+            self._conn.commit()
+        return True
+
+    def completed_pages(self, job_id: str) -> List[int]:
+        """0-based indexes of pages with a successful checkpoint; failed pages are retried"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page FROM page_results WHERE job_id = ? AND analysis NOT LIKE 'Error:%'", (job_id,)
+            ).fetchall()
+        return [row["page"] - 1 for row in rows]
+
+    def finish(self, job_id: str, claim: str, error: Optional[str] = None):
+        """Mark a job done, or failed with an error; a cancelled or reclaimed job is left alone"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                "WHERE id = ? AND status = 'running' AND claim = ?",
+                ("failed" if error else "done", error, time.time(), job_id, claim)
+            )
+            self._conn.commit()
+
+    def cancel(self, job_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')", (time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def requeue(self, job_id: str):
+        """Queue a failed or cancelled job again; pages already analyzed are kept"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', error = NULL, finished_at = NULL "
+                "WHERE id = ? AND status IN ('failed', 'cancelled')", (job_id,)
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def list_jobs(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Most recent jobs first"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def results(self, job_id: str) -> List[Dict[str, Any]]:
+        """Checkpointed page results in page order, in the analyzer's result format"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page, route, analysis, thumbnail FROM page_results WHERE job_id = ? ORDER BY page",
+                (job_id,)
+            ).fetchall()
+        return [
+            {
+                "page": row["page"],
+                "analysis": row["analysis"],
+                "route": row["route"],
+                "thumbnail": Image.open(io.BytesIO(row["thumbnail"])) if row["thumbnail"] else None
+            }
+            for row in rows
+        ]
+
+    def delete(self, job_id: str):
+        """Remove a finished job and its results; the stored file is kept if other jobs use it"""
+        with self._lock:
+            row = self._conn.execute("SELECT file_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            self._conn.execute("DELETE FROM page_results WHERE job_id = ?", (job_id,))
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            shared = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE file_path = ?",
+                                        (row["file_path"],)).fetchone()[0]
+            self._conn.commit()
+        if not shared:
+            Path(row["file_path"]).unlink(missing_ok=True)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+def load_pages(job: Dict[str, Any], skip_pages: List[int]):
+    """Page source for a job's stored file; completed pages come back as None"""
+    from gemma3n_document_analyzer import PdfPageSource
+
+    data = Path(job["file_path"]).read_bytes()
+    if job["file_path"].endswith(".pdf"):
+        return PdfPageSource(data, hybrid=job["params"].get("hybrid", True), skip_pages=skip_pages)
+    return [None if 0 in skip_pages else Image.open(io.BytesIO(data))]
+
+def process_job(queue: JobQueue, job: Dict[str, Any]):
+    """Analyze the remaining pages of a claimed job, checkpointing each page"""
+    from gemma3n_document_analyzer import DocumentAnalyzer
+
+    params = job["params"]
+    cache = None
+    if params.get("use_cache", True):
+        from gemma3n_cache import ResultCache
+        cache = ResultCache()
+    analyzer = DocumentAnalyzer(params.get("ollama_url", "http://localhost:11434"),
+                                params.get("model", "gemma3n:e4b"),
+                                params.get("max_in_flight", 4), cache)
+    if params.get("image_options"):
+        analyzer.image_options = params["image_options"]
+
+    # Set when the job is cancelled or taken over by another worker; the rest is skipped
+    cancelled = threading.Event()
+    stop_heartbeat = threading.Event()
+    claim = job["claim"]
+
+    def keep_alive():
+        while not stop_heartbeat.wait(HEARTBEAT_INTERVAL):
+            if queue.heartbeat(job["id"], claim) != "running":
+                cancelled.set()
+                return
+
+    def analyze(page_index, page):
+        # Skipped (already checkpointed) pages and pages after a cancel cost nothing
+        if page is None or cancelled.is_set():
+            return None
+        result = analyzer.analyze_page(page_index, page, job["analysis_type"])
+        if not queue.record_page(job["id"], claim, result):
+            cancelled.set()
+            return None
+        return result
+
+    heartbeat_thread = threading.Thread(target=keep_alive, daemon=True)
+    heartbeat_thread.start()
+    try:
+        pages = load_pages(job, queue.completed_pages(job["id"]))
+        queue.set_total_pages(job["id"], claim, len(pages))
+        results = [r for r in analyzer.map_pages(pages, analyze) if r is not None]
+        failed = sum(r["analysis"].startswith("Error:") for r in results)
+        queue.finish(job["id"], claim, f"{failed} page(s) failed" if failed else None)
+    except Exception as e:
+        queue.finish(job["id"], claim, f"Error: {str(e)}")
+    finally:
+        stop_heartbeat.set()
+
+def run_worker(queue: JobQueue, poll_interval: float = 2, once: bool = False):
+    """Process jobs until interrupted, or until the queue is empty with once=True"""
+    while True:
+        job = queue.claim_next()
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        print(f"Processing job {job['id']}: {job['file_name']} ({job['analysis_type']})", flush=True)
+        process_job(queue, job)
+        final = queue.get(job["id"])
+        print(f"Job {job['id']} {final['status']}: {final['done_pages']}/{final['total_pages']} pages"
+              f"{' - ' + final['error'] if final['error'] else ''}", flush=True)
+
+def start_worker_process(directory: Path = DEFAULT_JOBS_DIR, once: bool = True):
+    """Launch a detached worker process that outlives the calling Streamlit session"""
+    import subprocess
+
+    command = [sys.executable, str(Path(__file__).resolve()), "--jobs-dir", str(directory), "worker"]
+    if once:
+        command.append("--once")
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemma 3n Document Job Queue")
+    parser.add_argument("--jobs-dir", default=str(DEFAULT_JOBS_DIR),
+                       help="Directory holding the queue database and submitted files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worker = commands.add_parser("worker", help="Process queued jobs")
+    worker.add_argument("--poll", type=float, default=2,
+                       help="Seconds between checks of an empty queue")
+    worker.add_argument("--once", action="store_true",
+                       help="Exit when the queue is empty")
+
+    submit = commands.add_parser("submit", help="Queue documents for analysis")
+    submit.add_argument("files", nargs="+", help="PDF or image files")
+    submit.add_argument("--type", default="summary",
+                       help="Analysis type (summary, extract_data, questions, translation, compliance or a custom request)")
+    submit.add_argument("--ollama-url", default="http://localhost:11434",
+                       help="Ollama server URL; comma-separate several to balance across them")
+    submit.add_argument("--model", default="gemma3n:e4b",
+                       help="Gemma 3n model to use")
+    submit.add_argument("--max-in-flight", type=int,
+                       help="Pages analyzed concurrently within a job (default: OLLAMA_NUM_PARALLEL per server)")
+    submit.add_argument("--no-text-layer", action="store_true",
+                       help="Send every PDF page as an image")
+
+    commands.add_parser("list", help="Show jobs and their progress")
+
+    for name in ("cancel", "retry"):
+        command = commands.add_parser(name, help=f"{name.capitalize()} a job")
+        command.add_argument("job_id")
+
+    args = parser.parse_args()
+    queue = JobQueue(Path(args.jobs_dir))
+
+    if args.command == "worker":
+        try:
+            run_worker(queue, args.poll, args.once)
+        except KeyboardInterrupt:
+            # The interrupted job is reclaimed by the next worker once its heartbeat is stale
+            print("Worker stopped")
+    elif args.command == "submit":
+        params = {
+            "ollama_url": args.ollama_url,
+            "model": args.model,
+            "max_in_flight": args.max_in_flight or (
+                int(os.environ.get("OLLAMA_NUM_PARALLEL", "4")) * len(args.ollama_url.split(","))),
+            "hybrid": not args.no_text_layer,
+        }
+        for file_name in args.files:
+            job_id = queue.submit(os.path.basename(file_name), Path(file_name).read_bytes(), args.type, params)
+            print(f"{job_id}  {file_name}")
+    elif args.command == "list":
+        for job in queue.list_jobs():
+            progress = f"{job['done_pages']}/{job['total_pages'] if job['total_pages'] is not None else '?'}"
+            print(f"{job['id']}  {job['status']:<9}  {progress:>7}  {job['file_name']}"
+                  f"{'  ' + job['error'] if job['error'] else ''}")
+    elif args.command == "cancel":
+        queue.cancel(args.job_id)
+    elif args.command == "retry":
+        queue.requeue(args.job_id)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Gemma 3n Metrics
+Per-request latency and token throughput with Prometheus text and JSONL export
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# Samples kept in memory for percentiles; totals are counted over all requests
+DEFAULT_WINDOW = 1000
+# Set to a file path to append every request sample as one JSON line
+METRICS_LOG_ENV = "GEMMA3N_METRICS_LOG"
+
+# Ollama reports durations in nanoseconds
+SERVER_DURATIONS = {
+    "total_duration": "server_total_ms",
+    "load_duration": "load_ms",
+    "prompt_eval_duration": "prompt_eval_ms",
+    "eval_duration": "eval_ms",
+}
+
+def server_timings(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Token counts and durations (ms) from a final Ollama response body"""
+    sample = {name: body[key] / 1e6 for key, name in SERVER_DURATIONS.items() if key in body}
+    for key in ("prompt_eval_count", "eval_count"):
+        if key in body:
+            sample[key] = body[key]
+    if sample.get("eval_ms") and sample.get("eval_count"):
+        sample["tokens_per_s"] = sample["eval_count"] / (sample["eval_ms"] / 1000)
+    return sample
+
+def _escape_label(value: Any) -> str:
+    """Escape a Prometheus label value: backslash, double quote and newline"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(endpoint: str, model: str, status: str) -> str:
+    return (f'endpoint="{_escape_label(endpoint)}",model="{_escape_label(model)}",'
+            f'status="{_escape_label(status)}"')
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile, or None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class MetricsRecorder:
+    """Thread-safe store of request samples shared by every client in the process"""
+
+    def __init__(self, window: int = DEFAULT_WINDOW, log_path: Optional[str] = None):
+        self.samples = deque(maxlen=window)
+        self.log_path = log_path if log_path is not None else os.environ.get(METRICS_LOG_ENV)
+        self.totals: Dict[tuple, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        # The log is opened once and written under its own lock, off the hot path of record()
+        self._log = None
+        self._log_lock = threading.Lock()
+
+    def record(self, endpoint: str, model: str, status: str = "ok", **fields) -> Dict[str, Any]:
+        """Add one request sample; fields are timings in ms and token counts"""
+        sample = {"timestamp": time.time(), "endpoint": endpoint, "model": model, "status": status, **fields}
+        with self._lock:
+            self.samples.append(sample)
+            totals = self.totals.setdefault((endpoint, model, status), {
+                "requests": 0, "seconds": 0.0, "prompt_tokens": 0, "eval_tokens": 0
+            })
+            totals["requests"] += 1
+            totals["seconds"] += sample.get("total_ms", 0) / 1000
+            totals["prompt_tokens"] += sample.get("prompt_eval_count", 0)
+            totals["eval_tokens"] += sample.get("eval_count", 0)
+        if self.log_path:
+            line = json.dumps(sample) + "\n"
+            with self._log_lock:
+                if self._log is None:
+                    # Line buffered, so every sample reaches the file as it is recorded
+                    self._log = open(self.log_path, "a", encoding="utf-8", buffering=1)
+                self._log.write(line)
+        return sample
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.samples)
+
+    def summary(self) -> Dict[str, Any]:
+        """Percentiles and throughput over the in-memory window"""
+        samples = self.snapshot()
+        ok = [s for s in samples if s["status"] == "ok"]
+        latencies = [s["total_ms"] for s in ok if "total_ms" in s]
+        ttfts = [s["ttft_ms"] for s in ok if "ttft_ms" in s]
+        eval_tokens = sum(s.get("eval_count", 0) for s in ok)
+        eval_seconds = sum(s.get("eval_ms", 0) for s in ok) / 1000
+        return {
+            "requests": len(samples),
+            "errors": sum(s["status"] == "error" for s in samples),
+            # Requests answered by sharing an identical request already in flight
+            "coalesced": sum(s["status"] == "coalesced" for s in samples),
+            "p50_ms": percentile(latencies, 0.5),
+            "p95_ms": percentile(latencies, 0.95),
+            "ttft_p50_ms": percentile(ttfts, 0.5),
+            "tokens_per_s": eval_tokens / eval_seconds if eval_seconds else None,
+            "prompt_tokens": sum(s.get("prompt_eval_count", 0) for s in ok),
+            "eval_tokens": eval_tokens,
+            "load_ms": sum(s.get("load_ms", 0) for s in ok),
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition of totals and windowed latency quantiles"""
+        with self._lock:
+            totals = dict(self.totals)
+        lines = [
+            "# HELP gemma3n_requests_total Requests to the model backend.",
+            "# TYPE gemma3n_requests_total counter",
+        ]
+        for (endpoint, model, status), values in sorted(totals.items()):
+            lines.append(f'gemma3n_requests_total{{{_labels(endpoint, model, status)}}} {values["requests"]}')
+        for metric, key, help_text in (
+                ("gemma3n_request_seconds_total", "seconds", "Client-side time spent in requests."),
+                ("gemma3n_prompt_tokens_total", "prompt_tokens", "Prompt tokens evaluated by the server."),
+                ("gemma3n_eval_tokens_total", "eval_tokens", "Tokens generated by the server.")):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            for (endpoint, model, status), values in sorted(totals.items()):
+                lines.append(f'{metric}{{{_labels(endpoint, model, status)}}} {values[key]}')
+
+        summary = self.summary()
+        lines += ["# HELP gemma3n_request_latency_seconds Request latency over recent requests.",
+                  "# TYPE gemma3n_request_latency_seconds summary"]
+        for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms")):
+            if summary[key] is not None:
+                lines.append(f'gemma3n_request_latency_seconds{{quantile="{quantile}"}} {summary[key] / 1000:.6f}')
+        if summary["tokens_per_s"] is not None:
+            lines += ["# HELP gemma3n_eval_tokens_per_second Generation speed over recent requests.",
+                      "# TYPE gemma3n_eval_tokens_per_second gauge",
+                      f"gemma3n_eval_tokens_per_second {summary['tokens_per_s']:.3f}"]
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self) -> str:
+        return "".join(json.dumps(sample) + "\n" for sample in self.snapshot())
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+            self.totals.clear()
+
+    def close(self):
+        """Close the request log, if one is open; a later record() reopens it"""
+        with self._log_lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+_metrics = MetricsRecorder()
+
+def get_metrics() -> MetricsRecorder:
+    """Return the process-wide metrics recorder"""
+    return _metrics
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    """One-line summary for terminal output"""
+    def ms(value):
+        return f"{value:.0f} ms" if value is not None else "-"
+
+    rate = f"{summary['tokens_per_s']:.1f} tokens/s" if summary["tokens_per_s"] is not None else "- tokens/s"
+    return (f"{summary['requests']} requests ({summary['errors']} errors, {summary['coalesced']} coalesced), latency p50 {ms(summary['p50_ms'])} "
+            f"/ p95 {ms(summary['p95_ms'])}, TTFT p50 {ms(summary['ttft_p50_ms'])}, {rate}")
+
+def render_streamlit_panel(container, metrics: Optional[MetricsRecorder] = None):
+    """Live stats panel for a Streamlit sidebar (pass st.sidebar)"""
+    metrics = metrics or get_metrics()
+    summary = metrics.summary()
+    panel = container.expander("📈 Performance", expanded=False)
+    if not summary["requests"]:
+        panel.caption("No model requests yet")
+        return
+
+    def ms(value):
+        return f"{value:.0f} ms" if value is not None else "–"
+
+    col1, col2 = panel.columns(2)
+    col1.metric("Latency p50", ms(summary["p50_ms"]))
+    col2.metric("Latency p95", ms(summary["p95_ms"]))
+    col1.metric("Tokens/s", f"{summary['tokens_per_s']:.1f}" if summary["tokens_per_s"] is not None else "–")
+    col2.metric("TTFT p50", ms(summary["ttft_p50_ms"]))
+    panel.caption(f"{summary['requests']} requests, {summary['errors']} errors, {summary['coalesced']} coalesced · "
+                  f"{summary['prompt_tokens']} prompt / {summary['eval_tokens']} generated tokens")
+    panel.download_button("Prometheus metrics", metrics.to_prometheus(),
+                          file_name="gemma3n_metrics.prom", mime="text/plain")
+    panel.download_button("Request log (JSONL)", metrics.to_jsonl(),
+                          file_name="gemma3n_requests.jsonl", mime="application/x-ndjson")
@@ -1,11 +1,19 @@
 
 import streamlit as st
 import requests
-import base64
 from io import BytesIO
 from PIL import Image
 import json
 import os
+import time
+from gemma3n_audio import (DEFAULT_WINDOW_S, chat_audio_handler, format_timestamp, format_transcript,
+                           process_audio, stt_handler)
+from gemma3n_cache import make_cache_key
+from gemma3n_client import get_client
+from gemma3n_image import format_savings, prepare_image
+from gemma3n_metrics import get_metrics, render_streamlit_panel
+from gemma3n_semantic_cache import DEFAULT_THRESHOLD, SemanticCache, cache_scope, format_cache_stats
+from gemma3n_stt import STT_ENGINES, create_engine as create_stt_engine
 
 # Streamlit app for Gemma 3n Multimodal Chat
 st.set_page_config(
@@ -23,8 +31,15 @@ api_provider = st.sidebar.selectbox(
 
 # API configuration based on provider
 if api_provider == "Ollama (Local)":
-    ollama_url = st.sidebar.text_input("Ollama URL", "http://localhost:11434")
+    ollama_url = st.sidebar.text_input("Ollama URL", "http://localhost:11434",
+                                       help="Comma-separate several servers to balance requests across them")
     model_name = st.sidebar.selectbox("Model", ["gemma3n:e4b", "gemma3n:e2b"])
+    use_semantic_cache = st.sidebar.checkbox(
+        "Semantic cache", value=False,
+        help="Answer text questions similar to earlier ones (from any session) with their cached answers"
+    )
+    similarity_threshold = st.sidebar.slider("Similarity threshold", 0.80, 1.00, DEFAULT_THRESHOLD, 0.01,
+                                             disabled=not use_semantic_cache)
 elif api_provider == "Together AI":
     together_api_key = st.sidebar.text_input("Together AI API Key", type="password")
     model_name = "google/gemma-3n-E4B-it"
@@ -32,6 +47,20 @@ else:
     google_api_key = st.sidebar.text_input("Google AI API Key", type="password")
     model_name = "gemma-3n-e4b"
 
+AUDIO_ENDPOINT = "audio-capable endpoint"
+with st.sidebar.expander("Audio processing"):
+    audio_backend = st.selectbox(
+        "Audio backend", list(STT_ENGINES.keys()) + [AUDIO_ENDPOINT],
+        help="A local speech recognizer, or an OpenAI-compatible server (e.g. vLLM) that accepts Gemma 3n audio input"
+    )
+    if audio_backend == AUDIO_ENDPOINT:
+        audio_endpoint_url = st.text_input("Endpoint URL", "http://localhost:8000")
+        audio_endpoint_model = st.text_input("Endpoint model", "google/gemma-3n-E4B-it")
+        audio_endpoint_key = st.text_input("Endpoint API key", type="password")
+    audio_window_s = st.number_input("Window length (s)", min_value=5, max_value=60, value=DEFAULT_WINDOW_S,
+                                     help="Recordings are split into windows this long for the audio encoder")
+    audio_workers = st.number_input("Parallel windows", min_value=1, max_value=16, value=2)
+
 st.title("🤖 Gemma 3n Multimodal Assistant")
 st.markdown("Upload images, record audio, or ask text questions!")
 
@@ -51,55 +80,81 @@ if uploaded_image:
     image = Image.open(uploaded_image)
     st.image(image, caption="Uploaded Image", use_container_width=True)
 
-# Chat interface
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
+if uploaded_audio:
+    st.audio(uploaded_audio)
 
-# User input
-if prompt := st.chat_input("Ask about the image, audio, or anything else..."):
-    # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+def encode_upload(image):
+    """Downscale and re-encode an uploaded image, reporting the bytes saved"""
+    prepared = prepare_image(image.getvalue())
+    st.caption(f"🖼️ Image prepared: {format_savings(prepared)}")
+    return prepared
 
-    with st.chat_message("user"):
-        st.markdown(prompt)
+@st.cache_resource
+def get_stt_engine(name):
+    """Load a speech recognition engine once per process; offline models are large"""
+    return create_stt_engine(name)
 
-    # Generate response
-    with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            try:
-                if api_provider == "Ollama (Local)":
-                    response = call_ollama_api(prompt, uploaded_image, uploaded_audio, ollama_url, model_name)
-                elif api_provider == "Together AI":
-                    response = call_together_api(prompt, uploaded_image, uploaded_audio, together_api_key, model_name)
-                else:
-                    response = call_google_ai_api(prompt, uploaded_image, uploaded_audio, google_api_key, model_name)
+def audio_window_handler():
+    """Handler that turns one audio window into text with the selected backend"""
+    if audio_backend == AUDIO_ENDPOINT:
+        return chat_audio_handler(audio_endpoint_url, audio_endpoint_model, audio_endpoint_key or None)
+    return stt_handler(get_stt_engine(audio_backend))
 
-                st.markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
+def process_upload_audio(audio):
+    """Process an uploaded recording once per backend; follow-up questions reuse the result"""
+    backend = [audio_backend]
+    if audio_backend == AUDIO_ENDPOINT:
+        backend += [audio_endpoint_url, audio_endpoint_model]
+    key = make_cache_key(audio.getvalue(), backend, audio_window_s)
+    if "audio_results" not in st.session_state:
+        st.session_state.audio_results = {}
 
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
+    if key not in st.session_state.audio_results:
+        status = st.empty()
+        status.caption("🎧 Processing audio...")
+        st.session_state.audio_results[key] = process_audio(
+            audio.getvalue(), audio.name, audio_window_handler(), int(audio_workers), audio_window_s,
+            progress=lambda done: status.caption(f"🎧 Processed {done} audio window(s)...")
+        )
+        status.empty()
+    return st.session_state.audio_results[key]
 
-def call_ollama_api(prompt, image, audio, url, model):
-    """Call Ollama local API with multimodal support"""
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False
-    }
+def audio_prompt(prompt, audio):
+    """Add the transcript of an uploaded recording to the prompt"""
+    if not audio:
+        return prompt
+
+    results = process_upload_audio(audio)
+    failed = [r for r in results if r["text"].startswith("Error:")]
+    duration = sum(r["duration_s"] for r in results)
+    st.caption(f"🎧 Audio: {format_timestamp(duration)} in {len(results)} window(s)")
+    if failed:
+        st.warning(f"{len(failed)} audio window(s) failed: {failed[0]['text']}")
+
+    transcript = format_transcript(results)
+    if not transcript:
+        return prompt
+    return f"{prompt}\n\nTranscript of the attached audio, with timestamps:\n{transcript}"
+
+def ollama_images(image):
+    """Prepare the images list for an Ollama request"""
+    images = None
 
     # Add image if provided
     if image:
-        image_data = base64.b64encode(image.getvalue()).decode()
-        payload["images"] = [image_data]
+        images = [encode_upload(image)["data"]]
+
+    return images
 
-    # Note: Audio support coming soon in Ollama
-    if audio:
-        st.warning("Audio support coming soon to Ollama!")
+def stream_ollama_api(prompt, image, audio, url, model):
+    """Stream the Ollama response token by token"""
+    # Ollama has no audio input, so recordings arrive as a transcript
+    return get_client(url).generate_stream(model, audio_prompt(prompt, audio), ollama_images(image))
 
-    response = requests.post(f"{url}/api/generate", json=payload)
-    return response.json().get("response", "No response")
+@st.cache_resource
+def get_semantic_cache(url) -> SemanticCache:
+    # Shared by every session of this server, so one user's answer serves the next
+    return SemanticCache(url)
 
 def call_together_api(prompt, image, audio, api_key, model):
     """Call Together AI API with multimodal support"""
@@ -108,14 +163,16 @@ def call_together_api(prompt, image, audio, api_key, model):
         "Content-Type": "application/json"
     }
 
+    prompt = audio_prompt(prompt, audio)
     messages = [{"role": "user", "content": prompt}]
 
     # Add image if provided
     if image:
-        image_data = base64.b64encode(image.getvalue()).decode()
+        prepared = encode_upload(image)
+        mime = f"image/{prepared['format'].lower()}"
         messages[0]["content"] = [
             {"type": "text", "text": prompt},
-            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}}
+            {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{prepared['data']}"}}
         ]
 
     payload = {
@@ -124,9 +181,16 @@ def call_together_api(prompt, image, audio, api_key, model):
         "max_tokens": 1000
     }
 
+    started = time.perf_counter()
     response = requests.post("https://api.together.xyz/v1/chat/completions", 
                            headers=headers, json=payload)
-    return response.json()["choices"][0]["message"]["content"]
+    body = response.json()
+    usage = body.get("usage") or {}
+    get_metrics().record("together:/v1/chat/completions", model, "ok" if response.ok else "error",
+                         total_ms=(time.perf_counter() - started) * 1000,
+                         prompt_eval_count=usage.get("prompt_tokens", 0),
+                         eval_count=usage.get("completion_tokens", 0))
+    return body["choices"][0]["message"]["content"]
 
 def call_google_ai_api(prompt, image, audio, api_key, model):
     """Call Google AI Studio API with multimodal support"""
@@ -135,6 +199,61 @@ def call_google_ai_api(prompt, image, audio, api_key, model):
     st.info("Google AI Studio integration - use the SDK for full implementation")
     return "Response from Google AI Studio (implement with official SDK)"
 
+# Chat interface
+for message in st.session_state.messages:
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+
+# User input
+if prompt := st.chat_input("Ask about the image, audio, or anything else..."):
+    # Add user message to chat history
+    st.session_state.messages.append({"role": "user", "content": prompt})
+
+    with st.chat_message("user"):
+        st.markdown(prompt)
+
+    # Generate response
+    with st.chat_message("assistant"):
+        with st.spinner("Thinking..."):
+            try:
+                # Answers about an uploaded image or recording cannot be reused for other uploads
+                semantic_cache = (get_semantic_cache(ollama_url) if api_provider == "Ollama (Local)"
+                                  and use_semantic_cache and not uploaded_image and not uploaded_audio else None)
+                scope = cache_scope(model_name)
+                hit = semantic_cache.get(prompt, scope, similarity_threshold) if semantic_cache else None
+                if hit is not None:
+                    response = hit["response"]
+                    st.markdown(response)
+                    st.caption(f"⚡ Cached answer (similarity {hit['score']:.2f})")
+                elif api_provider == "Ollama (Local)":
+                    # Tokens are rendered as they arrive
+                    started = time.perf_counter()
+                    response = st.write_stream(
+                        stream_ollama_api(prompt, uploaded_image, uploaded_audio, ollama_url, model_name)
+                    )
+                    if semantic_cache:
+                        semantic_cache.put(prompt, response, scope, (time.perf_counter() - started) * 1000)
+                else:
+                    if api_provider == "Together AI":
+                        response = call_together_api(prompt, uploaded_image, uploaded_audio, together_api_key, model_name)
+                    else:
+                        response = call_google_ai_api(prompt, uploaded_image, uploaded_audio, google_api_key, model_name)
+                    st.markdown(response)
+
+                st.session_state.messages.append({"role": "assistant", "content": response})
+
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
+
+# Latency and throughput of the requests made so far
+render_streamlit_panel(st.sidebar)
+if api_provider == "Ollama (Local)" and use_semantic_cache:
+    semantic_cache = get_semantic_cache(ollama_url)
+    if semantic_cache.disabled_reason:
+        st.sidebar.warning(f"Semantic cache paused: {semantic_cache.disabled_reason}")
+    else:
+        st.sidebar.caption(f"⚡ Semantic cache: {format_cache_stats(semantic_cache.summary())}")
+
 # Add reset button
 if st.sidebar.button("Clear Chat"):
     st.session_state.messages = []
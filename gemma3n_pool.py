@@ -0,0 +1,327 @@
+"""
+Gemma 3n Backend Pool
+Load balancing and failover across several Ollama servers behind the OllamaClient interface
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+
+from gemma3n_cache import make_cache_key
+from gemma3n_client import OllamaClient, OllamaError
+from gemma3n_singleflight import COALESCED_PATHS, SingleFlight, request_key
+
+STRATEGIES = ("least_outstanding", "latency")
+# Seconds between /api/tags probes of every backend
+HEALTH_INTERVAL_S = 10
+HEALTH_TIMEOUT_S = 2
+# A failed backend is left out of rotation this long unless a health check revives it sooner
+COOLDOWN_S = 30
+# Weight of the newest request in the per-backend latency average
+LATENCY_ALPHA = 0.2
+# Conversations remembered for routing follow-up turns to the backend holding their KV cache
+MAX_AFFINITY_ENTRIES = 1024
+
+class Backend:
+    """One Ollama server and its routing state"""
+
+    def __init__(self, client: OllamaClient):
+        self.client = client
+        self.outstanding = 0
+        self.latency_ms: Optional[float] = None
+        self.healthy = True
+        self.down_until = 0.0
+        self.models: Optional[set] = None
+        self.requests = 0
+        self.failures = 0
+        self.last_error = ""
+
+    @property
+    def url(self) -> str:
+        return self.client.base_url
+
+    def available(self, now: float) -> bool:
+        return self.healthy or now >= self.down_until
+
+    def has_model(self, model: str) -> bool:
+        # Unknown until the first health check; assume it is there
+        if not self.models or not model:
+            return True
+        return model in self.models or f"{model}:latest" in self.models
+
+def _is_failover_error(error: Exception) -> bool:
+    """Errors worth retrying on another server: connection problems, timeouts and 5xx/404 responses"""
+    if isinstance(error, OllamaError):
+        # Reported mid-response, usually an out-of-memory or model load failure on that node
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        # 404 is a model that is not pulled on this node
+        return error.response.status_code >= 500 or error.response.status_code == 404
+    return isinstance(error, requests.exceptions.RequestException)
+
+class BackendPool:
+    """Spreads requests over several Ollama servers with the same API as OllamaClient.
+
+    Each request goes to the available backend with the fewest outstanding
+    requests, or with the lowest expected wait (latency x queue) in "latency"
+    mode. A backend that fails is taken out of rotation and the request is
+    retried on the next one, so a batch keeps going when a node dies. A
+    background thread probes /api/tags to bring recovered nodes back and to
+    learn which models each node has. Chat turns stick to the backend that
+    served the conversation before, where its prompt prefix is still cached.
+    """
+
+    def __init__(self, urls: List[str], strategy: str = "least_outstanding",
+                 health_interval: float = HEALTH_INTERVAL_S, cooldown: float = COOLDOWN_S,
+                 client_factory: Callable[[str], OllamaClient] = None):
+        if not urls:
+            raise ValueError("A backend pool needs at least one URL")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        # Failover replaces the per-client retries, which would otherwise delay it by seconds.
+        # Requests are coalesced here, before routing, so duplicates on different nodes share too.
+        client_factory = client_factory or (lambda url: OllamaClient(url, max_retries=1, coalesce=False))
+        self.single_flight = SingleFlight()
+        self.backends = [Backend(client_factory(url)) for url in urls]
+        self.base_url = ",".join(backend.url for backend in self.backends)
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self._affinity: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._health_thread = None
+        if health_interval:
+            self._health_thread = threading.Thread(target=self._health_loop, args=(health_interval,), daemon=True)
+            self._health_thread.start()
+
+    def _expected_wait(self, backend: Backend) -> float:
+        if self.strategy == "latency":
+            # Untried backends look fast so that they get measured
+            return (backend.latency_ms or 0.0) * (backend.outstanding + 1)
+        return backend.outstanding
+
+    def _acquire(self, model: str, tried: set, affinity: Optional[str]) -> Optional[Backend]:
+        """Choose a backend for a request and count it as outstanding"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in tried and b.available(now)]
+            if not candidates:
+                # Everything is down: try the untried nodes anyway rather than fail without asking
+                candidates = [b for b in self.backends if b not in tried]
+            if not candidates:
+                return None
+            candidates = [b for b in candidates if b.has_model(model)] or candidates
+
+            backend = min(candidates, key=self._expected_wait)
+            sticky = self._affinity.get(affinity) if affinity else None
+            # Stay on the cached backend unless it is clearly busier than the best one
+            if sticky in candidates and sticky.outstanding <= backend.outstanding + 1:
+                backend = sticky
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def _release(self, backend: Backend, started: float, error: Optional[Exception] = None,
+                 affinity: Optional[str] = None, failover: Optional[bool] = None):
+        """Finish a request; failover says whether error takes the backend out of rotation.
+
+        It is worked out from the requests exception when not given, so that
+        the async client can report its httpx errors through the same state.
+        """
+        if error is not None and failover is None:
+            failover = _is_failover_error(error)
+        with self._lock:
+            backend.outstanding -= 1
+            if error is None:
+                elapsed_ms = (time.monotonic() - started) * 1000
+                backend.latency_ms = elapsed_ms if backend.latency_ms is None else (
+                    backend.latency_ms + LATENCY_ALPHA * (elapsed_ms - backend.latency_ms))
+                backend.healthy = True
+                if affinity:
+                    self._affinity[affinity] = backend
+                    self._affinity.move_to_end(affinity)
+                    while len(self._affinity) > MAX_AFFINITY_ENTRIES:
+                        self._affinity.popitem(last=False)
+            elif failover:
+                backend.failures += 1
+                backend.last_error = str(error)
+                missing_model = (isinstance(error, requests.exceptions.HTTPError)
+                                 and error.response is not None and error.response.status_code == 404)
+                if not missing_model:
+                    backend.healthy = False
+                    backend.down_until = time.monotonic() + self.cooldown
+
+    @staticmethod
+    def _affinity_key(path: str, payload: Dict[str, Any]) -> Optional[str]:
+        """Conversation identity for callers that pass no session: model plus the first user turn.
+
+        Only stable while no history is trimmed, so long conversations should
+        pass a session id (ChatSession does).
+        """
+        messages = payload.get("messages")
+        if path != "/api/chat" or not messages:
+            return None
+        head = [m for m in messages if m.get("role") != "system"][:1]
+        return make_cache_key(payload.get("model"), messages[0], head)
+
+    def post(self, path: str, payload: Dict[str, Any], affinity: Optional[str] = None) -> Dict[str, Any]:
+        """POST to the best backend, failing over to the others on connection or server errors.
+
+        Requests with the same affinity key stick to the backend that served the last one.
+        """
+        if path not in COALESCED_PATHS:
+            return self._post(path, payload, affinity)
+        body, shared = self.single_flight.do(request_key(path, payload), lambda: self._post(path, payload, affinity))
+        if shared:
+            self.backends[0].client.metrics.record(path, payload.get("model", ""), "coalesced", backend=self.base_url)
+        return body
+
+    def _post(self, path: str, payload: Dict[str, Any], affinity: Optional[str] = None) -> Dict[str, Any]:
+        affinity = affinity or self._affinity_key(path, payload)
+        tried = set()
+        last_error: Optional[Exception] = None
+        while True:
+            backend = self._acquire(payload.get("model", ""), tried, affinity)
+            if backend is None:
+                raise last_error
+            tried.add(backend)
+            started = time.monotonic()
+            try:
+                body = backend.client.post(path, payload)
+            except requests.exceptions.RequestException as e:
+                self._release(backend, started, e)
+                if not _is_failover_error(e):
+                    raise
+                last_error = e
+                continue
+            self._release(backend, started, affinity=affinity)
+            return body
+
+    def stream_lines(self, path: str, payload: Dict[str, Any],
+                     affinity: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream from the best backend; fails over only until the first chunk has been yielded"""
+        if path not in COALESCED_PATHS:
+            return self._stream_lines(path, payload, affinity)
+        chunks, joined = self.single_flight.stream(request_key(path, payload),
+                                                   lambda: self._stream_lines(path, payload, affinity))
+        if joined:
+            self.backends[0].client.metrics.record(path, payload.get("model", ""), "coalesced", backend=self.base_url)
+        return chunks
+
+    def _stream_lines(self, path: str, payload: Dict[str, Any],
+                      affinity: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        affinity = affinity or self._affinity_key(path, payload)
+        tried = set()
+        last_error: Optional[Exception] = None
+        while True:
+            backend = self._acquire(payload.get("model", ""), tried, affinity)
+            if backend is None:
+                raise last_error
+            tried.add(backend)
+            started = time.monotonic()
+            yielded = False
+            error = None
+            try:
+                for chunk in backend.client.stream_lines(path, payload):
+                    yielded = True
+                    yield chunk
+                return
+            except requests.exceptions.RequestException as e:
+                error = e
+                # Text already shown to the caller cannot be replayed on another node
+                if yielded or not _is_failover_error(e):
+                    raise
+                last_error = e
+            finally:
+                self._release(backend, started, error, affinity if error is None else None)
+
+    # The request helpers of OllamaClient route through post() and stream_lines() above
+
+    def _payload_client(self) -> OllamaClient:
+        return self.backends[0].client
+
+    def generate(self, model: str, prompt: str, images: Optional[List[str]] = None,
+                 options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        payload = self._payload_client()._generate_payload(model, prompt, images, options, False)
+        return self.post("/api/generate", payload)
+
+    def generate_stream(self, model: str, prompt: str, images: Optional[List[str]] = None,
+                        options: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        payload = self._payload_client()._generate_payload(model, prompt, images, options, True)
+        for chunk in self.stream_lines("/api/generate", payload):
+            if chunk.get("response"):
+                yield chunk["response"]
+
+    def chat(self, model: str, messages: List[Dict[str, Any]], options: Optional[Dict[str, Any]] = None,
+             session: Optional[str] = None) -> Dict[str, Any]:
+        return self.post("/api/chat", self._payload_client()._chat_payload(model, messages, options, False),
+                         session)
+
+    def chat_stream(self, model: str, messages: List[Dict[str, Any]], options: Optional[Dict[str, Any]] = None,
+                    session: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        return self.stream_lines("/api/chat", self._payload_client()._chat_payload(model, messages, options, True),
+                                 session)
+
+    def embed(self, model: str, text: str) -> List[float]:
+        return self.post("/api/embeddings", self._payload_client()._embed_payload(model, text))["embedding"]
+
+    def list_models(self) -> List[Dict[str, Any]]:
+        """Models available on any healthy backend; raises only if every backend is unreachable"""
+        models = {}
+        errors = []
+        for backend in self.backends:
+            try:
+                for model in self.check(backend):
+                    models.setdefault(model["name"], model)
+            except requests.exceptions.RequestException as e:
+                errors.append(e)
+        if len(errors) == len(self.backends):
+            raise errors[0]
+        return list(models.values())
+
+    def check(self, backend: Backend) -> List[Dict[str, Any]]:
+        """Probe /api/tags, updating the backend's health and model list"""
+        try:
+            response = backend.client.session.get(f"{backend.url}/api/tags", timeout=HEALTH_TIMEOUT_S)
+            response.raise_for_status()
+            models = response.json().get("models", [])
+        except requests.exceptions.RequestException as e:
+            with self._lock:
+                backend.healthy = False
+                backend.down_until = time.monotonic() + self.cooldown
+                backend.last_error = str(e)
+            raise
+        with self._lock:
+            backend.healthy = True
+            backend.down_until = 0.0
+            backend.models = {model["name"] for model in models}
+        return models
+
+    def _health_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            for backend in self.backends:
+                try:
+                    self.check(backend)
+                except requests.exceptions.RequestException:
+                    pass
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Routing state of every backend"""
+        with self._lock:
+            return [{
+                "url": b.url,
+                "healthy": b.healthy,
+                "outstanding": b.outstanding,
+                "requests": b.requests,
+                "failures": b.failures,
+                "latency_ms": round(b.latency_ms, 1) if b.latency_ms is not None else None,
+                "last_error": b.last_error,
+            } for b in self.backends]
+
+    def close(self):
+        self._closed.set()
+        for backend in self.backends:
+            backend.client.close()
@@ -0,0 +1,114 @@
+"""
+Gemma 3n Retrieval
+Chunking, embedding and a NumPy vector index for question answering over documents
+"""
+
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from gemma3n_cache import DEFAULT_CACHE_DIR
+from gemma3n_chunking import estimate_tokens
+from gemma3n_client import OllamaClient
+
+DEFAULT_EMBED_MODEL = "nomic-embed-text"
+DEFAULT_INDEX_DIR = DEFAULT_CACHE_DIR / "indexes"
+DEFAULT_CHUNK_TOKENS = 300
+DEFAULT_OVERLAP_TOKENS = 50
+
+def chunk_text(text: str, max_tokens: int = DEFAULT_CHUNK_TOKENS,
+               overlap_tokens: int = DEFAULT_OVERLAP_TOKENS) -> List[str]:
+    """Split text into overlapping word windows of roughly max_tokens"""
+    words = re.findall(r"\S+\s*", text)
+    if not words:
+        return []
+
+    chunks = []
+    start = 0
+    while start < len(words):
+        end = start
+        tokens = 0
+        while end < len(words) and (tokens == 0 or tokens + estimate_tokens(words[end]) <= max_tokens):
+            tokens += estimate_tokens(words[end])
+            end += 1
+        chunks.append("".join(words[start:end]).strip())
+        if end >= len(words):
+            break
+        # Step back so neighbouring chunks share some context
+        overlap = 0
+        back = end
+        while back > start + 1 and overlap < overlap_tokens:
+            back -= 1
+            overlap += estimate_tokens(words[back])
+        start = back
+    return chunks
+
+def embed_texts(client: OllamaClient, model: str, texts: List[str], workers: int = 4) -> np.ndarray:
+    """Embed texts concurrently and return an (n, dim) float32 matrix"""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        vectors = list(executor.map(lambda text: client.embed(model, text), texts))
+    return np.asarray(vectors, dtype=np.float32)
+
+class VectorIndex:
+    """Brute-force cosine similarity index over unit-normalized vectors"""
+
+    def __init__(self, vectors: np.ndarray, records: List[Dict[str, Any]], embed_model: str):
+        if len(vectors) != len(records):
+            raise ValueError("vectors and records must have the same length")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True) if len(vectors) else 1
+        self.vectors = (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+        self.records = records
+        self.embed_model = embed_model
+        # Pages whose text could not be obtained; an index missing any is never saved
+        self.missing_pages: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def search(self, query: np.ndarray, k: int = 4) -> List[Dict[str, Any]]:
+        """Return the k most similar records, each with a 'score'"""
+        if not len(self.records):
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{**self.records[i], "score": float(scores[i])} for i in top]
+
+    def save(self, directory: Path):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / "vectors.npy", self.vectors)
+        with open(directory / "records.json", "w", encoding="utf-8") as f:
+            json.dump({"embed_model": self.embed_model, "records": self.records}, f)
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional["VectorIndex"]:
+        """Load a saved index, or None if there is none"""
+        directory = Path(directory)
+        try:
+            vectors = np.load(directory / "vectors.npy")
+            with open(directory / "records.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(vectors, meta["records"], meta["embed_model"])
+
+def build_qa_prompt(question: str, hits: List[Dict[str, Any]]) -> str:
+    """Prompt that answers a question from retrieved document passages only"""
+    context = "\n\n".join(f"[Page {hit['page']}]\n{hit['text']}" for hit in hits)
+    return f"""Answer the question using only the document passages below.
+Cite the page numbers you used, like (Page 3). If the passages do not contain
+the answer, say so.
+
+{context}
+
+Question: {question}"""
@@ -0,0 +1,232 @@
+"""
+Gemma 3n Semantic Cache
+Answer repeated chat questions from earlier responses to similar prompts
+"""
+
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import requests
+
+from gemma3n_cache import DEFAULT_CACHE_DIR, make_cache_key
+from gemma3n_client import DEFAULT_OLLAMA_URL, get_client
+from gemma3n_retrieval import DEFAULT_EMBED_MODEL
+
+DEFAULT_SEMANTIC_CACHE_DIR = DEFAULT_CACHE_DIR / "semantic"
+# Cosine similarity a new prompt needs with a stored one to reuse its answer
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_TTL_S = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 2000
+# Prompts longer than this are treated as carrying pasted files and never cached
+MAX_PROMPT_LINES = 12
+MAX_PROMPT_CHARS = 2000
+# Shorter prompts are usually follow-ups ("why?", "and in Rust?") whose answer depends on the conversation
+MIN_PROMPT_WORDS = 4
+# Embeddings kept from lookups so that put() after a miss does not embed the prompt again
+PENDING_EMBEDDINGS = 64
+# Consecutive embedding failures that pause the cache, and how long before it tries again
+EMBED_FAILURE_LIMIT = 3
+EMBED_RETRY_AFTER_S = 60
+
+# Code fences, diffs and tracebacks mark a prompt that embeds file contents
+FILE_CONTENT_PATTERN = re.compile(r"```|^(?:diff --git|@@ |\+\+\+ |--- |Traceback \()", re.MULTILINE)
+
+def has_file_contents(prompt: str) -> bool:
+    """Whether a prompt includes pasted file contents rather than just a question"""
+    return (bool(FILE_CONTENT_PATTERN.search(prompt)) or len(prompt) > MAX_PROMPT_CHARS
+            or prompt.count("\n") >= MAX_PROMPT_LINES)
+
+def should_bypass(prompt: str) -> bool:
+    """Prompts whose answer cannot safely come from another conversation"""
+    return has_file_contents(prompt) or len(prompt.split()) < MIN_PROMPT_WORDS
+
+def cache_scope(model: str, system_prompt: Optional[str] = None, *extra: Any) -> str:
+    """Answers are only reused for the same model, system prompt and any other settings passed"""
+    return make_cache_key(model, system_prompt, *extra)
+
+class SemanticCache:
+    """Prompt/response pairs looked up by embedding similarity instead of exact text.
+
+    Prompts are embedded through the local Ollama embedding endpoint and kept
+    as unit vectors in one NumPy matrix, so a lookup is a single matrix-vector
+    product. Entries expire after ttl_s and the least recently used ones are
+    evicted beyond max_entries. A failed embedding only misses that lookup;
+    after EMBED_FAILURE_LIMIT failures in a row (for example the embedding model
+    is not pulled) the cache pauses, with disabled_reason set, and tries again
+    after EMBED_RETRY_AFTER_S.
+    """
+
+    def __init__(self, ollama_url: str = DEFAULT_OLLAMA_URL, embed_model: str = DEFAULT_EMBED_MODEL,
+                 threshold: float = DEFAULT_THRESHOLD, ttl_s: float = DEFAULT_TTL_S,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, directory: Optional[Path] = None):
+        self.ollama_url = ollama_url
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max(1, max_entries)
+        self.directory = Path(directory) if directory else None
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.entries: List[Dict[str, Any]] = []
+        self.disabled_reason = ""
+        self._failures = 0
+        self._paused_until = 0.0
+        self.stats = {"lookups": 0, "hits": 0, "bypassed": 0, "stored": 0, "evicted": 0,
+                      "saved_ms": 0.0, "embed_ms": 0.0}
+        self._pending: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        if self.directory is not None:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _paused(self) -> bool:
+        return bool(self.disabled_reason) and time.monotonic() < self._paused_until
+
+    def _embed(self, prompt: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._pending.get(prompt)
+        if vector is not None:
+            return vector
+        started = time.perf_counter()
+        try:
+            vector = np.asarray(get_client(self.ollama_url).embed(self.embed_model, prompt), dtype=np.float32)
+        except (requests.exceptions.RequestException, KeyError) as e:
+            with self._lock:
+                self._failures += 1
+                if self._failures >= EMBED_FAILURE_LIMIT:
+                    self.disabled_reason = (f"embedding with {self.embed_model} failed {self._failures} times "
+                                            f"in a row, retrying in {EMBED_RETRY_AFTER_S}s: {e}")
+                    self._paused_until = time.monotonic() + EMBED_RETRY_AFTER_S
+            return None
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self._lock:
+            self._failures = 0
+            self.disabled_reason = ""
+            self.stats["embed_ms"] += (time.perf_counter() - started) * 1000
+            self._pending[prompt] = vector
+            while len(self._pending) > PENDING_EMBEDDINGS:
+                self._pending.popitem(last=False)
+        return vector
+
+    def _expire(self, now: float):
+        """Drop entries past their TTL; caller holds the lock"""
+        keep = [i for i, entry in enumerate(self.entries) if now - entry["created"] <= self.ttl_s]
+        if len(keep) < len(self.entries):
+            self.stats["evicted"] += len(self.entries) - len(keep)
+            self.entries = [self.entries[i] for i in keep]
+            self.vectors = self.vectors[keep]
+
+    def get(self, prompt: str, scope: str = "", threshold: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Return the stored entry most similar to prompt, with its 'score', or None below the threshold"""
+        if self._paused():
+            return None
+        if should_bypass(prompt):
+            with self._lock:
+                self.stats["bypassed"] += 1
+            return None
+        vector = self._embed(prompt)
+        if vector is None:
+            return None
+
+        threshold = self.threshold if threshold is None else threshold
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            self._expire(now)
+            if not self.entries or self.vectors.shape[1] != len(vector):
+                return None
+            scores = self.vectors @ vector
+            # Entries from another model or system prompt can never match
+            scores[[entry["scope"] != scope for entry in self.entries]] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None
+            entry = self.entries[best]
+            entry["last_used"] = now
+            entry["hits"] += 1
+            self.stats["hits"] += 1
+            self.stats["saved_ms"] += entry["generation_ms"]
+            return {**entry, "score": float(scores[best])}
+
+    def put(self, prompt: str, response: str, scope: str = "", generation_ms: float = 0.0):
+        """Store a response; generation_ms is what a later hit counts as saved"""
+        if self._paused() or should_bypass(prompt) or not response.strip():
+            return
+        vector = self._embed(prompt)
+        if vector is None:
+            return
+
+        now = time.time()
+        entry = {"prompt": prompt, "response": response, "scope": scope, "generation_ms": generation_ms,
+                 "created": now, "last_used": now, "hits": 0}
+        with self._lock:
+            self._pending.pop(prompt, None)
+            if not self.entries or self.vectors.shape[1] != len(vector):
+                # First entry, or the embedding model changed: start a fresh matrix
+                self.entries, self.vectors = [], np.zeros((0, len(vector)), dtype=np.float32)
+            self._expire(now)
+            if len(self.entries) >= self.max_entries:
+                order = np.argsort([e["last_used"] for e in self.entries])
+                keep = np.sort(order[len(self.entries) - self.max_entries + 1:])
+                self.stats["evicted"] += len(self.entries) - len(keep)
+                self.entries = [self.entries[i] for i in keep]
+                self.vectors = self.vectors[keep]
+            self.entries.append(entry)
+            self.vectors = np.vstack([self.vectors, vector[None, :]])
+            self.stats["stored"] += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries = []
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+            self._pending.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        """Hit rate and inference time saved so far"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        # Each lookup pays for one embedding, hit or miss
+        stats["net_saved_ms"] = stats["saved_ms"] - stats["embed_ms"]
+        return stats
+
+    def save(self):
+        """Write the entries to directory, if one was given"""
+        if self.directory is None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            vectors, entries = self.vectors.copy(), list(self.entries)
+        np.save(self.directory / "vectors.npy", vectors)
+        with open(self.directory / "entries.json", "w", encoding="utf-8") as f:
+            json.dump({"embed_model": self.embed_model, "entries": entries}, f)
+
+    def load(self):
+        """Read entries saved by an earlier session; a missing or stale file leaves the cache empty"""
+        try:
+            vectors = np.load(self.directory / "vectors.npy")
+            with open(self.directory / "entries.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        if meta.get("embed_model") != self.embed_model or len(vectors) != len(meta.get("entries", [])):
+            return
+        with self._lock:
+            self.vectors = vectors.astype(np.float32)
+            self.entries = meta["entries"]
+            self._expire(time.time())
+
+def format_cache_stats(stats: Dict[str, Any]) -> str:
+    """One-line summary of SemanticCache.summary()"""
+    return (f"{stats['hits']}/{stats['lookups']} hits ({stats['hit_rate']:.0%}), "
+            f"{stats['bypassed']} bypassed, {stats['entries']} entries, "
+            f"saved {stats['saved_ms'] / 1000:.1f}s of inference "
+            f"({stats['net_saved_ms'] / 1000:.1f}s net of embedding)")
@@ -0,0 +1,192 @@
+"""
+Gemma 3n Single-Flight
+Coalesce identical in-flight model requests into one upstream call shared by every caller
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterator, Tuple
+
+from gemma3n_cache import make_cache_key
+
+# Only generation is worth sharing; tags and embeddings are cheap
+COALESCED_PATHS = ("/api/generate", "/api/chat")
+
+def request_key(path: str, payload: Dict[str, Any]) -> str:
+    """Identity of a request: path plus the whole body (model, prompt, images and options)"""
+    return make_cache_key(path, payload)
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class _Stream:
+    """Chunks of one upstream stream, replayed to every subscriber from the start"""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self.abandoned = False
+        self.condition = threading.Condition()
+
+class _Subscription:
+    """One reader of a shared stream.
+
+    It counts as a subscriber from the moment stream() returns it, so a late
+    joiner cannot see the stream abandoned before it starts reading, and stops
+    counting once exhausted, closed or garbage collected, including when the
+    caller never iterates it at all.
+    """
+
+    def __init__(self, single_flight: "SingleFlight", key: str, flight: _Stream):
+        self._single_flight = single_flight
+        self._key = key
+        self._flight = flight
+        self._index = 0
+        self._closed = False
+
+    def __iter__(self) -> "_Subscription":
+        return self
+
+    def __next__(self) -> Any:
+        if self._closed:
+            raise StopIteration
+        flight = self._flight
+        with flight.condition:
+            while self._index >= len(flight.chunks) and not flight.finished:
+                flight.condition.wait()
+            if self._index < len(flight.chunks):
+                self._index += 1
+                return flight.chunks[self._index - 1]
+            error = flight.error
+        self.close()
+        if error is not None:
+            raise error
+        raise StopIteration
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._single_flight._unsubscribe(self._key, self._flight)
+
+    def __del__(self):
+        self.close()
+
+class SingleFlight:
+    """Runs at most one call per key at a time; callers that arrive meanwhile share its result.
+
+    Non-streaming callers block until the leader's call finishes and receive a
+    copy of its result (or its exception). Streams are read upstream by a pump
+    thread into a buffer, and every subscriber, including the first, reads
+    that buffer. The upstream stream is closed only once every subscriber has
+    stopped reading, so one user closing a tab does not cut off the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Stream] = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return (fn() result, whether it was shared from another caller's call)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["calls"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return dict(call.result) if isinstance(call.result, dict) else call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stream(self, key: str, open_stream: Callable[[], Iterator[Any]]) -> Tuple[Iterator[Any], bool]:
+        """Return (iterator over the shared stream, whether an existing stream was joined)"""
+        with self._lock:
+            flight = self._streams.get(key)
+            joined = flight is not None and not flight.abandoned
+            if joined:
+                self.stats["coalesced"] += 1
+            else:
+                flight = self._streams[key] = _Stream()
+                self.stats["calls"] += 1
+            flight.subscribers += 1
+        if not joined:
+            threading.Thread(target=self._pump, args=(key, flight, open_stream), daemon=True).start()
+        return _Subscription(self, key, flight), joined
+
+    def _pump(self, key: str, flight: _Stream, open_stream: Callable[[], Iterator[Any]]):
+        iterator = None
+        try:
+            iterator = open_stream()
+            for chunk in iterator:
+                with flight.condition:
+                    flight.chunks.append(chunk)
+                    flight.condition.notify_all()
+                    if flight.abandoned:
+                        break
+        except BaseException as e:
+            flight.error = e
+        finally:
+            # Closing the generator closes the HTTP response, which stops generation
+            if hasattr(iterator, "close"):
+                iterator.close()
+            with self._lock:
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+            with flight.condition:
+                flight.finished = True
+                flight.condition.notify_all()
+
+    def _unsubscribe(self, key: str, flight: _Stream):
+        with self._lock:
+            with flight.condition:
+                flight.subscribers -= 1
+                if flight.subscribers == 0 and not flight.finished:
+                    # Nobody is reading: stop upstream, and let new callers start afresh
+                    flight.abandoned = True
+                    if self._streams.get(key) is flight:
+                        del self._streams[key]
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines: identical concurrent awaits share one task.
+
+    The shared task is shielded, so a cancelled caller does not cancel the call
+    for the others.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Future] = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["calls"] += 1
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        result = await asyncio.shield(task)
+        return (dict(result) if shared and isinstance(result, dict) else result), shared
@@ -0,0 +1,231 @@
+"""
+Gemma 3n Speech Recognition
+Pluggable speech-to-text engines with incremental decoding and a real-time factor benchmark
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from gemma3n_vad import DEFAULT_SAMPLE_RATE, WavFileSource
+
+class STTError(RuntimeError):
+    """The recognizer could not be reached or failed"""
+
+def pcm_to_float(pcm: bytes) -> np.ndarray:
+    """16-bit PCM bytes to float32 samples in [-1, 1]"""
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+def resample_pcm(pcm: bytes, from_rate: int, to_rate: int = DEFAULT_SAMPLE_RATE) -> bytes:
+    """Linear-interpolation resampling of 16-bit mono PCM; enough for speech recognition"""
+    if from_rate == to_rate or not pcm:
+        return pcm
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+    positions = np.arange(int(len(samples) * to_rate / from_rate)) * (from_rate / to_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.int16).tobytes()
+
+class STTEngine:
+    """Base class for speech recognizers working on 16 kHz 16-bit mono PCM.
+
+    stream() decodes incrementally: every partial_interval_s of new audio the
+    buffered utterance is transcribed again and yielded as a partial result.
+    Engines with native streaming override it; partial_interval_s=None disables
+    partials for engines where each decode is a paid network round trip.
+    """
+
+    name = "base"
+    offline = True
+    partial_interval_s: Optional[float] = 1.0
+    sample_rate = DEFAULT_SAMPLE_RATE
+
+    def transcribe(self, pcm: bytes) -> str:
+        raise NotImplementedError
+
+    def stream(self, frames: Iterable[bytes]) -> Iterator[Dict]:
+        """Yield {"text", "final"} dicts; the last one has final=True"""
+        buffer = bytearray()
+        decoded_bytes = 0
+        step_bytes = int(self.partial_interval_s * self.sample_rate * 2) if self.partial_interval_s else None
+        for frame in frames:
+            buffer.extend(frame)
+            if step_bytes and len(buffer) - decoded_bytes >= step_bytes:
+                decoded_bytes = len(buffer)
+                yield {"text": self.transcribe(bytes(buffer)), "final": False}
+        yield {"text": self.transcribe(bytes(buffer)) if buffer else "", "final": True}
+
+class GoogleEngine(STTEngine):
+    """Google Web Speech API through speech_recognition (requires network access)"""
+
+    name = "google"
+    offline = False
+    partial_interval_s = None
+
+    def __init__(self, language: str = "en-US"):
+        import speech_recognition as sr
+        self._sr = sr
+        self._recognizer = sr.Recognizer()
+        self.language = language
+
+    def transcribe(self, pcm: bytes) -> str:
+        audio = self._sr.AudioData(pcm, self.sample_rate, 2)
+        try:
+            return self._recognizer.recognize_google(audio, language=self.language)
+        except self._sr.UnknownValueError:
+            return ""
+        except self._sr.RequestError as e:
+            raise STTError(str(e))
+
+class VoskEngine(STTEngine):
+    """Offline Kaldi recognizer; decodes frame by frame as audio arrives"""
+
+    name = "vosk"
+
+    def __init__(self, model_path: Optional[str] = None):
+        from vosk import KaldiRecognizer, Model, SetLogLevel
+        SetLogLevel(-1)
+        model_path = model_path or os.environ.get("VOSK_MODEL_PATH", "vosk-model")
+        if not os.path.isdir(model_path):
+            raise STTError(f"Vosk model not found at {model_path} (set VOSK_MODEL_PATH)")
+        self._model = Model(model_path)
+        self._recognizer_class = KaldiRecognizer
+
+    def _recognizer(self):
+        return self._recognizer_class(self._model, self.sample_rate)
+
+    def transcribe(self, pcm: bytes) -> str:
+        recognizer = self._recognizer()
+        recognizer.AcceptWaveform(pcm)
+        return json.loads(recognizer.FinalResult()).get("text", "")
+
+    def stream(self, frames: Iterable[bytes]) -> Iterator[Dict]:
+        recognizer = self._recognizer()
+        committed = []
+        last = ""
+        for frame in frames:
+            if recognizer.AcceptWaveform(frame):
+                # End of a segment: its text no longer changes
+                committed.append(json.loads(recognizer.Result()).get("text", ""))
+                partial = ""
+            else:
+                partial = json.loads(recognizer.PartialResult()).get("partial", "")
+            text = " ".join(t for t in committed + [partial] if t)
+            if text != last:
+                last = text
+                yield {"text": text, "final": False}
+        committed.append(json.loads(recognizer.FinalResult()).get("text", ""))
+        yield {"text": " ".join(t for t in committed if t), "final": True}
+
+class WhisperEngine(STTEngine):
+    """Offline Whisper on CPU through faster-whisper (int8 quantized)"""
+
+    name = "whisper"
+
+    def __init__(self, model_size: Optional[str] = None, language: Optional[str] = "en",
+                 compute_type: str = "int8", cpu_threads: int = 0):
+        from faster_whisper import WhisperModel
+        model_size = model_size or os.environ.get("WHISPER_MODEL", "base")
+        self._model = WhisperModel(model_size, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+        self.language = language
+
+    def transcribe(self, pcm: bytes) -> str:
+        # Greedy decoding without conditioning keeps repeated partial decodes cheap
+        segments, _ = self._model.transcribe(pcm_to_float(pcm), language=self.language, beam_size=1,
+                                             condition_on_previous_text=False)
+        return "".join(segment.text for segment in segments).strip()
+
+STT_ENGINES: Dict[str, Callable[[], STTEngine]] = {
+    "google": GoogleEngine,
+    "vosk": VoskEngine,
+    "whisper": WhisperEngine,
+}
+
+def create_engine(name: str, **kwargs) -> STTEngine:
+    """Instantiate a registered speech recognition engine by name"""
+    if name not in STT_ENGINES:
+        raise ValueError(f"Unknown speech recognition engine: {name}")
+    return STT_ENGINES[name](**kwargs)
+
+def wav_frames(path: str, sample_rate: int = DEFAULT_SAMPLE_RATE) -> Iterator[bytes]:
+    """Frames of a WAV file as 16 kHz mono PCM"""
+    source = WavFileSource(path)
+    try:
+        while True:
+            frame = source.read_frame()
+            if not frame:
+                return
+            yield resample_pcm(frame, source.sample_rate, sample_rate)
+    finally:
+        source.close()
+
+def benchmark(engine: STTEngine, paths: List[str], stream: bool = True) -> List[Dict]:
+    """Decode each WAV file as fast as possible and measure the real-time factor.
+
+    RTF is decode time divided by audio duration; below 1.0 the engine keeps up
+    with live speech. In stream mode the time to the first partial is reported too.
+    """
+    results = []
+    for path in paths:
+        frames = list(wav_frames(path, engine.sample_rate))
+        audio_s = sum(len(f) for f in frames) / 2 / engine.sample_rate
+        started = time.perf_counter()
+        first_partial_s = None
+        partials = 0
+        if stream:
+            for result in engine.stream(frames):
+                if not result["final"]:
+                    partials += 1
+                    if first_partial_s is None:
+                        first_partial_s = time.perf_counter() - started
+                text = result["text"]
+        else:
+            text = engine.transcribe(b"".join(frames))
+        decode_s = time.perf_counter() - started
+        results.append({
+            "file": path,
+            "audio_s": round(audio_s, 3),
+            "decode_s": round(decode_s, 3),
+            "rtf": round(decode_s / audio_s, 3) if audio_s else None,
+            "first_partial_s": round(first_partial_s, 3) if first_partial_s is not None else None,
+            "partials": partials,
+            "text": text,
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemma 3n speech recognition benchmark")
+    parser.add_argument("files", nargs="+", help="WAV fixtures (16-bit PCM)")
+    parser.add_argument("--engine", choices=list(STT_ENGINES.keys()), default="vosk",
+                       help="Speech recognition engine")
+    parser.add_argument("--no-stream", action="store_true",
+                       help="Decode each file in one call instead of incrementally")
+    parser.add_argument("--json", action="store_true",
+                       help="Print results as JSON lines")
+
+    args = parser.parse_args()
+    try:
+        engine = create_engine(args.engine)
+    except (ImportError, STTError) as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+    results = benchmark(engine, args.files, stream=not args.no_stream)
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+        else:
+            first = f"{result['first_partial_s']:.2f}s" if result["first_partial_s"] is not None else "-"
+            print(f"{result['file']}: {result['audio_s']:.1f}s audio, decoded in {result['decode_s']:.2f}s, "
+                  f"RTF {result['rtf']}, first partial {first}\n  {result['text']}")
+
+    total_audio = sum(r["audio_s"] for r in results)
+    total_decode = sum(r["decode_s"] for r in results)
+    if total_audio and not args.json:
+        print(f"Overall RTF ({args.engine}): {total_decode / total_audio:.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Gemma 3n Speech Pipeline
+Sentence-level text-to-speech that synthesizes ahead while earlier sentences play
+"""
+
+import io
+import queue
+import re
+import shutil
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+class TTSEngine:
+    """Base class for speech synthesizers; returns encoded audio bytes"""
+
+    name = "base"
+    audio_format = "wav"
+
+    def synthesize(self, text: str, language: str = "en") -> bytes:
+        raise NotImplementedError
+
+class GTTSEngine(TTSEngine):
+    """Google Translate TTS (requires network access)"""
+
+    name = "gtts"
+    audio_format = "mp3"
+
+    def __init__(self):
+        from gtts import gTTS
+        self._gtts = gTTS
+
+    def synthesize(self, text: str, language: str = "en") -> bytes:
+        buffer = io.BytesIO()
+        self._gtts(text=text, lang=language, slow=False).write_to_fp(buffer)
+        return buffer.getvalue()
+
+class EspeakEngine(TTSEngine):
+    """Offline synthesis through the espeak-ng (or espeak) command line tool"""
+
+    name = "espeak"
+    audio_format = "wav"
+
+    def __init__(self, executable: Optional[str] = None, words_per_minute: int = 170):
+        self.executable = executable or shutil.which("espeak-ng") or shutil.which("espeak")
+        if not self.executable:
+            raise RuntimeError("espeak-ng is not installed")
+        self.words_per_minute = words_per_minute
+
+    def synthesize(self, text: str, language: str = "en") -> bytes:
+        # --stdout writes a WAV stream, so no temporary files are involved
+        result = subprocess.run(
+            [self.executable, "-v", language, "-s", str(self.words_per_minute), "--stdout", text],
+            capture_output=True, check=True
+        )
+        return result.stdout
+
+TTS_ENGINES: Dict[str, Callable[[], TTSEngine]] = {
+    "gtts": GTTSEngine,
+    "espeak": EspeakEngine,
+}
+
+def create_engine(name: str) -> TTSEngine:
+    """Instantiate a registered TTS engine by name"""
+    if name not in TTS_ENGINES:
+        raise ValueError(f"Unknown TTS engine: {name}")
+    return TTS_ENGINES[name]()
+
+class PygamePlayer:
+    """Plays in-memory audio buffers through pygame.mixer.music"""
+
+    def __init__(self):
+        import pygame
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        self._music = pygame.mixer.music
+
+    def play(self, audio: bytes, audio_format: str):
+        self._music.load(io.BytesIO(audio), f"speech.{audio_format}")
+        self._music.play()
+        while self._music.get_busy():
+            time.sleep(0.05)
+
+    def stop(self):
+        self._music.stop()
+
+# A sentence ends at terminal punctuation (plus closing quotes/brackets) followed by whitespace
+SENTENCE_END = re.compile(r'[.!?…]+["\')\]]*\s+|\n{2,}')
+
+class SentenceSplitter:
+    """Accumulates streamed text and emits complete sentences"""
+
+    def __init__(self, min_length: int = 12):
+        # Very short fragments ("Sure." / "1.") are merged into the next sentence
+        self.min_length = min_length
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        self._buffer += chunk
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            candidate = self._buffer[start:match.end()].strip()
+            if len(candidate) >= self.min_length:
+                sentences.append(candidate)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return [remainder] if remainder else []
+
+_DONE = object()
+
+class SpeechPipeline:
+    """Synthesizes sentence N+1 on one thread while sentence N plays on another"""
+
+    def __init__(self, engine: TTSEngine, language: str = "en", player=None, max_buffered: int = 4):
+        self.engine = engine
+        self.language = language
+        self.player = player if player is not None else PygamePlayer()
+        self.splitter = SentenceSplitter()
+        self.errors: List[Exception] = []
+        self._text_queue = queue.Queue()
+        # Bounded so synthesis does not run arbitrarily far ahead of playback
+        self._audio_queue = queue.Queue(maxsize=max_buffered)
+        self._stopped = threading.Event()
+        self._synth_thread = threading.Thread(target=self._synthesize_loop, daemon=True)
+        self._play_thread = threading.Thread(target=self._play_loop, daemon=True)
+        self._synth_thread.start()
+        self._play_thread.start()
+
+    def feed(self, chunk: str):
+        """Add streamed model output; complete sentences are queued for speech"""
+        for sentence in self.splitter.feed(chunk):
+            self._text_queue.put(sentence)
+
+    def speak(self, text: str):
+        """Queue a complete piece of text for speech"""
+        self.feed(text)
+
+    def finish(self):
+        """Flush any trailing partial sentence and mark the end of input"""
+        for sentence in self.splitter.flush():
+            self._text_queue.put(sentence)
+        self._text_queue.put(_DONE)
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until everything queued has been spoken"""
+        self._synth_thread.join(timeout)
+        self._play_thread.join(timeout)
+
+    def stop(self):
+        """Abandon queued speech and stop current playback"""
+        self._stopped.set()
+        self._text_queue.put(_DONE)
+        self.player.stop()
+        # Unblock the synthesis thread if it is waiting on a full audio queue
+        try:
+            while True:
+                self._audio_queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._audio_queue.put(_DONE)
+
+    def _synthesize_loop(self):
+        while not self._stopped.is_set():
+            sentence = self._text_queue.get()
+            if sentence is _DONE:
+                break
+            try:
+                audio = self.engine.synthesize(sentence, self.language)
+            except Exception as e:
+                self.errors.append(e)
+                continue
+            self._audio_queue.put(audio)
+        if not self._stopped.is_set():
+            self._audio_queue.put(_DONE)
+
+    def _play_loop(self):
+        while not self._stopped.is_set():
+            audio = self._audio_queue.get()
+            if audio is _DONE:
+                break
+            try:
+                self.player.play(audio, self.engine.audio_format)
+            except Exception as e:
+                self.errors.append(e)
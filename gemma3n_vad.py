@@ -0,0 +1,304 @@
+"""
+Gemma 3n Voice Activity Detection
+Continuous audio capture with energy-based VAD and endpointing of utterances
+"""
+
+import io
+import queue
+import threading
+import time
+import wave
+from collections import deque
+from typing import Iterator, Optional
+
+import numpy as np
+
+DEFAULT_SAMPLE_RATE = 16000
+DEFAULT_FRAME_MS = 30
+
+class AudioSource:
+    """Produces fixed-size frames of 16-bit mono PCM; an empty frame means end of input"""
+
+    sample_rate = DEFAULT_SAMPLE_RATE
+    frame_ms = DEFAULT_FRAME_MS
+
+    @property
+    def frame_samples(self) -> int:
+        return int(self.sample_rate * self.frame_ms / 1000)
+
+    def read_frame(self) -> bytes:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class MicrophoneSource(AudioSource):
+    """Default input device through PyAudio"""
+
+    def __init__(self, sample_rate: int = DEFAULT_SAMPLE_RATE, frame_ms: int = DEFAULT_FRAME_MS,
+                 device_index: Optional[int] = None):
+        import pyaudio
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(format=pyaudio.paInt16, channels=1, rate=sample_rate, input=True,
+                                        frames_per_buffer=self.frame_samples, input_device_index=device_index)
+
+    def read_frame(self) -> bytes:
+        # Dropping samples on overflow is better than stalling the capture thread
+        return self._stream.read(self.frame_samples, exception_on_overflow=False)
+
+    def close(self):
+        self._stream.stop_stream()
+        self._stream.close()
+        self._audio.terminate()
+
+class WavFileSource(AudioSource):
+    """Frames from a 16-bit WAV file; stereo is mixed down. realtime=True paces reads like a microphone"""
+
+    def __init__(self, path: str, frame_ms: int = DEFAULT_FRAME_MS, realtime: bool = False):
+        self._wav = wave.open(str(path), "rb")
+        if self._wav.getsampwidth() != 2:
+            raise ValueError("Only 16-bit PCM WAV files are supported")
+        self.sample_rate = self._wav.getframerate()
+        self.channels = self._wav.getnchannels()
+        self.frame_ms = frame_ms
+        self.realtime = realtime
+
+    def read_frame(self) -> bytes:
+        data = self._wav.readframes(self.frame_samples)
+        if self.channels > 1 and data:
+            samples = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+            data = samples.mean(axis=1).astype(np.int16).tobytes()
+        if self.realtime and data:
+            time.sleep(self.frame_ms / 1000)
+        return data
+
+    def close(self):
+        self._wav.close()
+
+def frame_rms(frame: bytes) -> float:
+    samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+    return float(np.sqrt(np.mean(samples * samples))) if len(samples) else 0.0
+
+class EnergyVAD:
+    """Speech when frame energy is well above an adaptive noise floor.
+
+    The floor is calibrated once from the first calibration_ms of audio and then
+    follows slow changes in background noise, updated only on non-speech frames.
+    """
+
+    def __init__(self, threshold_ratio: float = 3.0, calibration_ms: int = 500,
+                 adapt_rate: float = 0.05, min_energy: float = 100.0):
+        self.threshold_ratio = threshold_ratio
+        self.calibration_ms = calibration_ms
+        self.adapt_rate = adapt_rate
+        self.min_energy = min_energy
+        self.noise_floor: Optional[float] = None
+        self._calibration = []
+        self._calibrated_ms = 0
+
+    @property
+    def calibrated(self) -> bool:
+        return self.noise_floor is not None
+
+    @property
+    def threshold(self) -> float:
+        return max(self.min_energy, (self.noise_floor or 0.0) * self.threshold_ratio)
+
+    def is_speech(self, frame: bytes, frame_ms: int) -> bool:
+        energy = frame_rms(frame)
+        if not self.calibrated:
+            self._calibration.append(energy)
+            self._calibrated_ms += frame_ms
+            if self._calibrated_ms >= self.calibration_ms:
+                # The median ignores a cough or click during calibration
+                self.noise_floor = float(np.median(self._calibration))
+                self._calibration = []
+            return False
+
+        speech = energy > self.threshold
+        if not speech:
+            self.noise_floor += self.adapt_rate * (energy - self.noise_floor)
+        return speech
+
+class Utterance:
+    """One endpointed stretch of speech as 16-bit mono PCM"""
+
+    def __init__(self, pcm: bytes, sample_rate: int, started_at: float):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.started_at = started_at
+        self.ended_at = time.time()
+
+    @property
+    def duration(self) -> float:
+        return len(self.pcm) / 2 / self.sample_rate
+
+    def to_wav(self) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(self.pcm)
+        return buffer.getvalue()
+
+_END = object()
+
+class SpeechCapture:
+    """Reads an audio source on a background thread and queues utterances as they end.
+
+    A ring buffer keeps the last pre_roll_ms of audio so the start of a word that
+    precedes VAD triggering is not clipped. An utterance ends after silence_ms of
+    non-speech, or at max_utterance_s; bursts shorter than min_speech_ms are dropped.
+    """
+
+    def __init__(self, source: AudioSource, vad: Optional[EnergyVAD] = None, pre_roll_ms: int = 300,
+                 silence_ms: int = 600, min_speech_ms: int = 250, max_utterance_s: float = 15):
+        self.source = source
+        self.vad = vad or EnergyVAD()
+        frame_ms = source.frame_ms
+        self.silence_frames = max(1, silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.max_frames = int(max_utterance_s * 1000 / frame_ms)
+        self._ring = deque(maxlen=max(1, pre_roll_ms // frame_ms))
+        self._utterances = queue.Queue()
+        self._stopped = threading.Event()
+        # Queue handed to the capture thread by stream_utterance for the next utterance
+        self._live_request: Optional[queue.Queue] = None
+        self._live_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.speaking = False
+        self.errors = []
+
+    def start(self) -> "SpeechCapture":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=1)
+        self.source.close()
+
+    def get_utterance(self, timeout: Optional[float] = None) -> Optional[Utterance]:
+        """Next complete utterance, or None on timeout or once the source has ended"""
+        try:
+            item = self._utterances.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if item is _END:
+            # Keep the marker for any other consumer
+            self._utterances.put(_END)
+            return None
+        return item
+
+    def discard_pending(self) -> int:
+        """Drop utterances nobody consumed, such as speech captured during playback"""
+        dropped = 0
+        try:
+            while True:
+                item = self._utterances.get_nowait()
+                if item is _END:
+                    self._utterances.put(_END)
+                    break
+                dropped += 1
+        except queue.Empty:
+            pass
+        return dropped
+
+    def utterances(self) -> Iterator[Utterance]:
+        """Yield utterances until the source ends or capture is stopped"""
+        while True:
+            utterance = self.get_utterance()
+            if utterance is None:
+                return
+            yield utterance
+
+    def stream_utterance(self, timeout: Optional[float] = None) -> Iterator[bytes]:
+        """Yield the frames of the next utterance while it is being spoken.
+
+        Starts with the pre-roll and ends at the utterance's endpoint, so a
+        recognizer can decode incrementally. Yields nothing if no speech starts
+        within timeout. The utterance is still queued for get_utterance as well.
+        """
+        live = queue.Queue()
+        with self._live_lock:
+            self._live_request = live
+        try:
+            frame = live.get(timeout=timeout)
+        except queue.Empty:
+            with self._live_lock:
+                if self._live_request is live:
+                    self._live_request = None
+                    return
+            # The capture thread took the request just as the timeout expired
+            frame = live.get()
+        while frame is not _END:
+            yield frame
+            frame = live.get()
+
+    def _capture_loop(self):
+        live = None
+        frames = []
+        speech_frames = 0
+        silent_frames = 0
+        started_at = 0.0
+        frame_ms = self.source.frame_ms
+        try:
+            while not self._stopped.is_set():
+                frame = self.source.read_frame()
+                if not frame:
+                    break
+                speech = self.vad.is_speech(frame, frame_ms)
+
+                if not self.speaking:
+                    self._ring.append(frame)
+                    if speech:
+                        self.speaking = True
+                        started_at = time.time() - len(self._ring) * frame_ms / 1000
+                        frames = list(self._ring)
+                        self._ring.clear()
+                        speech_frames, silent_frames = 1, 0
+                        with self._live_lock:
+                            live, self._live_request = self._live_request, None
+                        if live is not None:
+                            for buffered in frames:
+                                live.put(buffered)
+                    continue
+
+                frames.append(frame)
+                if live is not None:
+                    live.put(frame)
+                if speech:
+                    speech_frames += 1
+                    silent_frames = 0
+                else:
+                    silent_frames += 1
+
+                if silent_frames >= self.silence_frames or len(frames) >= self.max_frames:
+                    self._emit(frames, speech_frames, silent_frames, started_at)
+                    frames = []
+                    self.speaking = False
+                    if live is not None:
+                        live.put(_END)
+                        live = None
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            if self.speaking:
+                self._emit(frames, speech_frames, 0, started_at)
+                self.speaking = False
+            with self._live_lock:
+                pending, self._live_request = self._live_request, None
+            for waiting in (live, pending):
+                if waiting is not None:
+                    waiting.put(_END)
+            self._utterances.put(_END)
+
+    def _emit(self, frames, speech_frames: int, silent_frames: int, started_at: float):
+        if speech_frames < self.min_speech_frames:
+            return
+        # Trailing silence beyond a short tail only delays recognition
+        keep = len(frames) - max(0, silent_frames - 3)
+        self._utterances.put(Utterance(b"".join(frames[:keep]), self.source.sample_rate, started_at))
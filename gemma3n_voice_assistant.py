@@ -2,17 +2,14 @@
 import streamlit as st
 import requests
 import speech_recognition as sr
-from gtts import gTTS
 import pygame
-import tempfile
-import io
-import json
-import threading
-import queue
-import numpy as np
-from pydub import AudioSegment
-import base64
+import itertools
 import time
+from gemma3n_conversation import ChatSession, format_stats
+from gemma3n_metrics import render_streamlit_panel
+from gemma3n_tts import TTS_ENGINES, SpeechPipeline, create_engine
+from gemma3n_vad import MicrophoneSource, SpeechCapture
+from gemma3n_stt import STT_ENGINES, STTError, create_engine as create_stt_engine
 
 # Voice Assistant powered by Gemma 3n
 st.set_page_config(
@@ -26,10 +23,27 @@ pygame.mixer.init()
 
 # Sidebar configuration
 st.sidebar.title("Voice Assistant Settings")
-ollama_url = st.sidebar.text_input("Ollama URL", "http://localhost:11434")
+ollama_url = st.sidebar.text_input("Ollama URL", "http://localhost:11434",
+                                   help="Comma-separate several servers to balance requests across them")
 model_name = st.sidebar.selectbox("Gemma 3n Model", ["gemma3n:e4b", "gemma3n:e2b"])
 voice_language = st.sidebar.selectbox("Voice Language", ["en", "es", "fr", "de", "it"])
 voice_enabled = st.sidebar.checkbox("Enable Voice Responses", True)
+tts_engine_name = st.sidebar.selectbox(
+    "Speech Engine", list(TTS_ENGINES.keys()),
+    help="gtts needs internet access; espeak runs offline"
+)
+stt_engine_name = st.sidebar.selectbox(
+    "Speech Recognition", list(STT_ENGINES.keys()),
+    help="google needs internet access; vosk and whisper run offline (see VOSK_MODEL_PATH / WHISPER_MODEL)"
+)
+continuous_listening = st.sidebar.checkbox(
+    "Continuous listening", False,
+    help="Keep the microphone open and hand off each utterance as soon as you stop speaking"
+)
+history_tokens = st.sidebar.number_input(
+    "History budget (tokens)", min_value=200, max_value=8000, value=1500, step=100,
+    help="Older turns are dropped in one step once the conversation exceeds this budget"
+)
 
 st.title("🎤 Gemma 3n Voice Assistant")
 st.markdown("Talk to your AI assistant using voice commands!")
@@ -39,81 +53,155 @@ if "conversation_history" not in st.session_state:
     st.session_state.conversation_history = []
 if "is_listening" not in st.session_state:
     st.session_state.is_listening = False
+if "noise_calibrated" not in st.session_state:
+    st.session_state.noise_calibrated = False
 
 # Voice recognition setup
 recognizer = sr.Recognizer()
+recognizer.dynamic_energy_threshold = True
 microphone = sr.Microphone()
 
+@st.cache_resource
+def get_stt_engine(name):
+    """Load a speech recognition engine once per process; offline models are large"""
+    return create_stt_engine(name)
+
+def get_speech_capture():
+    """Background capture shared across reruns; the noise floor is calibrated once when it starts"""
+    if "speech_capture" not in st.session_state:
+        st.session_state.speech_capture = SpeechCapture(MicrophoneSource()).start()
+    return st.session_state.speech_capture
+
+def stop_speech_capture():
+    capture = st.session_state.pop("speech_capture", None)
+    if capture is not None:
+        capture.stop()
+
 def listen_for_speech():
     """Listen for speech input and return text"""
     try:
-        with microphone as source:
-            # Adjust for ambient noise
-            recognizer.adjust_for_ambient_noise(source, duration=1)
+        engine = get_stt_engine(stt_engine_name)
+        if continuous_listening:
             st.info("🎤 Listening... Speak now!")
+            capture = get_speech_capture()
+            # Anything heard before the button press (including our own replies) is stale
+            capture.discard_pending()
+            frames = capture.stream_utterance(timeout=10)
+            first_frame = next(frames, None)
+            if first_frame is None:
+                raise sr.WaitTimeoutError()
+
+            # Decode while the user is still speaking and show partial transcripts
+            partial = st.empty()
+            text = ""
+            for result in engine.stream(itertools.chain([first_frame], frames)):
+                text = result["text"]
+                if not result["final"] and text:
+                    partial.markdown(f"🗣️ *{text}…*")
+            partial.empty()
+        else:
+            with microphone as source:
+                # Calibrate once per session; the energy threshold adapts on its own afterwards
+                if not st.session_state.noise_calibrated:
+                    recognizer.adjust_for_ambient_noise(source, duration=1)
+                    st.session_state.noise_calibrated = True
+                st.info("🎤 Listening... Speak now!")
+
+                # Listen for audio
+                audio = recognizer.listen(source, timeout=10, phrase_time_limit=15)
 
-            # Listen for audio
-            audio = recognizer.listen(source, timeout=10, phrase_time_limit=15)
+            # Convert speech to text
+            text = engine.transcribe(audio.get_raw_data(convert_rate=engine.sample_rate, convert_width=2))
 
-        # Convert speech to text
-        text = recognizer.recognize_google(audio)
+        if not text:
+            raise sr.UnknownValueError()
         return text
     except sr.WaitTimeoutError:
         return "⏰ Listening timeout - no speech detected"
     except sr.UnknownValueError:
         return "❌ Could not understand audio"
-    except sr.RequestError as e:
+    except (sr.RequestError, STTError) as e:
         return f"❌ Error with speech recognition service: {e}"
-
-def call_gemma3n_api(prompt, conversation_history):
-    """Call Gemma 3n via Ollama with conversation context"""
-    # Build conversation context
-    context = "You are a helpful voice assistant. Keep responses conversational and concise.\n\n"
-    for msg in conversation_history[-5:]:  # Last 5 messages for context
-        context += f"Human: {msg['user']}\nAssistant: {msg['assistant']}\n\n"
-
-    full_prompt = context + f"Human: {prompt}\nAssistant:"
-
-    payload = {
-        "model": model_name,
-        "prompt": full_prompt,
-        "stream": False,
-        "options": {
-            "temperature": 0.7,
-            "max_tokens": 200
-        }
-    }
-
+    except ImportError as e:
+        return f"❌ Speech recognition engine is not installed: {e}"
+
+# The microphone can only be opened once, so release it when continuous mode is switched off
+if not continuous_listening:
+    stop_speech_capture()
+
+VOICE_SYSTEM_PROMPT = "You are a helpful voice assistant. Keep responses conversational and concise."
+
+VOICE_OPTIONS = {
+    "temperature": 0.7,
+    "num_predict": 200
+}
+
+# Conversation sent as chat messages so Ollama can reuse the cached history prefix
+if "chat_session" not in st.session_state:
+    st.session_state.chat_session = ChatSession(ollama_url, model_name, VOICE_SYSTEM_PROMPT,
+                                                max_history_tokens=history_tokens, options=VOICE_OPTIONS)
+st.session_state.chat_session.ollama_url = ollama_url
+st.session_state.chat_session.model = model_name
+st.session_state.chat_session.max_history_tokens = history_tokens
+
+def stream_gemma3n_api(prompt):
+    """Stream Gemma 3n's reply token by token"""
     try:
-        response = requests.post(f"{ollama_url}/api/generate", json=payload)
-        response.raise_for_status()
-        return response.json().get("response", "Sorry, I couldn't generate a response.")
+        yield from st.session_state.chat_session.stream(prompt)
     except requests.exceptions.RequestException as e:
-        return f"Error calling Gemma 3n: {str(e)}"
+        yield f"Error calling Gemma 3n: {str(e)}"
 
-def text_to_speech(text, language="en"):
-    """Convert text to speech and play it"""
+def show_turn_stats():
+    """Show how much of the prompt Ollama had to evaluate for the last reply"""
+    stats = st.session_state.chat_session.last_stats
+    if stats:
+        st.caption(f"⏱️ {format_stats(stats)}")
+
+def start_speech_pipeline(language="en"):
+    """Create a speech pipeline for one reply, or None when voice is disabled"""
+    stop_speech()
     if not voice_enabled:
-        return
+        return None
 
     try:
-        # Create TTS object
-        tts = gTTS(text=text, lang=language, slow=False)
-
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-            tts.save(tmp_file.name)
+        pipeline = SpeechPipeline(create_engine(tts_engine_name), language)
+    except Exception as e:
+        st.error(f"Error with text-to-speech: {str(e)}")
+        return None
+    # Kept across reruns so the Stop button can reach the worker threads
+    st.session_state.speech_pipeline = pipeline
+    return pipeline
+
+def stop_speech():
+    """Abandon the queued sentences of the reply being spoken and stop playback"""
+    pipeline = st.session_state.pop("speech_pipeline", None)
+    if pipeline is not None:
+        pipeline.stop()
+    pygame.mixer.music.stop()
+
+def speak_while_streaming(chunks, pipeline):
+    """Pass streamed chunks through, speaking each sentence as soon as it is complete"""
+    for chunk in chunks:
+        if pipeline:
+            pipeline.feed(chunk)
+        yield chunk
+
+    if pipeline:
+        pipeline.finish()
+
+def finish_speech(pipeline):
+    """Wait for queued sentences to finish playing"""
+    if pipeline is None:
+        return
 
-            # Play the audio
-            pygame.mixer.music.load(tmp_file.name)
-            pygame.mixer.music.play()
+    with st.spinner("Speaking..."):
+        pipeline.wait()
 
-            # Wait for playback to finish
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)
+    if st.session_state.get("speech_pipeline") is pipeline:
+        del st.session_state.speech_pipeline
 
-    except Exception as e:
-        st.error(f"Error with text-to-speech: {str(e)}")
+    if pipeline.errors:
+        st.error(f"Error with text-to-speech: {str(pipeline.errors[0])}")
 
 # Control buttons
 col1, col2, col3 = st.columns(3)
@@ -132,9 +220,11 @@ with col1:
             # Display user input
             st.success(f"You said: {user_input}")
 
-            # Get AI response
-            with st.spinner("Thinking..."):
-                ai_response = call_gemma3n_api(user_input, st.session_state.conversation_history)
+            # Get AI response, displayed and spoken as it streams in
+            st.markdown("**Assistant:**")
+            speech = start_speech_pipeline(voice_language)
+            ai_response = st.write_stream(speak_while_streaming(stream_gemma3n_api(user_input), speech))
+            show_turn_stats()
 
             # Add to conversation history
             st.session_state.conversation_history.append({
@@ -143,31 +233,30 @@ with col1:
                 "timestamp": time.time()
             })
 
-            # Display AI response
-            st.info(f"Assistant: {ai_response}")
-
-            # Convert to speech
-            if voice_enabled:
-                with st.spinner("Speaking..."):
-                    text_to_speech(ai_response, voice_language)
+            finish_speech(speech)
         else:
             st.warning(user_input)
 
 with col2:
     if st.button("🔇 Stop Voice"):
-        pygame.mixer.music.stop()
+        stop_speech()
 
 with col3:
     if st.button("🗑️ Clear History"):
         st.session_state.conversation_history = []
+        st.session_state.chat_session.reset()
 
 # Manual text input as fallback
 st.subheader("💬 Or type your message:")
 manual_input = st.text_input("Type your message here:")
 if st.button("Send Text") and manual_input:
-    # Get AI response
-    with st.spinner("Processing..."):
-        ai_response = call_gemma3n_api(manual_input, st.session_state.conversation_history)
+    st.success(f"You: {manual_input}")
+
+    # Get AI response, displayed and spoken as it streams in
+    st.markdown("**Assistant:**")
+    speech = start_speech_pipeline(voice_language)
+    ai_response = st.write_stream(speak_while_streaming(stream_gemma3n_api(manual_input), speech))
+    show_turn_stats()
 
     # Add to conversation history
     st.session_state.conversation_history.append({
@@ -176,13 +265,7 @@ if st.button("Send Text") and manual_input:
         "timestamp": time.time()
     })
 
-    # Display response
-    st.success(f"You: {manual_input}")
-    st.info(f"Assistant: {ai_response}")
-
-    # Convert to speech
-    if voice_enabled:
-        text_to_speech(ai_response, voice_language)
+    finish_speech(speech)
 
 # Display conversation history
 if st.session_state.conversation_history:
@@ -199,6 +282,13 @@ with st.expander("📦 Installation Requirements"):
 # Install required packages
 pip install streamlit speechrecognition gtts pygame pydub pyaudio
 
+# Optional offline speech engine:
+# - espeak-ng (apt install espeak-ng / brew install espeak-ng)
+
+# Optional offline speech recognition:
+pip install vosk            # plus a model from https://alphacephei.com/vosk/models (VOSK_MODEL_PATH)
+pip install faster-whisper  # WHISPER_MODEL=base by default
+
 # Additional system requirements:
 # - Ollama with Gemma 3n model installed
 # - Microphone access
@@ -208,12 +298,16 @@ pip install streamlit speechrecognition gtts pygame pydub pyaudio
 streamlit run gemma3n_voice_assistant.py
     """)
 
+# Latency and throughput of the requests made so far
+render_streamlit_panel(st.sidebar)
+
 # Usage tips
 with st.expander("💡 Usage Tips"):
     st.markdown("""
     - **Clear Speech**: Speak clearly and avoid background noise
-    - **Internet Required**: Speech recognition and TTS require internet
+    - **Continuous Listening**: Keeps the microphone open so each reply starts as soon as you stop speaking
+    - **Internet Required**: Google speech recognition and gTTS require internet; pick vosk or whisper and espeak to run fully offline
     - **Model Setup**: Make sure Ollama is running with Gemma 3n loaded
     - **Microphone**: Grant microphone permissions when prompted
-    - **Conversation Context**: The assistant remembers recent conversation
+    - **Conversation Context**: The assistant remembers recent conversation, up to the history budget in the sidebar
     """)
@@ -0,0 +1,103 @@
+import asyncio
+
+from gemma3n_chunking import (chunk_diff, chunk_python_source, estimate_tokens, pack_for_reduce,
+                              tree_reduce, tree_reduce_async)
+
+def make_method(name: str, lines: int = 12) -> str:
+    body = "".join(f"        total += {i} * value\n" for i in range(lines))
+    return f"    def {name}(self, value):\n        total = 0\n{body}        return total\n\n"
+
+def test_oversized_class_is_split_per_method_with_header():
+    source = "import os\n\n\nclass Big:\n    \"\"\"A large class\"\"\"\n\n" + "".join(
+        make_method(f"method_{i}") for i in range(6))
+    max_tokens = estimate_tokens(source) // 3
+    chunks = chunk_python_source(source, max_tokens)
+
+    method_chunks = [c for c in chunks if c["name"].startswith("Big.method_")]
+    assert [c["name"] for c in method_chunks] == [f"Big.method_{i}" for i in range(6)]
+    for chunk in method_chunks:
+        assert chunk["text"].startswith("class Big:\n")
+        assert estimate_tokens(chunk["text"]) <= max_tokens
+    # Line numbers point at the method in the original source
+    lines = source.splitlines()
+    first = method_chunks[0]
+    assert lines[first["start_line"] - 1].strip().startswith("def method_0")
+
+def make_hunk(start: int, lines: int = 20) -> str:
+    body = "".join(f"+added line {start + i} with some content\n" for i in range(lines))
+    return f"@@ -{start},0 +{start},{lines} @@\n{body}"
+
+def test_large_file_diff_is_split_per_hunk_repeating_the_header():
+    header = "diff --git a/app.py b/app.py\nindex 111..222 100644\n--- a/app.py\n+++ b/app.py\n"
+    diff = header + "".join(make_hunk(start) for start in (1, 100, 200))
+    max_tokens = estimate_tokens(header + make_hunk(1)) + 10
+    chunks = chunk_diff(diff, max_tokens)
+
+    assert len(chunks) == 3
+    for chunk in chunks:
+        assert chunk["text"].startswith(header)
+        assert chunk["name"] == "app.py"
+        assert chunk["text"].count("@@ -") == 1
+
+def test_small_file_diffs_are_packed_together():
+    diffs = [f"diff --git a/f{i}.py b/f{i}.py\n--- a/f{i}.py\n+++ b/f{i}.py\n" + make_hunk(1, 2) for i in range(3)]
+    chunks = chunk_diff("".join(diffs), estimate_tokens(diffs[0]) * 2 + 5)
+
+    assert [c["name"] for c in chunks] == ["f0.py, f1.py", "f2.py"]
+
+def test_pack_for_reduce_respects_the_budget():
+    texts = ["x" * 35] * 6  # 11 tokens each
+    assert pack_for_reduce(texts, 25) == [[0, 1], [2, 3], [4, 5]]
+    assert pack_for_reduce(texts, 40) == [[0, 1, 2], [3, 4, 5]]
+    assert pack_for_reduce(texts, 1000) == [list(range(6))]
+
+def test_pack_for_reduce_pairs_oversized_items():
+    texts = ["x" * 350] * 5  # 101 tokens each, over the budget alone
+    groups = pack_for_reduce(texts, 25)
+    assert groups == [[0, 1], [2, 3], [4]]
+    # Every level must shrink the list, or a reduction would never finish
+    assert len(groups) < len(texts)
+
+def test_tree_reduce_merges_in_order():
+    calls = []
+
+    def reduce_group(group, is_final):
+        calls.append(is_final)
+        return "(" + "+".join(text for _, text in group) + ")"
+
+    items = [(i, "x" * 35 + str(i)) for i in range(4)]
+    result = tree_reduce(items, reduce_group, max_tokens=25, workers=2)
+
+    assert result.index("0") < result.index("1") < result.index("2") < result.index("3")
+    assert calls.count(True) == 1 and calls[-1] is True
+
+def test_tree_reduce_stops_on_a_failed_merge():
+    attempts = []
+
+    def reduce_group(group, is_final):
+        texts = [text for _, text in group]
+        if "bad" in texts:
+            attempts.append(texts)
+            return "Error: model timed out"
+        return "merged"
+
+    items = [(0, "good"), (1, "bad"), (2, "good"), (3, "good")]
+    result = tree_reduce(items, reduce_group, max_tokens=2)
+
+    assert result == "Error: model timed out"
+    # One retry, then the error is returned instead of being merged as a summary
+    assert len(attempts) == 2
+
+def test_tree_reduce_keeps_answers_that_merely_start_with_error():
+    def reduce_group(group, is_final):
+        return "Error handling looks fine" if not is_final else " | ".join(text for _, text in group)
+
+    items = [(i, "part") for i in range(4)]
+    assert tree_reduce(items, reduce_group, max_tokens=2) == "Error handling looks fine | Error handling looks fine"
+
+def test_tree_reduce_async_stops_on_a_failed_merge():
+    async def reduce_group(group, is_final):
+        return "Error: boom" if any(text == "bad" for _, text in group) else "merged"
+
+    items = [(0, "bad"), (1, "good"), (2, "good"), (3, "good")]
+    assert asyncio.run(tree_reduce_async(items, reduce_group, max_tokens=2)) == "Error: boom"
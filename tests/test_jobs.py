@@ -0,0 +1,47 @@
+from gemma3n_jobs import STALE_AFTER, JobQueue
+
+def make_stale(queue: JobQueue, job_id: str):
+    """Pretend the owning worker stopped heartbeating long ago"""
+    with queue._lock:
+        queue._conn.execute("UPDATE jobs SET heartbeat = heartbeat - ? WHERE id = ?", (STALE_AFTER + 1, job_id))
+        queue._conn.commit()
+
+def page(number: int, analysis: str = "ok") -> dict:
+    return {"page": number, "analysis": analysis, "route": "text"}
+
+def test_stalled_worker_loses_a_reclaimed_job(tmp_path):
+    queue = JobQueue(tmp_path)
+    job_id = queue.submit("doc.pdf", b"%PDF", "summary", {})
+
+    first = queue.claim_next()
+    assert first["id"] == job_id
+    assert queue.claim_next() is None
+
+    make_stale(queue, job_id)
+    second = queue.claim_next()
+    assert second["id"] == job_id and second["claim"] != first["claim"]
+
+    # The stalled worker resumes: it must notice and write nothing
+    assert queue.heartbeat(job_id, first["claim"]) == "reclaimed"
+    assert queue.record_page(job_id, first["claim"], page(1, "stale")) is False
+    queue.finish(job_id, first["claim"], "Error: stale worker")
+    assert queue.get(job_id)["status"] == "running"
+
+    assert queue.heartbeat(job_id, second["claim"]) == "running"
+    assert queue.record_page(job_id, second["claim"], page(1))
+    queue.finish(job_id, second["claim"])
+
+    job = queue.get(job_id)
+    assert job["status"] == "done" and job["done_pages"] == 1
+    assert [r["analysis"] for r in queue.results(job_id)] == ["ok"]
+    queue.close()
+
+def test_cancelled_job_stops_its_worker(tmp_path):
+    queue = JobQueue(tmp_path)
+    job_id = queue.submit("doc.pdf", b"%PDF", "summary", {})
+    job = queue.claim_next()
+
+    queue.cancel(job_id)
+    assert queue.heartbeat(job_id, job["claim"]) == "cancelled"
+    assert queue.record_page(job_id, job["claim"], page(1)) is False
+    queue.close()
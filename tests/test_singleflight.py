@@ -0,0 +1,132 @@
+import threading
+
+import pytest
+
+from gemma3n_singleflight import SingleFlight
+
+class Upstream:
+    """A stream the test feeds one chunk at a time, recording whether it was closed"""
+
+    def __init__(self):
+        self.chunks = []
+        self.ready = threading.Semaphore(0)
+        self.closed = threading.Event()
+        self.opened = 0
+
+    def push(self, chunk):
+        self.chunks.append(chunk)
+        self.ready.release()
+
+    def open(self):
+        self.opened += 1
+        return self._read()
+
+    def _read(self):
+        try:
+            index = 0
+            while True:
+                assert self.ready.acquire(timeout=5)
+                chunk = self.chunks[index]
+                index += 1
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            self.closed.set()
+
+def test_do_shares_the_error_with_every_waiter():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        assert release.wait(5)
+        raise RuntimeError("model crashed")
+
+    def call():
+        try:
+            flight.do("key", fail)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=call) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.stats["coalesced"] < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert len(errors) == 4
+    assert flight.stats == {"calls": 1, "coalesced": 3}
+
+def test_late_joiner_replays_the_stream_from_the_start():
+    flight = SingleFlight()
+    upstream = Upstream()
+    first, joined = flight.stream("key", upstream.open)
+    assert not joined
+    upstream.push("a")
+    upstream.push("b")
+    assert [next(first), next(first)] == ["a", "b"]
+
+    late, joined = flight.stream("key", upstream.open)
+    assert joined
+    upstream.push("c")
+    upstream.push(None)
+    assert list(first) == ["c"]
+    assert list(late) == ["a", "b", "c"]
+    assert upstream.opened == 1
+
+def test_stream_error_reaches_every_subscriber():
+    flight = SingleFlight()
+    upstream = Upstream()
+    first, _ = flight.stream("key", upstream.open)
+    second, _ = flight.stream("key", upstream.open)
+    upstream.push("a")
+    upstream.push(RuntimeError("connection reset"))
+
+    for chunks in (first, second):
+        assert next(chunks) == "a"
+        with pytest.raises(RuntimeError):
+            next(chunks)
+
+def test_upstream_closes_once_every_subscriber_stops():
+    flight = SingleFlight()
+    upstream = Upstream()
+    first, _ = flight.stream("key", upstream.open)
+    second, _ = flight.stream("key", upstream.open)
+    upstream.push("a")
+    assert next(first) == "a" and next(second) == "a"
+
+    first.close()
+    upstream.push("b")
+    assert next(second) == "b"
+    assert not upstream.closed.is_set()
+
+    second.close()
+    upstream.push("c")
+    assert upstream.closed.wait(5)
+
+    # The abandoned stream is not joined again
+    _, joined = flight.stream("key", Upstream().open)
+    assert not joined
+
+def test_never_iterated_subscriber_does_not_hold_the_stream_open():
+    flight = SingleFlight()
+    upstream = Upstream()
+    reader, _ = flight.stream("key", upstream.open)
+    idle, _ = flight.stream("key", upstream.open)
+    del idle
+
+    upstream.push("a")
+    assert next(reader) == "a"
+    reader.close()
+    upstream.push("b")
+    assert upstream.closed.wait(5)